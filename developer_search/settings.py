@@ -49,16 +49,18 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "search.middleware.StaticFilesMiddleware",
+    'search.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'search.middleware.TimedSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'htmlmin.middleware.HtmlMinifyMiddleware',
-    'htmlmin.middleware.MarkRequestMiddleware',
+    'search.middleware.PageCacheMiddleware',
+    'search.middleware.TimedHtmlMinifyMiddleware',
+    'search.middleware.MarkRequestMiddleware',
 ]
 
 ROOT_URLCONF = 'developer_search.urls'
@@ -82,6 +84,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'developer_search.wsgi.application'
 
+# Serve searches with the async view, for ASGI servers such as uvicorn
+ASYNC_SEARCH = config("ASYNC_SEARCH", default=False, cast=bool)
+
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
@@ -133,6 +138,7 @@ USE_TZ = True
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 STATIC_URL = '/static/'
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "static"),
 ]
@@ -141,8 +147,22 @@ STATICFILES_DIRS = [
 HTML_MINIFY = True
 
 
-# Activate Django heroku
-django_heroku.settings(locals())
+# Cache of SerpAPI responses: in-process by default, set CACHE_BACKEND and
+# CACHE_LOCATION for a file-based or Redis cache shared by every worker
+CACHES = {
+    'default': {
+        'BACKEND': config(
+            "CACHE_BACKEND",
+            default="django.core.cache.backends.locmem.LocMemCache"),
+        'LOCATION': config("CACHE_LOCATION", default="devxplore"),
+    }
+}
+
+
+# Activate Django heroku; static files are set up above, as its staticfiles
+# option prepends the sync-only WhiteNoiseMiddleware to MIDDLEWARE (see
+# search.middleware.StaticFilesMiddleware)
+django_heroku.settings(locals(), staticfiles=False)
 
 # For forcing HTTPS
 
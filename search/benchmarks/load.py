@@ -0,0 +1,254 @@
+"""End-to-end load test of the search page.
+
+Drives views.index over HTTP the way users do, with SerpAPI replaced by the
+local stand-in (see standin.py), to size worker counts and check caching and
+concurrency changes without spending quota:
+- The app runs under gunicorn (threaded WSGI workers) or, with asgi, under
+  uvicorn workers with ASYNC_SEARCH, pointed at the stand-in through
+  SERPAPI_SEARCH_URL. Either one can be a server already running instead
+- Queries follow a Zipf-like mix over a fixed set of distinct queries, mostly
+  on the first page, so the response cache sees both hits and misses
+- Pages are classified by what they show: results, no results, the search
+  limit, or the error page
+
+Reports requests per second, p50/p90/p99/max latency and the share of each
+outcome.
+"""
+
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import requests
+from django.conf import settings
+
+from .standin import SerpApiStandin
+
+# Default number of requests sent
+DEFAULT_REQUESTS = 500
+
+# Default requests in flight at once
+DEFAULT_CONCURRENCY = 32
+
+# Default worker processes of the app server
+DEFAULT_WORKERS = 2
+
+# Default threads per gunicorn worker
+DEFAULT_THREADS = 8
+
+# Default number of distinct queries searched
+DEFAULT_DISTINCT_QUERIES = 100
+
+# Share of requests for a page after the first one
+NEXT_PAGE_SHARE = 0.2
+
+# Seconds the app server may take to start answering
+STARTUP_TIMEOUT = 30
+
+# Seconds a request may take before counting as an error
+REQUEST_TIMEOUT = 30
+
+# Marker of a search result in the page
+RESULT_MARKER = 'class="card search-card"'
+
+# Markers of why a page shows no results, checked in order (every empty tab
+# shows one, so they only count on pages without results)
+OUTCOME_MARKERS = (
+    ("error", "empty-state error-state"),
+    ("limit_reached", "empty-state limit-state"),
+    ("no_results", "empty-state no-results"),
+)
+
+QUERY_WORDS = ("django", "python", "orm", "queryset", "async", "react",
+               "hooks", "docker", "compose", "rust", "borrow", "checker",
+               "postgres", "index", "regex", "tutorial", "css", "grid")
+
+
+def query_mix(distinct, seed=0):
+    """Returns distinct queries and their Zipf-like weights."""
+    rng = random.Random(seed)
+    queries = [" ".join(rng.sample(QUERY_WORDS, rng.randint(1, 3)))
+               + f" {index}" for index in range(distinct)]
+    weights = [1 / rank for rank in range(1, distinct + 1)]
+    return queries, weights
+
+
+def outcome(response):
+    """Classifies a response of the search page."""
+    if response.status_code != 200:
+        return f"http_{response.status_code}"
+    if RESULT_MARKER in response.text:
+        return "ok"
+    for name, marker in OUTCOME_MARKERS:
+        if marker in response.text:
+            return name
+    return "empty"
+
+
+def percentile(timings, percent):
+    """Returns the percent-th percentile of sorted timings."""
+    index = min(int(len(timings) * percent / 100), len(timings) - 1)
+    return timings[index]
+
+
+def summarize(outcomes, timings, elapsed):
+    """Returns the throughput, latency and outcome mix of a run."""
+    timings = sorted(timings)
+    return {
+        "requests": len(timings),
+        "requests_per_sec": len(timings) / elapsed if elapsed else 0.0,
+        "p50_ms": statistics.median(timings) * 1000,
+        "p90_ms": percentile(timings, 90) * 1000,
+        "p99_ms": percentile(timings, 99) * 1000,
+        "max_ms": timings[-1] * 1000,
+        "outcomes": {name: count / len(timings)
+                     for name, count in sorted(outcomes.items())},
+    }
+
+
+def drive(app_url, requests_count, concurrency, distinct, seed=0):
+    """Sends searches to the app and measures them.
+
+    Args:
+        app_url: Base URL of the app.
+        requests_count: Number of requests sent.
+        concurrency: Requests in flight at once.
+        distinct: Number of distinct queries searched.
+        seed: Seed making the request mix reproducible.
+
+    Returns:
+        Result dict of summarize.
+    """
+    queries, weights = query_mix(distinct, seed)
+    rng = random.Random(seed)
+    searches = [
+        (query, 10 * rng.randint(1, 4) if rng.random() < NEXT_PAGE_SHARE else 0)
+        for query in rng.choices(queries, weights, k=requests_count)
+    ]
+
+    sessions = threading.local()
+    lock = threading.Lock()
+    outcomes = {}
+
+    def timed_search(search):
+        if not hasattr(sessions, "session"):
+            sessions.session = requests.Session()
+        query, page_index = search
+        url = f"{app_url}/?{urlencode({'q': query, 'page': page_index})}"
+
+        start = time.perf_counter()
+        try:
+            name = outcome(sessions.session.get(
+                url, timeout=REQUEST_TIMEOUT,
+                # Behind a proxy terminating TLS, as in production
+                headers={"X-Forwarded-Proto": "https"}))
+        except requests.RequestException:
+            name = "connection_error"
+        elapsed = time.perf_counter() - start
+
+        with lock:
+            outcomes[name] = outcomes.get(name, 0) + 1
+        return elapsed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        timings = list(executor.map(timed_search, searches))
+    return summarize(outcomes, timings, time.perf_counter() - start)
+
+
+def server_command(port, workers, threads, asgi):
+    """Returns the command running the app server."""
+    if asgi:
+        return [sys.executable, "-m", "uvicorn",
+                "developer_search.asgi:application",
+                "--host", "127.0.0.1", "--port", str(port),
+                "--workers", str(workers), "--no-access-log"]
+    return [sys.executable, "-m", "gunicorn", "developer_search.wsgi",
+            "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+            "--threads", str(threads)]
+
+
+def wait_until_ready(app_url, process):
+    """Waits until the app answers, failing if its server exits."""
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError("The app server exited while starting.")
+        try:
+            requests.get(f"{app_url}/credits", timeout=1,
+                         headers={"X-Forwarded-Proto": "https"})
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"The app did not answer within {STARTUP_TIMEOUT}s.")
+
+
+def start_app(port, workers, threads, asgi, standin_url, app_env=None):
+    """Starts the app server, pointed at the stand-in."""
+    env = {**os.environ, **(app_env or {}), "SERPAPI_SEARCH_URL": standin_url,
+           "ASYNC_SEARCH": str(asgi)}
+    env.setdefault("SERP_API_KEY", "load-test")
+    env.setdefault("ALLOWED_HOSTS", "127.0.0.1,localhost")
+    return subprocess.Popen(server_command(port, workers, threads, asgi),
+                            cwd=settings.BASE_DIR, env=env)
+
+
+def run_load_test(requests_count=DEFAULT_REQUESTS,
+                  concurrency=DEFAULT_CONCURRENCY, workers=DEFAULT_WORKERS,
+                  threads=DEFAULT_THREADS, asgi=False,
+                  distinct=DEFAULT_DISTINCT_QUERIES, seed=0, port=8765,
+                  app_url=None, standin_url=None, standin_options=None,
+                  app_env=None):
+    """Runs a load test against the app and the SerpAPI stand-in.
+
+    Args:
+        requests_count: Number of requests sent.
+        concurrency: Requests in flight at once.
+        workers: Worker processes of the app server.
+        threads: Threads per gunicorn worker.
+        asgi: Whether to run the app under uvicorn with ASYNC_SEARCH.
+        distinct: Number of distinct queries searched.
+        seed: Seed making the request mix reproducible.
+        port: Port of the app server started.
+        app_url: URL of an app already running, instead of starting one.
+        standin_url: SERPAPI_SEARCH_URL of a stand-in already running,
+            instead of starting one.
+        standin_options: Keyword arguments of SerpApiStandin.
+        app_env: Environment variables of the app server started, e.g. its
+            cache settings.
+
+    Returns:
+        Result dict of summarize, with the setup.
+    """
+    standin = None
+    process = None
+    try:
+        if app_url is None:
+            if standin_url is None:
+                standin = SerpApiStandin(**(standin_options or {})).start()
+                standin_url = standin.url
+            app_url = f"http://127.0.0.1:{port}"
+            process = start_app(port, workers, threads, asgi, standin_url,
+                                app_env)
+
+        wait_until_ready(app_url, process)
+        result = drive(app_url, requests_count, concurrency, distinct, seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if standin is not None:
+            standin.stop()
+
+    return {
+        "setup": "asgi" if asgi else "wsgi",
+        "workers": workers,
+        "threads": 1 if asgi else threads,
+        **result,
+    }
@@ -0,0 +1,68 @@
+"""Benchmark of concurrent searches under the WSGI and ASGI deployments.
+
+Runs the load test (see load.py) twice against one SerpAPI stand-in answering
+after a fixed latency, so it shows how many searches each deployment keeps in
+flight while waiting on upstream:
+- wsgi: the app under gunicorn with threaded workers (one thread held per
+  search for the whole upstream wait)
+- asgi: the app under uvicorn workers with ASYNC_SEARCH (classification still
+  runs in worker threads)
+
+Both deployments get the same requests, as many in flight at once and as many
+worker processes, and serve them through the whole request stack: middleware,
+views and templates. Every request searches a distinct query and the app's
+search and page caches are disabled, so every search waits on the stand-in.
+"""
+
+from .load import run_load_test
+from .standin import SerpApiStandin
+
+# Default number of searches per deployment
+DEFAULT_SEARCHES = 200
+
+# Default searches in flight at once, on both deployments
+DEFAULT_CONCURRENCY = 64
+
+# Default worker processes of both app servers
+DEFAULT_WORKERS = 1
+
+# Default threads per gunicorn worker
+DEFAULT_THREADS = 8
+
+# Default seconds the SerpAPI stand-in takes to answer
+DEFAULT_LATENCY = 0.2
+
+# Environment of the app servers, disabling what would spare upstream calls
+UNCACHED_APP_ENV = {
+    "SEARCH_CACHE_TTL": "0",
+    "PAGE_CACHE_TTL": "0",
+    "PREFETCH_NEXT_PAGE": "False",
+    "DEEP_FILL": "False",
+}
+
+
+def compare_deployments(searches=DEFAULT_SEARCHES,
+                        concurrency=DEFAULT_CONCURRENCY,
+                        workers=DEFAULT_WORKERS, threads=DEFAULT_THREADS,
+                        latency=DEFAULT_LATENCY, port=8765):
+    """Load tests the same searches under both deployments.
+
+    Args:
+        searches: Searches sent to each deployment.
+        concurrency: Searches in flight at once, on both deployments.
+        workers: Worker processes of both app servers.
+        threads: Threads per gunicorn worker.
+        latency: Seconds the SerpAPI stand-in takes to answer.
+        port: Port of the app servers started.
+
+    Returns:
+        List of result dicts of load.run_load_test, WSGI first.
+    """
+    with SerpApiStandin(latency=latency, jitter=0.0) as standin:
+        return [
+            run_load_test(requests_count=searches, concurrency=concurrency,
+                          workers=workers, threads=threads, asgi=asgi,
+                          distinct=searches, port=port,
+                          standin_url=standin.url, app_env=UNCACHED_APP_ENV)
+            for asgi in (False, True)
+        ]
@@ -0,0 +1,187 @@
+"""Local stand-in for the SerpAPI search endpoint.
+
+Replays a recorded SerpAPI response over HTTP, so the app can be load tested
+without spending quota. Point it at the stand-in with SERPAPI_SEARCH_URL:
+- Answers after a configurable latency, with random jitter on top
+- Fails a configurable share of searches like SerpAPI does: 429 ("run out
+  of searches"), 400 (a 200 with an "error" key, as for no results) and 500
+- Pages through total_results results: each window (the start parameter)
+  cycles through the recorded organic results, with links made unique per
+  query and start, and pagination links while results remain
+"""
+
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from .suite import RECORDED_RESPONSE, load_response
+
+# Default seconds the stand-in takes to answer
+DEFAULT_LATENCY = 0.3
+
+# Default seconds of random latency added on top
+DEFAULT_JITTER = 0.1
+
+# Default results of every query, across all pages
+DEFAULT_TOTAL_RESULTS = 50
+
+# Results per page (the num search parameter)
+RESULTS_PER_PAGE = 10
+
+# Bodies SerpAPI answers errors with
+QUOTA_ERROR = "Your account has run out of searches."
+NO_RESULTS_ERROR = "Google hasn't returned any results for this query."
+SERVER_ERROR = "Internal server error."
+
+
+class SerpApiStandin:
+    """Serves recorded SerpAPI responses with latency, errors and paging."""
+
+    def __init__(self, response_path=RECORDED_RESPONSE,
+                 latency=DEFAULT_LATENCY, jitter=DEFAULT_JITTER, rate_429=0.0,
+                 rate_400=0.0, rate_500=0.0,
+                 total_results=DEFAULT_TOTAL_RESULTS, seed=None,
+                 host="127.0.0.1", port=0):
+        self.recorded = load_response(response_path)
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rate_400 = rate_400
+        self.rate_500 = rate_500
+        self.total_results = total_results
+        self.random = random.Random(seed)
+        self.lock = Lock()
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        """URL of the search endpoint, to use as SERPAPI_SEARCH_URL."""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/search"
+
+    def draw(self):
+        """Returns a random number, and a latency, for a search."""
+        with self.lock:
+            return (self.random.random(),
+                    self.latency + self.random.uniform(0, self.jitter))
+
+    def handle(self, params, draw=None):
+        """Answers a search.
+
+        Args:
+            params: Dict of the search parameters.
+            draw: Random number in [0, 1) deciding whether the search fails
+                (default: a new one).
+
+        Returns:
+            Tuple of the HTTP status and the response dict.
+        """
+        if draw is None:
+            draw = self.draw()[0]
+
+        if draw < self.rate_429:
+            return 429, {"error": QUOTA_ERROR}
+        draw -= self.rate_429
+        if draw < self.rate_400:
+            return 200, {"error": NO_RESULTS_ERROR}
+        draw -= self.rate_400
+        if draw < self.rate_500:
+            return 500, {"error": SERVER_ERROR}
+
+        try:
+            start = max(int(params.get("start") or 0), 0)
+        except ValueError:
+            return 400, {"error": "Invalid start parameter."}
+        if start >= self.total_results:
+            return 200, {"error": NO_RESULTS_ERROR}
+
+        return 200, self.page(params.get("q", ""), start)
+
+    def page(self, search_query, start):
+        """Builds the response of the result window beginning at start."""
+        recorded_results = self.recorded.get("organic_results", [])
+        count = min(RESULTS_PER_PAGE, self.total_results - start)
+        organic_results = []
+        for index in range(count):
+            organic_result = dict(
+                recorded_results[(start + index) % len(recorded_results)])
+            organic_result["position"] = start + index + 1
+            # Unique per query and position, so caches and dedupes see
+            # distinct results for every window
+            organic_result["link"] = (
+                f"{organic_result['link']}#{urlencode({'q': search_query})}"
+                f"&result={start + index}")
+            organic_results.append(organic_result)
+
+        api_response = dict(self.recorded)
+        api_response["organic_results"] = organic_results
+        api_response["search_parameters"] = {
+            **self.recorded.get("search_parameters", {}),
+            "q": search_query, "start": start,
+        }
+
+        pagination = {"current": start // RESULTS_PER_PAGE + 1}
+        if start + RESULTS_PER_PAGE < self.total_results:
+            pagination["next"] = self.page_link(search_query,
+                                                start + RESULTS_PER_PAGE)
+        if start > 0:
+            pagination["previous"] = self.page_link(
+                search_query, max(start - RESULTS_PER_PAGE, 0))
+        api_response["pagination"] = pagination
+        api_response["serpapi_pagination"] = dict(pagination)
+        return api_response
+
+    def page_link(self, search_query, start):
+        """Returns the stand-in link of the window beginning at start."""
+        return (f"http://{self.host}:{self.port}/search?"
+                f"{urlencode({'q': search_query, 'start': start})}")
+
+    def start(self):
+        """Starts serving on a background thread and returns the stand-in."""
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                draw, latency = standin.draw()
+                time.sleep(latency)
+                status, api_response = standin.handle(
+                    dict(parse_qsl(urlsplit(self.path).query)), draw)
+
+                body = json.dumps(api_response).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = Thread(target=self.server.serve_forever,
+                             name="serpapi-standin", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,307 @@
+"""Benchmark suite for the classification and search pipeline.
+
+Measures each stage of the pipeline on SerpAPI 'organic_results' fixtures:
+- parse: building SearchResult objects from organic results
+- classify cold/warm: CategoryMatcher without and with a filled score cache
+- score_search_item / keyword_in_search: the reference scoring helpers
+- perform_search_v2: the whole search, with SerpAPI replaced by the fixture
+  and every process-wide singleton it touches (score cache, query folds,
+  suggestions, quota, prefetching, deep fill) swapped for a fresh one, so
+  runs neither see each other nor leave state behind
+
+Fixtures are a recorded SerpAPI response (or any response file passed in)
+and synthetic results of any size. Rule sets grow by appending synthetic
+categories to SEARCH_CATEGORY_DATA. Each measurement reports throughput,
+p50/p99 latency and peak memory allocated during a run, compared to a
+stored baseline (baseline.json, recorded with --save-baseline).
+"""
+
+import json
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from unittest import mock
+
+from ..helpers import constants, metrics
+from ..helpers import search
+from ..helpers.deep_fill import DeepFiller
+from ..helpers.matcher import CategoryMatcher
+from ..helpers.prefetch import Prefetcher
+from ..helpers.providers import FunctionProvider, MultiProviderSearch
+from ..helpers.queries import QueryCanonicalizer
+from ..helpers.results import SearchResult
+from ..helpers.score_cache import ScoreCache
+from ..helpers.suggest import SuggestionIndex
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# Recorded SerpAPI response used by default
+RECORDED_RESPONSE = os.path.join(FIXTURES_DIR, "serpapi_django_orm.json")
+
+# Stored baseline that runs are compared against
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Default sizes of the synthetic organic_results fixtures
+DEFAULT_SIZES = (10, 100, 10000)
+
+# Default rule set sizes, as multiples of SEARCH_CATEGORY_DATA
+DEFAULT_RULE_SCALES = (1, 4, 16)
+
+# Upper bound on items processed per measurement, to keep large runs short
+MAX_ITEMS_PER_MEASUREMENT = 200000
+
+# Stages whose reference implementations are too slow for grown rule sets
+DEFAULT_RULES_ONLY_STAGES = ("score_search_item", "keyword_in_search",
+                             "perform_search_v2")
+
+HOSTS = (
+    "https://www.youtube.com", "https://youtu.be", "https://stackoverflow.com",
+    "https://superuser.stackexchange.com", "https://github.com",
+    "https://gitlab.com", "https://docs.python.org",
+    "https://developer.mozilla.org", "https://requests.readthedocs.io",
+    "https://www.udemy.com", "https://www.coursera.org",
+    "https://www.freecodecamp.org", "https://codepen.io",
+    "https://codesandbox.io", "https://medium.com", "https://dev.to",
+    "https://www.geeksforgeeks.org", "https://realpython.com",
+    "https://www.w3schools.com", "https://blog.example.com",
+)
+
+PATHS = (
+    "/", "/course/{slug}", "/courses/{slug}", "/learn/{slug}", "/docs/{slug}",
+    "/documentation/{slug}", "/reference/{slug}", "/blog/{slug}",
+    "/article/{slug}", "/post/{slug}", "/watch?v={slug}",
+    "/questions/12345/{slug}", "/{slug}", "/en-US/docs/Web/{slug}",
+)
+
+WORDS = (
+    "python", "django", "orm", "react", "hooks", "rust", "async", "api",
+    "query", "database", "css", "flexbox", "grid", "docker", "kubernetes",
+    "testing", "performance", "course", "tutorial", "learn", "training",
+    "bootcamp", "documentation", "docs", "reference", "guide", "playground",
+    "interactive", "practice", "game", "challenge", "blog", "article",
+    "explained", "how", "to", "the", "a", "of", "and", "for", "with", "in",
+    "Tutorial", "Documentation", "Guide", "tutorail", "documentaion",
+)
+
+
+def load_response(path=RECORDED_RESPONSE):
+    """Loads a recorded SerpAPI response from a JSON file."""
+    with open(path, encoding="utf-8") as response_file:
+        return json.load(response_file)
+
+
+def synthetic_organic_results(count, seed=0):
+    """Generates SerpAPI-like organic results mixing every category signal.
+
+    Args:
+        count: Number of results to generate.
+        seed: Seed making the results reproducible.
+
+    Returns:
+        List of organic result dicts.
+    """
+    rng = random.Random(seed)
+
+    def sentence(low, high):
+        return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+    organic_results = []
+    for position in range(1, count + 1):
+        slug = "-".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+        link = rng.choice(HOSTS) + rng.choice(PATHS).format(slug=slug)
+        organic_results.append({
+            "position": position,
+            "link": link,
+            "title": sentence(3, 10).capitalize(),
+            "snippet": sentence(15, 45) + ".",
+            "displayed_link": link.replace("/", " › ")[:60],
+        })
+    return organic_results
+
+
+def grow_category_data(scale, seed=0):
+    """Returns SEARCH_CATEGORY_DATA followed by synthetic categories.
+
+    Args:
+        scale: Total size as a multiple of SEARCH_CATEGORY_DATA.
+        seed: Seed making the rules reproducible.
+    """
+    rng = random.Random(seed)
+    category_data = dict(constants.SEARCH_CATEGORY_DATA)
+
+    for index in range((scale - 1) * len(constants.SEARCH_CATEGORY_DATA)):
+        words = rng.sample(WORDS, 8)
+        category_data[f"synthetic {index}"] = {
+            "keywords": tuple(f"{word}{index}" for word in words[:3]),
+            "domains": (f"example{index}.com", f"{words[3]}{index}.io"),
+            "url_patterns": (f"/{words[4]}{index}/",),
+            "title_patterns": (f"{words[5]} {words[6]}{index}",),
+        }
+    return category_data
+
+
+def measure(func, runs):
+    """Times func over several runs and measures its peak allocations.
+
+    Returns:
+        Dict with p50/p99 latency in milliseconds and peak KiB allocated.
+    """
+    func()  # Warm up
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "p50_ms": statistics.median(timings),
+        "p99_ms": (statistics.quantiles(timings, n=100)[98]
+                   if len(timings) > 1 else timings[0]),
+        "peak_kib": peak / 1024,
+    }
+
+
+def stage_functions(organic_results, category_data):
+    """Returns the stages to measure, as (name, function) pairs."""
+    search_results = [SearchResult.from_serpapi(organic_result)
+                      for organic_result in organic_results]
+
+    cold_matcher = CategoryMatcher(category_data)
+    warm_matcher = CategoryMatcher(category_data, score_cache=ScoreCache(
+        maxsize=len(search_results) + 1))
+    warm_matcher.classify(search_results)
+
+    keyword_rules = [category_config
+                     for category_config in category_data.values()
+                     if category_config.get("keywords")]
+
+    def score_items():
+        for search_result in search_results:
+            for category_config in category_data.values():
+                search.score_search_item(search_result, category_config)
+
+    def match_keywords():
+        for search_result in search_results:
+            for category_config in keyword_rules:
+                search.keyword_in_search(
+                    search_result, category_config["keywords"],
+                    category_config.get("must_contain_all_keywords", False))
+
+    api_response = {"organic_results": organic_results,
+                    "pagination": {"current": 1, "next": "next"}}
+    score_cache = ScoreCache(maxsize=len(search_results) + 1)
+    default_matcher = CategoryMatcher(constants.SEARCH_CATEGORY_DATA,
+                                      score_cache=score_cache)
+    provider_search = MultiProviderSearch([FunctionProvider(
+        "benchmark", lambda search_query, page_index: api_response)])
+
+    def perform_search():
+        score_cache.clear()
+        with mock.patch.multiple(
+                search, SCORE_CACHE=score_cache,
+                CATEGORY_MATCHER=default_matcher,
+                PROVIDER_SEARCH=provider_search,
+                QUERY_CANONICALIZER=QueryCanonicalizer(),
+                SUGGESTION_INDEX=SuggestionIndex(snapshot_path=""),
+                PREFETCHER=Prefetcher(enabled=False),
+                DEEP_FILLER=DeepFiller(enabled=False)), \
+                mock.patch.object(search.SEARCH_RESPONSE_CACHE, "ttl", 0), \
+                mock.patch.object(metrics, "METRICS_ENABLED", False):
+            search.perform_search_v2("benchmark", 0)
+
+    return (
+        ("parse", lambda: [SearchResult.from_serpapi(organic_result)
+                           for organic_result in organic_results]),
+        ("classify cold", lambda: cold_matcher.classify(search_results)),
+        ("classify warm", lambda: warm_matcher.classify(search_results)),
+        ("score_search_item", score_items),
+        ("keyword_in_search", match_keywords),
+        ("perform_search_v2", perform_search),
+    )
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, rule_scales=DEFAULT_RULE_SCALES,
+                   runs=20, recorded_path=RECORDED_RESPONSE, stages=None,
+                   seed=0):
+    """Runs every stage over every fixture and rule set size.
+
+    Args:
+        sizes: Sizes of the synthetic fixtures.
+        rule_scales: Rule set sizes, as multiples of SEARCH_CATEGORY_DATA.
+        runs: Timed runs per measurement (fewer for large fixtures).
+        recorded_path: Recorded SerpAPI response, or None to skip it.
+        stages: Names of the stages to run (default: all).
+        seed: Seed for the synthetic fixtures and rules.
+
+    Yields:
+        One result dict per measurement.
+    """
+    fixtures = []
+    if recorded_path:
+        fixtures.append(("recorded",
+                         load_response(recorded_path).get("organic_results", [])))
+    for size in sizes:
+        fixtures.append(("synthetic", synthetic_organic_results(size, seed)))
+
+    for rule_scale in rule_scales:
+        category_data = grow_category_data(rule_scale, seed)
+
+        for source, organic_results in fixtures:
+            size = len(organic_results)
+            stage_runs = max(3, min(runs, MAX_ITEMS_PER_MEASUREMENT // max(size, 1)))
+
+            for name, func in stage_functions(organic_results, category_data):
+                if stages and name not in stages:
+                    continue
+                if rule_scale != 1 and name in DEFAULT_RULES_ONLY_STAGES:
+                    continue
+
+                result = measure(func, stage_runs)
+                yield {
+                    "stage": name,
+                    "source": source,
+                    "size": size,
+                    "categories": len(category_data),
+                    "runs": stage_runs,
+                    "items_per_sec": size / (result["p50_ms"] / 1000)
+                    if result["p50_ms"] else 0.0,
+                    **result,
+                }
+
+
+def result_key(result):
+    """Returns the key identifying a measurement in a baseline file."""
+    return "{stage}|{source}|{size}|{categories}".format(**result)
+
+
+def save_baseline(results, path):
+    """Stores measurements as the baseline to compare future runs against."""
+    with open(path, "w", encoding="utf-8") as baseline_file:
+        json.dump({result_key(result): result for result in results},
+                  baseline_file, indent=2, sort_keys=True)
+
+
+def load_baseline(path):
+    """Loads a baseline saved by save_baseline, or {} if there is none."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as baseline_file:
+        return json.load(baseline_file)
+
+
+def p50_change(result, baseline):
+    """Returns the p50 latency change against the baseline, in percent."""
+    previous = baseline.get(result_key(result))
+    if not previous or not previous["p50_ms"]:
+        return None
+    return (result["p50_ms"] - previous["p50_ms"]) / previous["p50_ms"] * 100
@@ -0,0 +1,175 @@
+"""Bulk classification of archived SerpAPI responses.
+
+Archives are JSONL files (optionally gzipped) holding one SerpAPI response per
+line. Lines are read lazily and classified in chunks, either in this process
+or across a process pool, with the same engine as perform_search_v2. Output
+is one JSON line per organic result with the categories it was assigned to,
+written in input order as chunks complete.
+
+At most a few chunks per worker are read ahead, so memory stays bounded
+whatever the size of the archive.
+"""
+
+import gzip
+import json
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from . import constants, matcher
+from .results import SearchResult
+from .search import classify_search
+
+# SerpAPI responses classified per task
+DEFAULT_CHUNK_SIZE = 500
+
+# Chunks read ahead per worker process
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+
+def open_archive(path, mode="rt"):
+    """Opens a JSONL file, gzipped if its name ends with .gz ('-' is stdin)."""
+    if path == "-":
+        return open(sys.stdin.fileno(), mode, encoding="utf-8", closefd=False)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def read_chunks(paths, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Lazily reads the lines of several archives in chunks.
+
+    Yields:
+        (path, first line number, list of lines) tuples.
+    """
+    for path in paths:
+        with open_archive(path) as archive:
+            line_number = 1
+            while True:
+                lines = list(islice(archive, chunk_size))
+                if not lines:
+                    break
+                yield path, line_number, lines
+                line_number += len(lines)
+
+
+def assign_categories(search_items):
+    """Classifies search items like perform_search_v2 does.
+
+    Returns:
+        List with the category names assigned to each item, in item order.
+    """
+    results = classify_search(search_items, constants.SEARCH_CATEGORY_DATA)
+
+    categories = {id(search_item): [] for search_item in search_items}
+    for category, category_items in results.items():
+        if category == "all":
+            continue
+        for search_item in category_items:
+            categories[id(search_item)].append(category)
+
+    return [categories[id(search_item)] for search_item in search_items]
+
+
+def classify_chunk(path, first_line, lines):
+    """Classifies a chunk of archive lines into JSONL output.
+
+    The organic results of every response in the chunk are classified in a
+    single batch. Blank lines are skipped; lines that are not JSON objects,
+    or whose organic results are not a list of result objects, are skipped
+    and counted as invalid.
+
+    Returns:
+        Tuple of (output text, responses, organic results, invalid lines).
+    """
+    search_items = []
+    origins = []
+    responses = invalid = 0
+
+    for line_number, line in enumerate(lines, first_line):
+        if not line.strip():
+            continue
+        try:
+            api_response = json.loads(line)
+        except ValueError:
+            invalid += 1
+            continue
+        if not isinstance(api_response, dict):
+            invalid += 1
+            continue
+
+        query = (api_response.get("search_parameters") or {}).get("q")
+        try:
+            line_items = [SearchResult.from_serpapi(organic_result)
+                          for organic_result
+                          in api_response.get("organic_results") or []]
+        except (AttributeError, TypeError):
+            invalid += 1
+            continue
+
+        responses += 1
+        search_items.extend(line_items)
+        origins.extend((line_number, query) for _ in line_items)
+
+    output = [
+        json.dumps({
+            "source": path,
+            "line": line_number,
+            "query": query,
+            "link": search_item.link,
+            "title": search_item.title,
+            "categories": categories,
+        }, ensure_ascii=False)
+        for search_item, (line_number, query), categories in zip(
+            search_items, origins, assign_categories(search_items))
+    ]
+
+    text = "\n".join(output) + "\n" if output else ""
+    return text, responses, len(search_items), invalid
+
+
+def init_worker():
+    """Keeps fuzzy matching single-threaded inside pool worker processes."""
+    matcher.FUZZY_WORKERS = 1
+
+
+def classify_archives(paths, output, workers=1, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Classifies archives chunk by chunk, writing results in input order.
+
+    Args:
+        paths: Archive paths ('-' reads stdin).
+        output: Text file the JSONL output is written to.
+        workers: Worker processes (1 classifies in this process).
+        chunk_size: SerpAPI responses per chunk.
+
+    Yields:
+        (responses, organic results, invalid lines) counts of each chunk, once
+        its output is written.
+    """
+    for text, *counts in classified_chunks(paths, workers, chunk_size):
+        if text:
+            output.write(text)
+        yield tuple(counts)
+
+
+def classified_chunks(paths, workers, chunk_size):
+    """Yields classify_chunk results in input order, from a pool if workers > 1."""
+    chunks = read_chunks(paths, chunk_size)
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield classify_chunk(*chunk)
+        return
+
+    max_in_flight = workers * CHUNKS_IN_FLIGHT_PER_WORKER
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(classify_chunk, *chunk))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
@@ -10,7 +10,8 @@ Each category can use multiple signals for classification:
     - url_patterns: Patterns to match in the URL path
     - title_patterns: Patterns to match in the page title
     - must_contain_all_keywords: If True, all keywords must be present
-    - exclude_if_matched: Don't include if already matched these categories
+    - exclude_if_matched: Don't include if matched by any of these categories
+      (they are evaluated first, whatever the order they are listed in)
 
 The scoring system awards points for different matches:
     - Domain match with priority: 100 points (instant match)
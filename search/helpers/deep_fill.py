@@ -0,0 +1,158 @@
+"""Deep fill of sparse category tabs.
+
+With num=10, tabs such as "interactive" often hold only one or two results.
+When DEEP_FILL is set and a page leaves a tab with some results, but fewer
+than DEEP_FILL_MIN_ITEMS, the following result windows (starting at
+page_index + 10, + 20, ..., past the results of the page) are fetched
+concurrently, at most DEEP_FILL_MAX_PAGES of them. They are classified one by
+one in order, and their results are added to the tabs that are still sparse,
+until every tab is filled:
+- Tabs without any result on the page are not filled, as the query is
+  likely unrelated to them, and neither is "all"
+- The whole fill is bounded by DEEP_FILL_DEADLINE seconds; pages arriving
+  later are left for the cache
+- Windows go through the response cache, under the keys of the pages
+  starting at the same index, and upstream calls are limited to
+  DEEP_FILL_HOURLY_BUDGET per hour across processes. The next page links
+  only move the start by one, which would share 9 of 10 results with the
+  page, so those keys are not used
+- Tabs that already had enough results keep those of the page only, so
+  paging is unchanged
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import Lock
+
+from decouple import config
+
+from . import metrics
+from .quota import HourlyBudget
+from .results import SearchResult
+
+# Whether sparse tabs are filled from the following result windows
+DEEP_FILL = config("DEEP_FILL", default=False, cast=bool)
+
+# Results a tab should hold before it is no longer filled
+DEEP_FILL_MIN_ITEMS = config("DEEP_FILL_MIN_ITEMS", default=3, cast=int)
+
+# Result windows fetched at most to fill the tabs of a page
+DEEP_FILL_MAX_PAGES = config("DEEP_FILL_MAX_PAGES", default=3, cast=int)
+
+# Seconds a page waits for the windows filling its tabs
+DEEP_FILL_DEADLINE = config("DEEP_FILL_DEADLINE", default=2.0, cast=float)
+
+# Upstream calls deep fills may make per hour, across processes
+DEEP_FILL_HOURLY_BUDGET = config("DEEP_FILL_HOURLY_BUDGET", default=200,
+                                 cast=int)
+
+# Threads fetching result windows
+DEEP_FILL_WORKERS = config("DEEP_FILL_WORKERS", default=8, cast=int)
+
+# Results in a window (the num parameter of searches)
+RESULTS_PER_WINDOW = 10
+
+
+class DeepFiller:
+    """Fills sparse tabs with results of the following result windows."""
+
+    def __init__(self, enabled=DEEP_FILL, min_items=DEEP_FILL_MIN_ITEMS,
+                 max_pages=DEEP_FILL_MAX_PAGES, deadline=DEEP_FILL_DEADLINE,
+                 hourly_budget=DEEP_FILL_HOURLY_BUDGET,
+                 workers=DEEP_FILL_WORKERS):
+        self.enabled = enabled
+        self.min_items = min_items
+        self.max_pages = max_pages
+        self.deadline = deadline
+        self.budget = HourlyBudget("deep-fill", hourly_budget)
+        self.workers = workers
+        self.lock = Lock()
+        self.executor = None
+
+    def sparse_categories(self, results):
+        """Returns the categories of results with some, but fewer than
+        min_items, results ("all" excepted)."""
+        return {category for category, search_items in results.items()
+                if category != "all"
+                and 0 < len(search_items) < self.min_items}
+
+    def take_budget(self):
+        """Counts an upstream call against the hourly budget.
+
+        Returns:
+            False if the budget of the current hour is spent.
+        """
+        within_budget = self.budget.take()
+        if not within_budget:
+            metrics.record_deep_fill("over_budget")
+        return within_budget
+
+    def fill(self, search_query, page_index, results, fetch_page, classify):
+        """Adds results of the following windows to sparse tabs.
+
+        Args:
+            search_query: Query string searched for.
+            page_index: Starting index of the page.
+            results: Classified results of the page, by category.
+            fetch_page: Function called as fetch_page(search_query,
+                page_index) returning a call_serpapi response, or None to
+                skip it.
+            classify: Function classifying a list of SearchResult.
+
+        Returns:
+            Dict of results by category, with sparse tabs filled.
+        """
+        sparse = self.sparse_categories(results)
+        if not self.enabled or not sparse:
+            return results
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="deep-fill")
+
+        futures = [
+            self.executor.submit(fetch_page, search_query,
+                                 page_index + window * RESULTS_PER_WINDOW)
+            for window in range(1, self.max_pages + 1)
+        ]
+        filled = {category: list(search_items)
+                  for category, search_items in results.items()}
+        seen = {category: {search_item.lowered_link
+                           for search_item in search_items}
+                for category, search_items in results.items()}
+        deadline = time.monotonic() + self.deadline
+
+        try:
+            for future in futures:
+                api_response = future.result(
+                    timeout=max(deadline - time.monotonic(), 0))
+                if not api_response or "error_code" in api_response:
+                    continue
+                metrics.record_deep_fill("page")
+
+                search_items = [
+                    SearchResult.from_serpapi(organic_result)
+                    for organic_result in api_response.get("organic_results", [])
+                ]
+                for category, search_items in classify(search_items).items():
+                    if category not in sparse:
+                        continue
+                    for search_item in search_items:
+                        if search_item.lowered_link not in seen[category]:
+                            seen[category].add(search_item.lowered_link)
+                            filled[category].append(search_item)
+
+                sparse = self.sparse_categories(
+                    {category: filled[category] for category in sparse})
+                if not sparse:
+                    break
+        except FutureTimeoutError:
+            metrics.record_deep_fill("deadline")
+        finally:
+            for future in futures:
+                future.cancel()
+
+        metrics.record_deep_fill("partial" if sparse else "filled")
+        return filled
@@ -0,0 +1,54 @@
+"""Registered-domain extraction for domain-based classification rules.
+
+Domain rules compare the registered domain label (e.g. "python" for
+"docs.python.org") of a configured domain with that of a search result link.
+
+This module provides:
+- An extractor that uses the Public Suffix List snapshot bundled with
+  tldextract, so no network fetch happens on first use
+- Memoized lookups, with result hosts kept in a bounded LRU cache
+"""
+
+from functools import lru_cache
+
+import tldextract
+from tldextract.remote import lenient_netloc
+
+# Maximum number of distinct result hosts kept in the LRU cache
+HOST_CACHE_SIZE = 4096
+
+# Bundled PSL snapshot only: no download and no on-disk cache
+DOMAIN_EXTRACTOR = tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None)
+
+
+@lru_cache(maxsize=HOST_CACHE_SIZE)
+def host_domain(host):
+    """Returns the registered domain label of a hostname."""
+    return DOMAIN_EXTRACTOR(host).domain
+
+
+def link_host(link):
+    """Returns the hostname of a URL (scheme optional), as tldextract sees it."""
+    if not link:
+        return ""
+    return lenient_netloc(link)
+
+
+def link_domain(link):
+    """Returns the registered domain label of a URL.
+
+    Args:
+        link: URL of a search result (scheme optional).
+
+    Returns:
+        Domain label without subdomains and public suffix, e.g. "github".
+    """
+    if not link:
+        return ""
+    return host_domain(link_host(link))
+
+
+@lru_cache(maxsize=None)
+def configured_domains(domains):
+    """Resolves a tuple of configured domains into a frozen set of labels."""
+    return frozenset(DOMAIN_EXTRACTOR(domain).domain for domain in domains)
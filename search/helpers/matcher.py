@@ -0,0 +1,589 @@
+"""Precompiled classification engine for search results.
+
+This module compiles category rules (see constants.SEARCH_CATEGORY_DATA) once
+into lookup structures, so that every search result is scanned a single time
+and scored against all categories at once:
+- One Aho-Corasick automaton finds every URL pattern, title pattern and
+  keyword present in a field, regardless of how many categories use them
+- Domain rules become hash-set lookups on the result's registered domain
+- Categories are evaluated in dependency order of their exclude_if_matched
+  rules, so results do not depend on the order categories are listed in
+- Fuzzy keyword matching only covers categories not already decided by an
+  exact match or excluded, skips pairs that provably cannot reach the
+  cutoff, and runs for a whole page as one rapidfuzz call, in C and
+  optionally across cores
+
+The scores produced are identical to search.score_search_item.
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from heapq import heapify, heappop, heappush
+
+import ahocorasick
+import numpy
+from decouple import config
+from rapidfuzz import fuzz, process
+
+from .domains import configured_domains
+from .results import SearchResult
+from .score_cache import ScoreCache, rules_version
+
+# Points awarded for each signal (see constants module docstring)
+DOMAIN_PRIORITY_SCORE = 100
+DOMAIN_SCORE = 50
+URL_PATTERN_SCORE = 30
+TITLE_PATTERN_SCORE = 25
+KEYWORD_SCORE = 20
+
+# Minimum score for an item to be included in a category
+MIN_CATEGORY_SCORE = 20
+
+# Minimum fuzzy similarity for a keyword to count as present
+FUZZY_KEYWORD_CUTOFF = 90
+
+# Threads used for batch fuzzy matching (-1 uses all cores)
+FUZZY_WORKERS = config("FUZZY_WORKERS", default=-1, cast=int)
+
+# Keywords within length reach of a text from which they are prefiltered with
+# numpy rather than one by one
+VECTORIZED_PREFILTER_MIN_KEYWORDS = 64
+
+# Batches smaller than this (keyword, field) pair count run on one thread,
+# as starting worker threads would cost more than it saves
+PARALLEL_FUZZY_MIN_PAIRS = 20000
+
+# Fuzzy matches of an item before fuzzy matching (link, title, snippet)
+NO_FUZZY_HITS = (frozenset(), frozenset(), frozenset())
+
+
+class PatternIndex:
+    """Finds every pattern of a fixed set occurring in a text in one pass.
+
+    Patterns are compiled into an Aho-Corasick automaton, so scanning a text
+    costs the same however many patterns there are, and overlapping
+    patterns are all reported.
+    """
+
+    def __init__(self, patterns):
+        self.automaton = None
+
+        patterns = {pattern.lower() for pattern in patterns if pattern}
+        if patterns:
+            self.automaton = ahocorasick.Automaton()
+            for pattern in patterns:
+                self.automaton.add_word(pattern, pattern)
+            self.automaton.make_automaton()
+
+    def find(self, text):
+        """Returns the set of patterns contained in a lowercase text."""
+        if not text or self.automaton is None:
+            return frozenset()
+
+        return {pattern for _, pattern in self.automaton.iter(text)}
+
+
+class CategoryRule:
+    """Compiled form of a single category configuration."""
+
+    __slots__ = (
+        "name",
+        "domains",
+        "domain_priority",
+        "url_patterns",
+        "title_patterns",
+        "keywords",
+        "keyword_set",
+        "lowered_keywords",
+        "must_contain_all",
+        "exclude_if_matched",
+    )
+
+    def __init__(self, name, category_config):
+        self.name = name
+        self.domains = configured_domains(
+            tuple(category_config.get("domains", ())))
+        self.domain_priority = bool(category_config.get("domain_priority"))
+        self.url_patterns = frozenset(
+            pattern.lower() for pattern in category_config.get("url_patterns", ()))
+        self.title_patterns = frozenset(
+            pattern.lower() for pattern in category_config.get("title_patterns", ()))
+        self.keywords = tuple(category_config.get("keywords", ()))
+        self.keyword_set = frozenset(self.keywords)
+        self.lowered_keywords = frozenset(
+            keyword.lower() for keyword in self.keywords)
+        self.must_contain_all = bool(
+            category_config.get("must_contain_all_keywords", False))
+        self.exclude_if_matched = tuple(
+            category_config.get("exclude_if_matched", ()))
+
+
+def index_rules(rules, attribute):
+    """Maps each value of a rule attribute to the indices of rules having it."""
+    index = {}
+    for rule_index, rule in enumerate(rules):
+        for value in getattr(rule, attribute):
+            index.setdefault(value, []).append(rule_index)
+    return {value: tuple(indices) for value, indices in index.items()}
+
+
+def evaluation_order(rules):
+    """Orders rules so each comes after the categories that exclude it.
+
+    Rules are topologically sorted on their exclude_if_matched categories
+    (unknown names are ignored); ties keep the configuration order.
+
+    Returns:
+        Tuple of (evaluation order, prerequisites), where evaluation order
+        holds rule indices and prerequisites the indices of the categories
+        excluding each rule.
+
+    Raises:
+        ValueError: If exclude_if_matched rules form a cycle.
+    """
+    indices = {rule.name: rule_index for rule_index, rule in enumerate(rules)}
+    prerequisites = tuple(
+        tuple(dict.fromkeys(indices[name] for name in rule.exclude_if_matched
+                            if name in indices))
+        for rule in rules
+    )
+
+    dependents = [[] for _ in rules]
+    remaining = [len(rule_prerequisites) for rule_prerequisites in prerequisites]
+    for rule_index, rule_prerequisites in enumerate(prerequisites):
+        for prerequisite in rule_prerequisites:
+            dependents[prerequisite].append(rule_index)
+
+    ready = [rule_index for rule_index, count in enumerate(remaining)
+             if not count]
+    heapify(ready)
+    order = []
+    while ready:
+        rule_index = heappop(ready)
+        order.append(rule_index)
+        for dependent in dependents[rule_index]:
+            remaining[dependent] -= 1
+            if not remaining[dependent]:
+                heappush(ready, dependent)
+
+    if len(order) < len(rules):
+        cycle = [rules[rule_index].name
+                 for rule_index, count in enumerate(remaining) if count]
+        raise ValueError("exclude_if_matched rules form a cycle, unresolved "
+                         f"categories: {', '.join(cycle)}")
+
+    return tuple(order), prerequisites
+
+
+def char_mask(text):
+    """Folds the characters of text into a 64-bit mask, one bit per ord % 64.
+
+    If a string's characters are a subset of another's, so is its mask.
+    """
+    mask = 0
+    for char in set(text):
+        mask |= 1 << (ord(char) & 63)
+    return mask
+
+
+def could_fuzzy_match(keyword, text, keyword_chars=None, text_chars=None):
+    """Cheap necessary condition for fuzz.WRatio(keyword, text) >= 90.
+
+    WRatio caps pairs whose lengths differ more than 8-fold at 60. Pairs that
+    differ more than 1.5-fold can only reach 90 through a perfect partial
+    ratio, which needs every character of the shorter string in the longer.
+
+    Args:
+        keyword: Keyword to match.
+        text: Field text to match the keyword against.
+        keyword_chars: Precomputed set of the keyword's characters (optional).
+        text_chars: Precomputed set of the text's characters (optional).
+
+    Returns:
+        False if the pair can be skipped, True if it must be scored.
+    """
+    if not keyword or not text:
+        return False
+
+    length_ratio = max(len(keyword), len(text)) / min(len(keyword), len(text))
+    if length_ratio > 8:
+        return False
+
+    if length_ratio > 1.5:
+        keyword_chars = keyword_chars or frozenset(keyword)
+        text_chars = text_chars or frozenset(text)
+        if len(keyword) <= len(text):
+            return keyword_chars <= text_chars
+        return text_chars <= keyword_chars
+
+    return True
+
+
+class CategoryMatcher:
+    """Scores and classifies search results against a set of categories.
+
+    Build it once per category configuration and reuse it for every request.
+    Rules are indexed by domain, pattern and keyword, so only categories
+    reached by one of an item's matches are scored; every other category
+    scores 0 without being looked at.
+
+    Categories excluded by another category (exclude_if_matched) are
+    evaluated after it, and skipped before fuzzy matching once the item is
+    known to belong to it. A ValueError is raised if exclusions form a cycle.
+
+    fuzzy_stats counts the (keyword, field) pairs of every non-empty field,
+    and how many of them were fuzzy scored or skipped. With a score_cache,
+    results already classified under the same rules version are not
+    classified again.
+    """
+
+    def __init__(self, category_configs, score_cache=None):
+        self.category_configs = category_configs
+        self.version = rules_version(category_configs)
+        self.score_cache = score_cache
+        self.rules = tuple(CategoryRule(name, category_config)
+                           for name, category_config in category_configs.items())
+        self.has_domains = any(rule.domains for rule in self.rules)
+
+        # Rules in exclusion dependency order, and the rules excluding each
+        self.evaluation_order, self.prerequisites = evaluation_order(self.rules)
+        self.evaluation_rank = {rule_index: rank for rank, rule_index
+                                in enumerate(self.evaluation_order)}
+        self.excludable_order = tuple(rule_index
+                                      for rule_index in self.evaluation_order
+                                      if self.prerequisites[rule_index])
+        self.patterns = PatternIndex(
+            pattern
+            for rule in self.rules
+            for pattern in (rule.url_patterns | rule.title_patterns
+                            | rule.lowered_keywords)
+        )
+
+        # Indices of the rules using each domain, pattern and keyword
+        self.domain_rules = index_rules(self.rules, "domains")
+        self.url_rules = index_rules(self.rules, "url_patterns")
+        self.title_rules = index_rules(self.rules, "title_patterns")
+        self.keyword_rules = index_rules(self.rules, "lowered_keywords")
+        self.fuzzy_keyword_rules = index_rules(self.rules, "keywords")
+
+        # Keywords sorted by length, with their lengths and character masks,
+        # to find those within fuzzy reach of a text
+        self.fuzzy_keywords = tuple(sorted(self.fuzzy_keyword_rules, key=len))
+        self.fuzzy_keyword_lengths = [len(keyword)
+                                      for keyword in self.fuzzy_keywords]
+        self.fuzzy_keyword_length_array = numpy.array(
+            self.fuzzy_keyword_lengths, dtype=numpy.int64)
+        self.fuzzy_keyword_masks = numpy.array(
+            [char_mask(keyword) for keyword in self.fuzzy_keywords],
+            dtype=numpy.uint64)
+        self.fuzzy_keyword_chars = {keyword: frozenset(keyword)
+                                    for keyword in self.fuzzy_keywords}
+        self.fuzzy_keyword_rule_sets = {
+            keyword: frozenset(rule_indices)
+            for keyword, rule_indices in self.fuzzy_keyword_rules.items()
+        }
+
+        self.fuzzy_stats = Counter()
+
+    def scan_item(self, search_item):
+        """Runs every exact (non-fuzzy) check on a search item.
+
+        Returns:
+            Tuple of (fields, domain, exact_hits, keyword_rules), where
+            exact_hits holds the lowercase patterns found in each field and
+            keyword_rules the indices of rules whose keywords matched exactly.
+        """
+        result = SearchResult.from_serpapi(search_item)
+        fields = (result.link, result.title, result.snippet)
+        domain = result.domain if self.has_domains else None
+        exact_hits = tuple(
+            self.patterns.find(text)
+            for text in (result.lowered_link, result.lowered_title,
+                         result.lowered_snippet))
+
+        keyword_rules = set()
+        for hits in exact_hits:
+            for pattern in hits:
+                for rule_index in self.keyword_rules.get(pattern, ()):
+                    rule = self.rules[rule_index]
+                    if not rule.must_contain_all or rule.lowered_keywords <= hits:
+                        keyword_rules.add(rule_index)
+
+        return fields, domain, exact_hits, keyword_rules
+
+    def decided_rules(self, scanned_item):
+        """Returns indices of rules that fuzzy keyword matching cannot change.
+
+        These are categories matched by a priority domain or whose keywords
+        already matched exactly.
+        """
+        _, domain, _, keyword_rules = scanned_item
+        decided = set(keyword_rules)
+        for rule_index in self.domain_rules.get(domain, ()):
+            if self.rules[rule_index].domain_priority:
+                decided.add(rule_index)
+        return decided
+
+    def settled_rules(self, scores):
+        """Returns indices of rules whose membership fuzzy matching cannot change.
+
+        These are categories already reaching MIN_CATEGORY_SCORE without
+        fuzzy matches, and categories excluded by one the item surely
+        belongs to.
+
+        Args:
+            scores: rule_scores result of the item without fuzzy matches.
+        """
+        matched = {rule_index for rule_index, score in scores
+                   if score >= MIN_CATEGORY_SCORE}
+        if not self.excludable_order:
+            return matched
+
+        # Matched categories are certain unless a category excluding them
+        # could still match
+        excluded = set()
+        certain = {rule_index for rule_index in matched
+                   if not self.prerequisites[rule_index]}
+        for rule_index in self.excludable_order:
+            prerequisites = self.prerequisites[rule_index]
+            if any(prerequisite in certain for prerequisite in prerequisites):
+                excluded.add(rule_index)
+            elif rule_index in matched and all(
+                    prerequisite in excluded for prerequisite in prerequisites):
+                certain.add(rule_index)
+
+        return matched | excluded
+
+    def assigned_rules(self, scores):
+        """Applies the threshold and exclusions to an item's scores.
+
+        Args:
+            scores: rule_scores result of the item.
+
+        Returns:
+            Sorted tuple of the indices of the categories the item belongs to.
+        """
+        matched = [rule_index for rule_index, score in scores
+                   if score >= MIN_CATEGORY_SCORE]
+        if not self.excludable_order:
+            return tuple(matched)
+
+        assigned = set()
+        for rule_index in sorted(matched, key=self.evaluation_rank.__getitem__):
+            if not any(prerequisite in assigned
+                       for prerequisite in self.prerequisites[rule_index]):
+                assigned.add(rule_index)
+
+        return tuple(sorted(assigned))
+
+    def fuzzy_candidates(self, text, text_chars):
+        """Returns the keywords for which could_fuzzy_match(keyword, text) holds.
+
+        Keywords more than 8 times shorter or longer than text are excluded
+        with two binary searches. When many keywords remain, those differing
+        in length more than 1.5-fold are first filtered for all keywords at
+        once, keeping only those where the character mask of the shorter
+        string is contained in that of the longer.
+        """
+        length = len(text)
+        start = bisect_left(self.fuzzy_keyword_lengths, length / 8)
+        end = bisect_right(self.fuzzy_keyword_lengths, length * 8)
+
+        if end - start >= VECTORIZED_PREFILTER_MIN_KEYWORDS:
+            lengths = self.fuzzy_keyword_length_array[start:end]
+            masks = self.fuzzy_keyword_masks[start:end]
+            text_mask = numpy.uint64(char_mask(text))
+
+            similar_length = ((lengths * 3 >= length * 2)
+                              & (length * 3 >= lengths * 2))
+            shorter_in_text = (lengths <= length) & ((masks & ~text_mask) == 0)
+            text_in_longer = (lengths > length) & ((text_mask & ~masks) == 0)
+
+            keep = numpy.flatnonzero(
+                similar_length | shorter_in_text | text_in_longer)
+            keywords = [self.fuzzy_keywords[start + offset]
+                        for offset in keep.tolist()]
+        else:
+            keywords = self.fuzzy_keywords[start:end]
+
+        return [keyword for keyword in keywords
+                if could_fuzzy_match(keyword, text,
+                                     self.fuzzy_keyword_chars[keyword],
+                                     text_chars)]
+
+    def fuzzy_keyword_hits(self, scanned_items, settled=None):
+        """Finds the fuzzy keyword matches of many items in a single batch.
+
+        Every field is exact-matched before any fuzzy scoring happens. Only
+        keywords within fuzzy reach of a field's length, of categories not
+        already settled, and passing could_fuzzy_match are scored, together,
+        in one rapidfuzz call.
+
+        Args:
+            scanned_items: Sequence of scan_item results.
+            settled: Sets of rule indices not needing fuzzy matches, one per
+                item (default: decided_rules of each item).
+
+        Returns:
+            List with, for each item, the set of fuzzily matching keywords of
+            each of its fields.
+        """
+        hits = [tuple(set() for _ in scanned_item[0])
+                for scanned_item in scanned_items]
+        pairs = []
+
+        for index, scanned_item in enumerate(scanned_items):
+            decided = (self.decided_rules(scanned_item) if settled is None
+                       else settled[index])
+            for position, text in enumerate(scanned_item[0]):
+                if not text:
+                    continue
+                self.fuzzy_stats["pairs"] += len(self.fuzzy_keywords)
+                for keyword in self.fuzzy_candidates(text, frozenset(text)):
+                    if not self.fuzzy_keyword_rule_sets[keyword] <= decided:
+                        pairs.append((index, position, keyword, text))
+
+        self.fuzzy_stats["scored"] += len(pairs)
+        self.fuzzy_stats["skipped"] = (self.fuzzy_stats["pairs"]
+                                       - self.fuzzy_stats["scored"])
+        if not pairs:
+            return hits
+
+        workers = FUZZY_WORKERS if len(pairs) >= PARALLEL_FUZZY_MIN_PAIRS else 1
+        scores = process.cpdist(
+            [keyword for _, _, keyword, _ in pairs],
+            [text for _, _, _, text in pairs],
+            scorer=fuzz.WRatio,
+            score_cutoff=FUZZY_KEYWORD_CUTOFF,
+            workers=workers,
+        )
+
+        # Scores below the cutoff are reported as 0
+        for pair_index in scores.nonzero()[0].tolist():
+            index, position, keyword, _ = pairs[pair_index]
+            hits[index][position].add(keyword)
+
+        return hits
+
+    def rule_scores(self, scanned_item, fuzzy_hits):
+        """Scores an item against the categories reached by its matches.
+
+        Args:
+            scanned_item: scan_item result of the item.
+            fuzzy_hits: Fuzzy keyword matches of the item's fields.
+
+        Returns:
+            Tuple of (rule index, score) pairs in rule order, for every
+            category with a nonzero score.
+        """
+        _, domain, exact_hits, keyword_rules = scanned_item
+        link_hits, title_hits, _ = exact_hits
+
+        domain_rules = set(self.domain_rules.get(domain, ()))
+        url_rules = {rule_index for pattern in link_hits
+                     for rule_index in self.url_rules.get(pattern, ())}
+        title_rules = {rule_index for pattern in title_hits
+                       for rule_index in self.title_rules.get(pattern, ())}
+
+        keyword_rules = set(keyword_rules)
+        for fuzzy in fuzzy_hits:
+            for keyword in fuzzy:
+                for rule_index in self.fuzzy_keyword_rules[keyword]:
+                    rule = self.rules[rule_index]
+                    if not rule.must_contain_all or rule.keyword_set <= fuzzy:
+                        keyword_rules.add(rule_index)
+
+        scores = []
+        for rule_index in sorted(domain_rules | url_rules | title_rules
+                                 | keyword_rules):
+            score = 0
+
+            if rule_index in domain_rules:
+                if self.rules[rule_index].domain_priority:
+                    scores.append((rule_index, DOMAIN_PRIORITY_SCORE))
+                    continue
+                score += DOMAIN_SCORE
+
+            if rule_index in url_rules:
+                score += URL_PATTERN_SCORE
+
+            if rule_index in title_rules:
+                score += TITLE_PATTERN_SCORE
+
+            if rule_index in keyword_rules:
+                score += KEYWORD_SCORE
+
+            scores.append((rule_index, score))
+
+        return tuple(scores)
+
+    def score_item(self, search_item):
+        """Scores a search item against every category.
+
+        Args:
+            search_item: SearchResult, or dict with 'link', 'title',
+                'snippet' keys.
+
+        Returns:
+            Dict mapping category names to integer scores (0-100).
+        """
+        scanned_item = self.scan_item(search_item)
+        fuzzy_hits = self.fuzzy_keyword_hits([scanned_item])[0]
+        scores = dict(self.rule_scores(scanned_item, fuzzy_hits))
+
+        return {rule.name: scores.get(rule_index, 0)
+                for rule_index, rule in enumerate(self.rules)}
+
+    def classify(self, search_items):
+        """Classifies search items into categories.
+
+        Args:
+            search_items: List of SearchResult objects or search result dicts.
+
+        Returns:
+            Dict with 'all' key containing all items, plus keys for each
+            category containing filtered items.
+        """
+        search_data = {"all": search_items}
+        for rule in self.rules:
+            search_data[rule.name] = []
+
+        search_results = [SearchResult.from_serpapi(search_item)
+                          for search_item in search_items]
+        item_rules = self.cached_categories(search_results)
+
+        # Exact matching for every unseen item, then fuzzy matching in one
+        # batch for categories it can still change
+        unseen = [index for index, rule_indices in enumerate(item_rules)
+                  if rule_indices is None]
+        scanned_items = [self.scan_item(search_results[index])
+                         for index in unseen]
+        exact_scores = [self.rule_scores(scanned_item, NO_FUZZY_HITS)
+                        for scanned_item in scanned_items]
+        fuzzy_hits = self.fuzzy_keyword_hits(
+            scanned_items, [self.settled_rules(scores) for scores in exact_scores])
+
+        for index, scanned_item, scores, item_fuzzy_hits in zip(
+                unseen, scanned_items, exact_scores, fuzzy_hits):
+            if any(item_fuzzy_hits):
+                scores = self.rule_scores(scanned_item, item_fuzzy_hits)
+            item_rules[index] = self.assigned_rules(scores)
+
+            if self.score_cache is not None:
+                self.score_cache.set(
+                    ScoreCache.key(search_results[index], self.version),
+                    item_rules[index])
+
+        for search_item, rule_indices in zip(search_items, item_rules):
+            for rule_index in rule_indices:
+                search_data[self.rules[rule_index].name].append(search_item)
+
+        return search_data
+
+    def cached_categories(self, search_results):
+        """Returns cached assigned_rules results, None for unseen items."""
+        if self.score_cache is None:
+            return [None] * len(search_results)
+
+        return [self.score_cache.get(ScoreCache.key(result, self.version))
+                for result in search_results]
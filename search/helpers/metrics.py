@@ -0,0 +1,349 @@
+"""Request stage timing and Prometheus metrics.
+
+When METRICS_ENABLED is set:
+- stage() times a block of code (SerpAPI call, classification, theme and
+  session handling, template rendering, HTML minification)
+- Stage timings of the current request are sent back in a Server-Timing
+  header by search.middleware.ServerTimingMiddleware
+- Stage latencies are aggregated into histograms, alongside counters of
+  SerpAPI requests, SerpAPI errors by error code, coalesced SerpAPI calls,
+  results per category, response cache lookups, prefetches and search
+  provider responses, hedges and fail-fasts, deep fills, raw queries
+  folded into canonical forms and page cache lookups, all served in the
+  Prometheus text format by the /metrics view
+
+The 429 rate is serpapi_errors_total{code="429"} / serpapi_requests_total,
+and the cache hit ratio that of search_cache_lookups_total{result="hit"}
+and {result="stale"} to all lookups.
+
+/metrics is served to requests with the METRICS_TOKEN bearer token, and to
+staff users. Metrics are kept per process. When disabled, stage() returns a shared no-op
+timer and the record functions return immediately.
+"""
+
+import hmac
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+
+from decouple import config
+
+# Whether stage timers, the Server-Timing header and /metrics are active
+METRICS_ENABLED = config("METRICS_ENABLED", default=False, cast=bool)
+
+# Bearer token scrapers send to /metrics ("" allows staff users only)
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
+# Prefix of every exported metric name
+METRIC_PREFIX = "devxplore_"
+
+# Upper bounds, in seconds, of the stage latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+# Content type of the Prometheus text exposition format
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Help text of each exported metric
+METRIC_HELP = {
+    "stage_duration_seconds": "Time spent in each stage of a search request.",
+    "serpapi_requests_total": "SerpAPI searches performed.",
+    "serpapi_errors_total": "SerpAPI searches that failed, by error code.",
+    "category_results_total": "Search results classified into each category.",
+    "search_cache_lookups_total": "SerpAPI response cache lookups, by result.",
+    "serpapi_coalesced_total": "Identical SerpAPI calls that waited for an "
+                               "in-flight one, and waits that timed out.",
+    "prefetch_total": "Next page prefetches, by outcome.",
+    "provider_responses_total": "Search provider responses, by provider and "
+                                "error code (\"ok\" without error).",
+    "provider_hedges_total": "Searches sent to a further provider, because "
+                             "the previous one was slow (hedge) or failed "
+                             "(failover).",
+    "upstream_guard_total": "Searches failed fast by the rate limiter, "
+                            "circuit breaker or in-flight cap, and breaker "
+                            "state changes, by provider and outcome.",
+    "deep_fill_total": "Deep fills of sparse tabs and the windows they "
+                       "fetched, by outcome.",
+    "query_folds_total": "Distinct raw queries seen, by whether they started "
+                         "a canonical form (new) or folded into one seen "
+                         "before (folded).",
+    "page_cache_lookups_total": "Rendered search page cache lookups, by "
+                                "result.",
+}
+
+# Stage timings of the request being handled, or None outside a request
+REQUEST_TIMINGS = ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    """Latency histogram with fixed bucket bounds."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        """Adds a value to the bucket of the lowest bound it does not exceed."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+    def cumulative_counts(self):
+        """Returns (upper bound, count of values <= bound) pairs, ending at +Inf."""
+        bounds = [format_value(bound) for bound in self.buckets] + ["+Inf"]
+        running = 0
+        cumulative = []
+        for bound, count in zip(bounds, self.counts):
+            running += count
+            cumulative.append((bound, running))
+        return cumulative
+
+
+class MetricsRegistry:
+    """Thread-safe store of stage histograms and labelled counters."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.stage_durations = {}
+        self.counters = {}
+
+    def observe_stage(self, name, seconds):
+        """Records how long a stage took."""
+        with self.lock:
+            histogram = self.stage_durations.get(name)
+            if histogram is None:
+                histogram = self.stage_durations[name] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, labels=(), amount=1):
+        """Adds amount to the counter name with the given (label, value) pairs."""
+        with self.lock:
+            key = (name, labels)
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def clear(self):
+        """Drops every recorded value."""
+        with self.lock:
+            self.stage_durations.clear()
+            self.counters.clear()
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+
+        with self.lock:
+            if self.stage_durations:
+                name = METRIC_PREFIX + "stage_duration_seconds"
+                lines.append(f"# HELP {name} "
+                             f"{METRIC_HELP['stage_duration_seconds']}")
+                lines.append(f"# TYPE {name} histogram")
+                for stage_name, histogram in sorted(self.stage_durations.items()):
+                    stage_label = (("stage", stage_name),)
+                    for bound, count in histogram.cumulative_counts():
+                        lines.append(f"{name}_bucket"
+                                     f"{format_labels(stage_label + (('le', bound),))}"
+                                     f" {count}")
+                    lines.append(f"{name}_sum{format_labels(stage_label)} "
+                                 f"{format_value(histogram.total)}")
+                    lines.append(f"{name}_count{format_labels(stage_label)} "
+                                 f"{sum(histogram.counts)}")
+
+            counter_names = sorted({name for name, _ in self.counters})
+            for counter_name in counter_names:
+                name = METRIC_PREFIX + counter_name
+                lines.append(f"# HELP {name} {METRIC_HELP.get(counter_name, '')}")
+                lines.append(f"# TYPE {name} counter")
+                for (other_name, labels), value in sorted(self.counters.items()):
+                    if other_name == counter_name:
+                        lines.append(f"{name}{format_labels(labels)} "
+                                     f"{format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def format_value(value):
+    """Formats a sample value, without a trailing .0 for whole numbers."""
+    return repr(float(value)).removesuffix(".0")
+
+
+def format_labels(labels):
+    """Formats (label, value) pairs as a Prometheus label set."""
+    if not labels:
+        return ""
+    escaped = (
+        (label, str(value).replace("\\", "\\\\").replace('"', '\\"')
+         .replace("\n", "\\n"))
+        for label, value in labels
+    )
+    return "{" + ",".join(f'{label}="{value}"' for label, value in escaped) + "}"
+
+
+# Metrics of this process
+REGISTRY = MetricsRegistry()
+
+
+class NullTimer:
+    """Stage timer used while metrics are disabled; does nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class StageTimer:
+    """Times a stage into its histogram and the current request's timings."""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        REGISTRY.observe_stage(self.name, elapsed)
+
+        timings = REQUEST_TIMINGS.get()
+        if timings is not None:
+            timings[self.name] = timings.get(self.name, 0.0) + elapsed
+        return False
+
+
+def stage(name):
+    """Returns a context manager timing the stage name, if metrics are enabled.
+
+    Args:
+        name: Stage name, used as Server-Timing metric name and histogram label.
+
+    Returns:
+        StageTimer, or the shared no-op NULL_TIMER when metrics are disabled.
+    """
+    if not METRICS_ENABLED:
+        return NULL_TIMER
+    return StageTimer(name)
+
+
+def record_serpapi_response(error_code):
+    """Counts a SerpAPI search, and its error code if it failed."""
+    if not METRICS_ENABLED:
+        return
+
+    REGISTRY.increment("serpapi_requests_total")
+    if error_code:
+        REGISTRY.increment("serpapi_errors_total",
+                           (("code", str(error_code)),))
+
+
+def record_category_results(results):
+    """Counts the results classified into each category of a search."""
+    if not METRICS_ENABLED:
+        return
+
+    for category, search_items in results.items():
+        if search_items:
+            REGISTRY.increment("category_results_total",
+                               (("category", category),), len(search_items))
+
+
+def record_search_cache_lookup(result):
+    """Counts a response cache lookup ("hit", "stale" or "miss")."""
+    if not METRICS_ENABLED:
+        return
+
+    REGISTRY.increment("search_cache_lookups_total", (("result", result),))
+
+
+def record_single_flight(outcome):
+    """Counts a call coalesced into an in-flight one ("follower" or "timeout")."""
+    if not METRICS_ENABLED:
+        return
+
+    REGISTRY.increment("serpapi_coalesced_total", (("outcome", outcome),))
+
+
+def record_prefetch(outcome):
+    """Counts a prefetch outcome (e.g. "scheduled", "fetched", "dropped")."""
+    if not METRICS_ENABLED:
+        return
+
+    REGISTRY.increment("prefetch_total", (("outcome", outcome),))
+
+
+def record_provider_response(provider, error_code):
+    """Counts a search provider response, by its error code ("ok" if none)."""
+    if not METRICS_ENABLED:
+        return
+
+    REGISTRY.increment("provider_responses_total",
+                       (("provider", provider),
+                        ("code", str(error_code or "ok"))))
+
+
+def record_provider_hedge(reason):
+    """Counts a search sent to a further provider ("hedge" or "failover")."""
+    if not METRICS_ENABLED:
+        return
+
+    REGISTRY.increment("provider_hedges_total", (("reason", reason),))
+
+
+def record_upstream_guard(provider, outcome):
+    """Counts a quota or circuit breaker outcome ("rate_limited", "rejected",
+    "saturated", "opened", "probe" or "closed") of a provider."""
+    if not METRICS_ENABLED:
+        return
+
+    REGISTRY.increment("upstream_guard_total",
+                       (("provider", provider), ("outcome", outcome)))
+
+
+def record_deep_fill(outcome):
+    """Counts a deep fill outcome (e.g. "page", "filled", "partial", "deadline")."""
+    if not METRICS_ENABLED:
+        return
+
+    REGISTRY.increment("deep_fill_total", (("outcome", outcome),))
+
+
+def record_page_cache_lookup(result):
+    """Counts a rendered page cache lookup ("hit" or "miss")."""
+    if not METRICS_ENABLED:
+        return
+
+    REGISTRY.increment("page_cache_lookups_total", (("result", result),))
+
+
+def record_query_fold(outcome):
+    """Counts a distinct raw query ("new" or "folded" into a known form)."""
+    if not METRICS_ENABLED:
+        return
+
+    REGISTRY.increment("query_folds_total", (("outcome", outcome),))
+
+
+def scrape_allowed(request):
+    """Whether a request may read /metrics (METRICS_TOKEN or a staff user)."""
+    if request.user.is_staff:
+        return True
+
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return bool(METRICS_TOKEN) and scheme.lower() == "bearer" and (
+        hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()))
+
+
+def server_timing_header(timings):
+    """Formats stage timings (in seconds) as a Server-Timing header value."""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}"
+                     for name, seconds in timings.items())
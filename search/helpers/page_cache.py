@@ -0,0 +1,101 @@
+"""Full-page cache of search result pages.
+
+Search pages do not depend on the user beyond the theme, so rendered pages
+are cached in a Django cache (see PAGE_CACHE_ALIAS) and served by
+search.middleware.PageCacheMiddleware, skipping the search, classification,
+rendering and HTML minification:
+- Pages are keyed on the canonical query, the page and the theme of the
+  session (none, light or dark); as pages echo the query as typed (search
+  box, pagination and theme links), the typed text is part of the key too.
+  Queries typed differently still share the cached search response
+- Only pages the view marks cacheable (a Cache-Control max-age, see
+  views.cache_headers) are stored, for PAGE_CACHE_TTL seconds: not error or
+  "limit reached" pages, nor theme switches, which update the session
+- Cache-Control and Vary: Cookie let a CDN or reverse proxy serve repeat hits
+  too. They depend on the request (pages of sessions, which may hold a
+  theme, are private), so they are not stored but set again on every hit
+
+Lookups are counted in the search metrics. A cache that cannot be reached is
+treated as a miss.
+"""
+
+import hashlib
+
+from decouple import config
+from django.core.cache import caches
+
+from . import metrics
+
+# Seconds a rendered search page is served from cache (0 disables caching)
+PAGE_CACHE_TTL = config("PAGE_CACHE_TTL", default=300, cast=int)
+
+# Django cache alias storing rendered pages
+PAGE_CACHE_ALIAS = config("PAGE_CACHE_ALIAS", default="default")
+
+# Bumped when the format of cached entries changes
+CACHE_KEY_VERSION = 3
+
+# Response headers stored with a page, the same for every request
+CACHED_HEADERS = ("Content-Type",)
+
+
+class PageCache:
+    """Caches rendered search pages in a Django cache."""
+
+    def __init__(self, alias=PAGE_CACHE_ALIAS, ttl=PAGE_CACHE_TTL):
+        self.alias = alias
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        """The Django cache pages are stored in."""
+        return caches[self.alias]
+
+    @property
+    def enabled(self):
+        """Whether pages are cached (PAGE_CACHE_TTL is set)."""
+        return self.ttl > 0
+
+    @staticmethod
+    def key(canonical_query, query, page_index, theme):
+        """Returns the cache key of a page.
+
+        Args:
+            canonical_query: Canonical form of the query.
+            query: Query as typed, echoed by the page.
+            page_index: Starting index of the page.
+            theme: Theme of the session, or None if it has none.
+        """
+        content = f"{canonical_query}\0{query}\0{page_index}\0{theme or ''}"
+        digest = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+        return f"page:{CACHE_KEY_VERSION}:{digest}"
+
+    def get(self, key):
+        """Returns the cached entry of key, or None if missing or unreachable."""
+        try:
+            entry = self.cache.get(key)
+        except Exception:
+            entry = None
+
+        metrics.record_page_cache_lookup("miss" if entry is None else "hit")
+        return entry
+
+    def set(self, key, response, record_suggestion=False):
+        """Stores a rendered page, with the headers it is served with.
+
+        Args:
+            key: Cache key of the page.
+            response: HttpResponse of the page.
+            record_suggestion: Whether hits count as searches of the query
+                for suggestions.
+        """
+        entry = {
+            "content": response.content,
+            "headers": {header: response[header] for header in CACHED_HEADERS
+                        if header in response},
+            "record_suggestion": record_suggestion,
+        }
+        try:
+            self.cache.set(key, entry, timeout=self.ttl)
+        except Exception:
+            pass
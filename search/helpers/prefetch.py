@@ -0,0 +1,127 @@
+"""Speculative background work, such as prefetching the next results page.
+
+When PREFETCH_NEXT_PAGE is set, perform_search_v2 schedules the next page of
+a search to be fetched and classified into the caches while the current
+page is served, so a click on "next" is answered from cache. Prefetching is
+bounded so it never competes with real searches for quota:
+- At most PREFETCH_WORKERS prefetches run at once, and at most
+  PREFETCH_MAX_PENDING wait; further ones are dropped
+- Upstream calls made by prefetches are limited to PREFETCH_HOURLY_BUDGET
+  per hour, counted in the Django cache across processes
+- After any SerpAPI 429 ("run out of searches"), prefetching stops for
+  PREFETCH_BACKOFF seconds
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from decouple import config
+from django.core.cache import caches
+
+from . import metrics
+from .quota import HourlyBudget
+
+# Whether the next page of each search is prefetched
+PREFETCH_NEXT_PAGE = config("PREFETCH_NEXT_PAGE", default=False, cast=bool)
+
+# Prefetches running at once
+PREFETCH_WORKERS = config("PREFETCH_WORKERS", default=2, cast=int)
+
+# Prefetches waiting to run, beyond which new ones are dropped
+PREFETCH_MAX_PENDING = config("PREFETCH_MAX_PENDING", default=16, cast=int)
+
+# Upstream calls prefetches may make per hour, across processes
+PREFETCH_HOURLY_BUDGET = config("PREFETCH_HOURLY_BUDGET", default=100,
+                                cast=int)
+
+# Seconds without prefetching after SerpAPI reports running out of searches
+PREFETCH_BACKOFF = config("PREFETCH_BACKOFF", default=900, cast=int)
+
+# Django cache alias holding the budget and back-off state
+PREFETCH_CACHE_ALIAS = config("PREFETCH_CACHE_ALIAS", default="default")
+
+BACKOFF_KEY = "prefetch:backoff"
+
+
+class Prefetcher:
+    """Runs speculative tasks in a bounded background thread pool."""
+
+    def __init__(self, enabled=PREFETCH_NEXT_PAGE, workers=PREFETCH_WORKERS,
+                 max_pending=PREFETCH_MAX_PENDING,
+                 hourly_budget=PREFETCH_HOURLY_BUDGET,
+                 backoff=PREFETCH_BACKOFF, alias=PREFETCH_CACHE_ALIAS):
+        self.enabled = enabled
+        self.workers = workers
+        self.max_pending = max_pending
+        self.hourly_budget = hourly_budget
+        self.budget = HourlyBudget("prefetch", hourly_budget, alias)
+        self.backoff = backoff
+        self.alias = alias
+        self.lock = Lock()
+        self.tasks = {}
+        self.executor = None
+
+    @property
+    def cache(self):
+        """The Django cache holding the budget and back-off state."""
+        return caches[self.alias]
+
+    def schedule(self, key, func, *args):
+        """Runs func(*args) in the background, unless disabled or saturated.
+
+        Args:
+            key: Key identifying the task; a task already scheduled under
+                the same key is not scheduled again.
+            func: Function to run.
+
+        Returns:
+            True if the task was scheduled.
+        """
+        if not self.enabled:
+            return False
+
+        if self.backing_off():
+            metrics.record_prefetch("backoff")
+            return False
+
+        with self.lock:
+            if key in self.tasks:
+                return False
+            if len(self.tasks) >= self.workers + self.max_pending:
+                metrics.record_prefetch("dropped")
+                return False
+
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="prefetch")
+            future = self.executor.submit(func, *args)
+            self.tasks[key] = future
+
+        metrics.record_prefetch("scheduled")
+        future.add_done_callback(lambda _: self.tasks.pop(key, None))
+        return True
+
+    def take_budget(self):
+        """Counts an upstream call against the hourly budget.
+
+        Returns:
+            False if the budget of the current hour is spent.
+        """
+        within_budget = self.budget.take()
+        if not within_budget:
+            metrics.record_prefetch("over_budget")
+        return within_budget
+
+    def back_off(self):
+        """Stops prefetching for a while, e.g. after a SerpAPI 429."""
+        try:
+            self.cache.set(BACKOFF_KEY, True, timeout=self.backoff)
+        except Exception:
+            pass
+
+    def backing_off(self):
+        """Whether prefetching is paused by back_off."""
+        try:
+            return bool(self.cache.get(BACKOFF_KEY))
+        except Exception:
+            return True
@@ -0,0 +1,507 @@
+"""Search providers, and strategies combining several of them.
+
+A provider runs a search and returns a response shaped like that of
+call_serpapi: a dict with "organic_results" and "pagination", or
+{"error_code": ...} on failure. Besides SerpAPI, Google Custom Search can be
+used once GOOGLE_CSE_API_KEY and GOOGLE_CSE_ID are set.
+
+With several providers in SEARCH_PROVIDERS (in order of preference),
+SEARCH_PROVIDER_STRATEGY picks how they are combined:
+- hedge: ask the first provider, then the next one if it fails or has not
+  answered within its recent p95 latency, and keep the first good answer
+- race: ask every provider at once and keep the first good answer
+- merge: ask every provider at once and merge their results, deduplicated
+  by link
+
+Each provider is guarded by a shared TokenBucket and CircuitBreaker (see the
+quota module): while out of quota or failing, it answers with an error
+without being called, so another provider is tried at once. Only answers of
+the upstream itself reach the on_answer hook of the provider.
+
+Providers that have not answered within SEARCH_DEADLINE seconds are given up
+on, though their searches keep running on the shared thread pool. So that a
+stalled provider cannot fill the pool, each one runs at most
+SEARCH_PROVIDER_MAX_IN_FLIGHT searches at once, and fails fast beyond. When
+no provider answers, the most telling error is returned: "no
+results" (400), then "run out of searches" (429), then a server error (500).
+"""
+
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from itertools import zip_longest
+from threading import Lock, local
+from urllib.parse import urlsplit
+
+import httplib2
+from asgiref.sync import sync_to_async
+from decouple import Csv, config
+from django.core.exceptions import ImproperlyConfigured
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+from . import metrics
+from .quota import CircuitBreaker, TokenBucket
+
+# Providers searched, in order of preference ("serpapi", "google_cse")
+SEARCH_PROVIDERS = config("SEARCH_PROVIDERS", default="serpapi", cast=Csv())
+
+# How several providers are combined: "hedge", "race" or "merge"
+SEARCH_PROVIDER_STRATEGY = config("SEARCH_PROVIDER_STRATEGY", default="hedge")
+
+# Seconds after which providers that have not answered are given up on
+SEARCH_DEADLINE = config("SEARCH_DEADLINE", default=8.0, cast=float)
+
+# Seconds before hedging, until a provider has enough latencies for its p95
+SEARCH_HEDGE_DELAY = config("SEARCH_HEDGE_DELAY", default=1.0, cast=float)
+
+# Threads running provider searches
+SEARCH_PROVIDER_WORKERS = config("SEARCH_PROVIDER_WORKERS", default=16,
+                                 cast=int)
+
+# Searches a provider runs at once on the threads, beyond which it fails fast
+# (0 for an equal share of SEARCH_PROVIDER_WORKERS)
+SEARCH_PROVIDER_MAX_IN_FLIGHT = config("SEARCH_PROVIDER_MAX_IN_FLIGHT",
+                                       default=0, cast=int)
+
+# Searches per hour allowed by the SerpAPI plan (0 for no limit)
+SERPAPI_HOURLY_LIMIT = config("SERPAPI_HOURLY_LIMIT", default=0, cast=int)
+
+# Searches per hour allowed on Google Custom Search (0 for no limit)
+GOOGLE_CSE_HOURLY_LIMIT = config("GOOGLE_CSE_HOURLY_LIMIT", default=0,
+                                 cast=int)
+
+# Google Custom Search API key and search engine ID
+GOOGLE_CSE_API_KEY = config("GOOGLE_CSE_API_KEY", default="")
+GOOGLE_CSE_ID = config("GOOGLE_CSE_ID", default="")
+
+# Seconds to wait for Google Custom Search to answer
+GOOGLE_CSE_TIMEOUT = config("GOOGLE_CSE_TIMEOUT", default=10.0, cast=float)
+
+# Reasons of Custom Search 403 errors meaning the quota is spent, lowercased
+# without underscores
+CSE_QUOTA_REASONS = frozenset(("dailylimitexceeded", "ratelimitexceeded",
+                               "userratelimitexceeded", "quotaexceeded"))
+
+# Latencies kept per provider to estimate its p95
+LATENCY_WINDOW = 200
+
+# Latencies needed before the p95 replaces SEARCH_HEDGE_DELAY
+MIN_LATENCY_SAMPLES = 20
+
+STRATEGIES = ("hedge", "race", "merge")
+
+
+class ProviderLatency:
+    """Recent search latencies of a provider."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.lock = Lock()
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds):
+        """Adds the latency of a search."""
+        with self.lock:
+            self.samples.append(seconds)
+
+    def p95(self):
+        """Returns the 95th percentile latency, or None without enough samples."""
+        with self.lock:
+            samples = sorted(self.samples)
+
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[int(len(samples) * 0.95) - 1]
+
+
+class SearchProvider:
+    """A search backend answering with call_serpapi-style responses."""
+
+    name = None
+
+    # Coroutine function searching without blocking, if the provider has one
+    asearch = None
+
+    def __init__(self, hourly_limit=0, on_answer=None):
+        self.latency = ProviderLatency()
+        self.bucket = TokenBucket(self.name, hourly_limit)
+        self.breaker = CircuitBreaker(self.name)
+        self.on_answer = on_answer
+
+    def search(self, query, page_index):
+        """Returns the response of a search (see the module docstring)."""
+        raise NotImplementedError
+
+    def timed_search(self, query, page_index):
+        """Runs search unless failing fast, recording its latency and outcome."""
+        api_response = self.fail_fast()
+        if api_response is not None:
+            return api_response
+
+        start = time.perf_counter()
+        try:
+            api_response = self.search(query, page_index)
+        except Exception:
+            api_response = {"error_code": 500}
+
+        self.settle(api_response, time.perf_counter() - start)
+        return api_response
+
+    async def atimed_search(self, query, page_index):
+        """Async version of timed_search, awaiting asearch."""
+        api_response = await sync_to_async(self.fail_fast)()
+        if api_response is not None:
+            return api_response
+
+        start = time.perf_counter()
+        try:
+            api_response = await self.asearch(query, page_index)
+        except Exception:
+            api_response = {"error_code": 500}
+
+        await sync_to_async(self.settle)(api_response,
+                                         time.perf_counter() - start)
+        return api_response
+
+    def fail_fast(self):
+        """Returns the error response of a search not sent upstream, or None."""
+        error_code = self.breaker.rejection()
+        if error_code is None and not self.bucket.take():
+            metrics.record_upstream_guard(self.name, "rate_limited")
+            error_code = 429
+        return None if error_code is None else {"error_code": error_code}
+
+    def settle(self, api_response, seconds):
+        """Records the latency and outcome of an upstream search.
+
+        Searches failed fast are never settled, so errors the guards produce
+        locally are not taken for answers of the upstream.
+        """
+        error_code = api_response.get("error_code")
+        self.latency.record(seconds)
+        self.breaker.record(error_code)
+        metrics.record_provider_response(self.name, error_code)
+        if self.on_answer is not None:
+            self.on_answer(self.name, api_response)
+
+
+class FunctionProvider(SearchProvider):
+    """A provider searching with a function, such as call_serpapi."""
+
+    def __init__(self, name, search, asearch=None, hourly_limit=0,
+                 on_answer=None):
+        self.name = name
+        super().__init__(hourly_limit, on_answer)
+        self.search = search
+        self.asearch = asearch
+
+
+class GoogleCseProvider(SearchProvider):
+    """Google Custom Search JSON API provider."""
+
+    name = "google_cse"
+
+    def __init__(self, api_key=GOOGLE_CSE_API_KEY, engine_id=GOOGLE_CSE_ID,
+                 timeout=GOOGLE_CSE_TIMEOUT,
+                 hourly_limit=GOOGLE_CSE_HOURLY_LIMIT, on_answer=None):
+        super().__init__(hourly_limit, on_answer)
+        if not api_key or not engine_id:
+            raise ImproperlyConfigured(
+                "The google_cse search provider needs GOOGLE_CSE_API_KEY and "
+                "GOOGLE_CSE_ID")
+        self.api_key = api_key
+        self.engine_id = engine_id
+        self.timeout = timeout
+        self.local = local()
+
+    @property
+    def service(self):
+        """Custom Search service of the current thread (httplib2 is not thread-safe)."""
+        service = getattr(self.local, "service", None)
+        if service is None:
+            service = self.local.service = build(
+                "customsearch", "v1", developerKey=self.api_key,
+                http=httplib2.Http(timeout=self.timeout),
+                cache_discovery=False)
+        return service
+
+    def search(self, query, page_index):
+        try:
+            response = self.service.cse().list(
+                q=query, cx=self.engine_id, start=page_index + 1, num=10,
+                safe="active").execute()
+        except HttpError as error:
+            return {"error_code": cse_error_code(error)}
+
+        return cse_response(response, page_index)
+
+
+def cse_error_code(error):
+    """Returns the error code of a Custom Search HttpError.
+
+    Custom Search reports a spent quota as a 429, or as a 403 whose reason is
+    rateLimitExceeded, dailyLimitExceeded, ...; those are 429s, anything
+    else a server error (500).
+    """
+    if error.resp.status == 429:
+        return 429
+
+    if error.resp.status == 403 and isinstance(error.error_details, list):
+        reasons = {str(detail.get("reason", "")).lower().replace("_", "")
+                   for detail in error.error_details
+                   if isinstance(detail, dict)}
+        if reasons & CSE_QUOTA_REASONS:
+            return 429
+
+    return 500
+
+
+def cse_response(response, page_index):
+    """Converts a Custom Search response to a call_serpapi-style response.
+
+    Args:
+        response: Dict of the Custom Search JSON API response.
+        page_index: Starting index of the search.
+    """
+    items = response.get("items")
+    if not items:
+        return {"error_code": 400}
+
+    queries = response.get("queries", {})
+    return {
+        "organic_results": [
+            {
+                "position": page_index + position,
+                "link": item.get("link"),
+                "title": item.get("title"),
+                "snippet": item.get("snippet"),
+                "displayed_link": item.get("displayLink"),
+            }
+            for position, item in enumerate(items, 1)
+        ],
+        "pagination": {
+            "next": bool(queries.get("nextPage")),
+            "previous": bool(queries.get("previousPage")),
+        },
+    }
+
+
+def link_key(link):
+    """Returns the form of a link under which duplicates are merged."""
+    parts = urlsplit(link or "")
+    host = parts.netloc.lower().removeprefix("www.")
+    return host, parts.path.rstrip("/"), parts.query
+
+
+def merge_responses(responses):
+    """Merges the results of several responses, deduplicated by link.
+
+    Results are interleaved by rank, ties going to the earlier response, and
+    there are next/previous pages if any response has them.
+    """
+    organic_results = []
+    seen = set()
+    ranked = zip_longest(*(response.get("organic_results", [])
+                           for response in responses))
+    for same_rank in ranked:
+        for organic_result in same_rank:
+            if organic_result is None:
+                continue
+            key = link_key(organic_result.get("link"))
+            if key in seen:
+                continue
+            seen.add(key)
+            organic_results.append({**organic_result,
+                                    "position": len(organic_results) + 1})
+
+    paginations = [response.get("pagination", {}) for response in responses]
+    return {
+        **responses[0],
+        "organic_results": organic_results,
+        "pagination": {
+            **paginations[0],
+            "next": next((pagination["next"] for pagination in paginations
+                          if pagination.get("next")), False),
+            "previous": next((pagination["previous"]
+                              for pagination in paginations
+                              if pagination.get("previous")), False),
+        },
+    }
+
+
+def failed_response(responses):
+    """Returns the most telling error of failed responses (see module docstring)."""
+    error_codes = {response.get("error_code") for response in responses}
+    for error_code in (400, 429):
+        if error_code in error_codes:
+            return {"error_code": error_code}
+    return {"error_code": 500}
+
+
+class MultiProviderSearch:
+    """Searches one or several providers, combined by a strategy."""
+
+    def __init__(self, providers, strategy=SEARCH_PROVIDER_STRATEGY,
+                 deadline=SEARCH_DEADLINE, hedge_delay=SEARCH_HEDGE_DELAY,
+                 workers=SEARCH_PROVIDER_WORKERS,
+                 max_in_flight=SEARCH_PROVIDER_MAX_IN_FLIGHT):
+        if strategy not in STRATEGIES:
+            raise ImproperlyConfigured(
+                f"Unknown SEARCH_PROVIDER_STRATEGY {strategy!r}, expected "
+                f"one of {', '.join(STRATEGIES)}")
+        self.providers = tuple(providers)
+        self.names = tuple(provider.name for provider in self.providers)
+        self.strategy = strategy
+        self.deadline = deadline
+        self.hedge_delay = hedge_delay
+        self.workers = workers
+        self.max_in_flight = (max_in_flight
+                              or max(1, workers // len(self.providers)))
+        self.lock = Lock()
+        self.executor = None
+        self.in_flight = {}
+
+    def search(self, query, page_index):
+        """Returns the response of a search, combining the providers.
+
+        Args:
+            query: Search query string.
+            page_index: Starting index for pagination.
+
+        Returns:
+            Dict containing the response, or error_code on failure.
+        """
+        if len(self.providers) == 1:
+            return self.providers[0].timed_search(query, page_index)
+        if self.strategy == "merge":
+            return self.merged(query, page_index)
+        return self.first_answer(query, page_index,
+                                 hedged=self.strategy == "hedge")
+
+    async def asearch(self, query, page_index):
+        """Async version of search.
+
+        A single provider with an asearch is awaited without blocking;
+        otherwise the providers are combined in a worker thread.
+        """
+        if len(self.providers) == 1 and self.providers[0].asearch is not None:
+            return await self.providers[0].atimed_search(query, page_index)
+        return await sync_to_async(self.search, thread_sensitive=False)(
+            query, page_index)
+
+    def submit(self, provider, query, page_index):
+        """Starts a search of provider in the background.
+
+        A provider already running max_in_flight searches, e.g. waiting on a
+        stalled upstream, fails fast with a server error instead of queueing
+        more searches behind them.
+        """
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="search-provider")
+            in_flight = self.in_flight.get(provider, 0)
+            if in_flight < self.max_in_flight:
+                self.in_flight[provider] = in_flight + 1
+
+        if in_flight >= self.max_in_flight:
+            metrics.record_upstream_guard(provider.name, "saturated")
+            future = Future()
+            future.set_result({"error_code": 500})
+            return future
+
+        future = self.executor.submit(provider.timed_search, query, page_index)
+        future.add_done_callback(lambda _: self.release(provider))
+        return future
+
+    def release(self, provider):
+        """Counts a search of provider as finished."""
+        with self.lock:
+            self.in_flight[provider] -= 1
+
+    def first_answer(self, query, page_index, hedged):
+        """Returns the first good answer, asking providers all at once or hedged."""
+        deadline = time.monotonic() + self.deadline
+        waiting = list(self.providers)
+        pending = {}
+        failed = []
+        hedge_at = None
+
+        def ask(reason=None):
+            nonlocal hedge_at
+            provider = waiting.pop(0)
+            pending[self.submit(provider, query, page_index)] = provider
+            hedge_at = time.monotonic() + (provider.latency.p95()
+                                           or self.hedge_delay)
+            if reason:
+                metrics.record_provider_hedge(reason)
+
+        ask()
+        while waiting and not hedged:
+            ask()
+
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if waiting and (not pending or now >= hedge_at):
+                ask("hedge" if pending else "failover")
+                continue
+            if not pending:
+                break
+
+            wake_at = min(deadline, hedge_at) if waiting else deadline
+            done, _ = wait(pending, timeout=wake_at - now,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                del pending[future]
+                api_response = future.result()
+                if "error_code" not in api_response:
+                    return api_response
+                failed.append(api_response)
+
+        return failed_response(failed)
+
+    def merged(self, query, page_index):
+        """Returns the merged answers of every provider within the deadline."""
+        futures = [self.submit(provider, query, page_index)
+                   for provider in self.providers]
+        wait(futures, timeout=self.deadline)
+
+        responses = [future.result() for future in futures if future.done()]
+        answers = [api_response for api_response in responses
+                   if "error_code" not in api_response]
+        if not answers:
+            return failed_response(responses)
+        return merge_responses(answers)
+
+
+def configured_providers(serpapi_search, serpapi_asearch=None,
+                         names=SEARCH_PROVIDERS, on_answer=None):
+    """Returns the providers named in SEARCH_PROVIDERS, in order.
+
+    Args:
+        serpapi_search: Function searching SerpAPI, such as call_serpapi.
+        serpapi_asearch: Coroutine function searching SerpAPI, such as
+            call_serpapi_async.
+        names: Provider names.
+        on_answer: Function called with the provider name and response of
+            every search the upstream answered.
+
+    Raises:
+        ImproperlyConfigured: For unknown or unconfigured providers.
+    """
+    providers = []
+    for name in names:
+        if name == "serpapi":
+            providers.append(FunctionProvider(
+                "serpapi", serpapi_search, serpapi_asearch,
+                hourly_limit=SERPAPI_HOURLY_LIMIT, on_answer=on_answer))
+        elif name == "google_cse":
+            providers.append(GoogleCseProvider(on_answer=on_answer))
+        else:
+            raise ImproperlyConfigured(f"Unknown search provider {name!r}")
+
+    if not providers:
+        raise ImproperlyConfigured("SEARCH_PROVIDERS names no provider")
+    return providers
@@ -0,0 +1,145 @@
+"""Canonical forms of search queries.
+
+"Django ORM", "django  orm " and "ＤＪＡＮＧＯ ORM" are the same search. Queries
+are canonicalized before any upstream call or cache lookup, so they share
+one SerpAPI call and one cache entry:
+- Unicode NFKC normalization (full-width letters, ligatures, ...)
+- Case folding and collapsing of whitespace
+- Removal of tracking parameters (utm_*, gclid, fbclid, ...) from URLs
+  pasted into the query, when QUERY_STRIP_TRACKING is set
+- Removal of stopwords ("how to", "the", ...), when QUERY_STRIP_STOPWORDS is
+  set; a query made only of stopwords is kept whole
+
+Pages still echo the query as the user typed it. The distinct raw queries
+folded into each canonical form are tracked per process (see
+QueryCanonicalizer.folds) and counted in the search metrics.
+"""
+
+import unicodedata
+from collections import OrderedDict
+from threading import Lock
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from decouple import Csv, config
+
+from . import metrics
+
+# Whether tracking parameters are removed from URLs in queries
+QUERY_STRIP_TRACKING = config("QUERY_STRIP_TRACKING", default=True, cast=bool)
+
+# Whether stopwords are removed from queries
+QUERY_STRIP_STOPWORDS = config("QUERY_STRIP_STOPWORDS", default=False,
+                               cast=bool)
+
+# Words removed from queries with QUERY_STRIP_STOPWORDS
+QUERY_STOPWORDS = config(
+    "QUERY_STOPWORDS",
+    default="a,an,the,how,to,what,is,are,do,does,in,of,for,with,on,and,or",
+    cast=Csv())
+
+# Canonical forms whose raw queries are tracked, most recent first
+QUERY_FOLD_TRACKED_FORMS = config("QUERY_FOLD_TRACKED_FORMS", default=10000,
+                                  cast=int)
+
+# Raw queries tracked per canonical form
+MAX_RAW_QUERIES_PER_FORM = 64
+
+# Query parameters of URLs dropped as tracking parameters
+TRACKING_PARAMS = frozenset((
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "mc_cid", "mc_eid",
+    "igshid", "ref_src", "_ga", "_gl",
+))
+
+# Prefixes of query parameters dropped as tracking parameters
+TRACKING_PARAM_PREFIXES = ("utm_",)
+
+
+def is_tracking_param(name):
+    """Whether a URL query parameter only tracks where a link was shared."""
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PARAM_PREFIXES)
+
+
+def strip_tracking(word):
+    """Returns a query word without tracking parameters, if it is a URL."""
+    if "?" not in word or "=" not in word:
+        return word
+
+    try:
+        parts = urlsplit(word)
+    except ValueError:
+        return word
+
+    params = parse_qsl(parts.query, keep_blank_values=True)
+    kept = [(name, value) for name, value in params
+            if not is_tracking_param(name)]
+    if len(kept) == len(params):
+        return word
+
+    return urlunsplit(parts._replace(query=urlencode(kept)))
+
+
+class QueryCanonicalizer:
+    """Canonicalizes queries, tracking the raw queries folded together."""
+
+    def __init__(self, strip_tracking=QUERY_STRIP_TRACKING,
+                 strip_stopwords=QUERY_STRIP_STOPWORDS,
+                 stopwords=QUERY_STOPWORDS,
+                 tracked_forms=QUERY_FOLD_TRACKED_FORMS):
+        self.strip_tracking = strip_tracking
+        self.strip_stopwords = strip_stopwords
+        self.stopwords = frozenset(stopword.casefold()
+                                   for stopword in stopwords)
+        self.tracked_forms = tracked_forms
+        self.lock = Lock()
+        self.raw_queries = OrderedDict()
+
+    def canonical(self, query):
+        """Returns the canonical form of a query ("" for a blank one)."""
+        words = unicodedata.normalize("NFKC", query).casefold().split()
+
+        if self.strip_tracking:
+            words = [strip_tracking(word) for word in words]
+
+        if self.strip_stopwords:
+            words = ([word for word in words if word not in self.stopwords]
+                     or words)
+
+        return " ".join(words)
+
+    def canonicalize(self, query):
+        """Returns the canonical form of a searched query, tracking the fold."""
+        canonical = self.canonical(query)
+        if canonical:
+            self.track(query, canonical)
+        return canonical
+
+    def track(self, query, canonical):
+        """Records query as one of the raw queries of its canonical form."""
+        with self.lock:
+            raw_queries = self.raw_queries.get(canonical)
+            if raw_queries is None:
+                raw_queries = self.raw_queries[canonical] = set()
+                if len(self.raw_queries) > self.tracked_forms:
+                    self.raw_queries.popitem(last=False)
+            else:
+                self.raw_queries.move_to_end(canonical)
+
+            if (query in raw_queries
+                    or len(raw_queries) >= MAX_RAW_QUERIES_PER_FORM):
+                return
+            raw_queries.add(query)
+            folded = len(raw_queries) > 1
+
+        metrics.record_query_fold("folded" if folded else "new")
+
+    def folds(self, canonical):
+        """Returns the number of distinct raw queries seen for a canonical form."""
+        with self.lock:
+            return len(self.raw_queries.get(canonical, ()))
+
+    def most_folded(self, count=10):
+        """Returns the canonical forms with the most raw queries, with counts."""
+        with self.lock:
+            folds = [(canonical, len(raw_queries))
+                     for canonical, raw_queries in self.raw_queries.items()]
+        return sorted(folds, key=lambda fold: fold[1], reverse=True)[:count]
@@ -0,0 +1,200 @@
+"""Quota tracking and circuit breaking of search providers.
+
+Both keep their state in the Django cache, so every process sharing the cache
+(e.g. gunicorn workers on a Redis cache) sees the same quota and breaker:
+- TokenBucket paces upstream calls to an hourly rate (e.g. SERPAPI_HOURLY_LIMIT)
+  with a burst allowance; searches beyond it fail fast with a 429
+- CircuitBreaker opens after a 429 ("run out of searches") or after
+  CIRCUIT_FAILURE_THRESHOLD server errors within CIRCUIT_FAILURE_WINDOW
+  seconds. While open, searches fail fast with the error that opened it;
+  after the cooldown one search probes upstream, closing the breaker if it
+  succeeds and reopening it if not
+
+HourlyBudget caps optional upstream calls, such as prefetches, per hour.
+
+Failing fast happens below the response cache, so cached results are still
+served. A cache that cannot be reached lets every search through, while the
+optional calls counted by an HourlyBudget are skipped.
+"""
+
+import time
+
+from decouple import config
+from django.core.cache import caches
+
+from . import metrics
+
+# Searches burst above the hourly rate before being failed fast
+SEARCH_RATE_LIMIT_BURST = config("SEARCH_RATE_LIMIT_BURST", default=20,
+                                 cast=int)
+
+# Server errors within CIRCUIT_FAILURE_WINDOW seconds opening the breaker
+CIRCUIT_FAILURE_THRESHOLD = config("CIRCUIT_FAILURE_THRESHOLD", default=5,
+                                   cast=int)
+CIRCUIT_FAILURE_WINDOW = config("CIRCUIT_FAILURE_WINDOW", default=60, cast=int)
+
+# Seconds the breaker stays open after server errors, before probing
+CIRCUIT_ERROR_COOLDOWN = config("CIRCUIT_ERROR_COOLDOWN", default=30, cast=int)
+
+# Seconds the breaker stays open after a 429, before probing
+CIRCUIT_QUOTA_COOLDOWN = config("CIRCUIT_QUOTA_COOLDOWN", default=600,
+                                cast=int)
+
+# Django cache alias holding buckets and breakers
+QUOTA_CACHE_ALIAS = config("QUOTA_CACHE_ALIAS", default="default")
+
+# Seconds a probing search may take before another one is let through
+PROBE_TIMEOUT = 30
+
+
+class TokenBucket:
+    """Token bucket shared through the Django cache.
+
+    Rather than a token count, which would need an atomic read-modify-write,
+    the cache holds how many tokens were taken, against the number generated
+    since the epoch at the bucket's rate. A take increments the count, and
+    is allowed while at most burst tokens are taken ahead of generation.
+    Concurrent refills of an idle bucket may let a few extra searches
+    through, never fewer.
+    """
+
+    def __init__(self, name, hourly_limit, burst=SEARCH_RATE_LIMIT_BURST,
+                 alias=QUOTA_CACHE_ALIAS):
+        self.key = f"quota:{name}:taken"
+        self.rate = hourly_limit / 3600
+        self.burst = burst
+        self.alias = alias
+
+    @property
+    def cache(self):
+        """The Django cache holding the bucket."""
+        return caches[self.alias]
+
+    @property
+    def enabled(self):
+        """Whether the bucket limits anything (an hourly limit is set)."""
+        return self.rate > 0
+
+    def take(self):
+        """Takes a token.
+
+        Returns:
+            False if the bucket is empty.
+        """
+        if not self.enabled:
+            return True
+
+        generated = int(time.time() * self.rate)
+        timeout = max(3600, int(self.burst / self.rate))
+        try:
+            self.cache.add(self.key, generated, timeout=timeout)
+            taken = self.cache.incr(self.key)
+            if taken <= generated:
+                # Idle long enough to be full: drop the tokens beyond burst
+                taken = generated + 1
+                self.cache.set(self.key, taken, timeout=timeout)
+            if taken <= generated + self.burst:
+                return True
+            self.cache.decr(self.key)
+        except Exception:
+            return True
+
+        return False
+
+
+class HourlyBudget:
+    """Hourly budget of upstream calls, counted in the Django cache."""
+
+    def __init__(self, name, limit, alias=QUOTA_CACHE_ALIAS):
+        self.name = name
+        self.limit = limit
+        self.alias = alias
+
+    @property
+    def cache(self):
+        """The Django cache holding the budget."""
+        return caches[self.alias]
+
+    def take(self):
+        """Counts an upstream call against the budget of the current hour.
+
+        Returns:
+            False if the budget of the current hour is spent, or the cache
+            cannot be reached.
+        """
+        budget_key = f"{self.name}:budget:{int(time.time() // 3600)}"
+        try:
+            self.cache.add(budget_key, 0, timeout=3600)
+            return self.cache.incr(budget_key) <= self.limit
+        except Exception:
+            return False
+
+
+class CircuitBreaker:
+    """Circuit breaker of an upstream, shared through the Django cache."""
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 failure_window=CIRCUIT_FAILURE_WINDOW,
+                 error_cooldown=CIRCUIT_ERROR_COOLDOWN,
+                 quota_cooldown=CIRCUIT_QUOTA_COOLDOWN,
+                 alias=QUOTA_CACHE_ALIAS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.error_cooldown = error_cooldown
+        self.quota_cooldown = quota_cooldown
+        self.alias = alias
+        self.open_key = f"circuit:{name}:open"
+        self.failures_key = f"circuit:{name}:failures"
+        self.probe_key = f"circuit:{name}:probe"
+
+    @property
+    def cache(self):
+        """The Django cache holding the breaker state."""
+        return caches[self.alias]
+
+    def rejection(self):
+        """Returns the error_code to fail fast with, or None to call upstream.
+
+        Once the cooldown is over, a single caller is let through to probe.
+        """
+        try:
+            state = self.cache.get(self.open_key)
+            if state is None:
+                return None
+            if time.time() >= state["until"] and self.cache.add(
+                    self.probe_key, True, timeout=PROBE_TIMEOUT):
+                metrics.record_upstream_guard(self.name, "probe")
+                return None
+        except Exception:
+            return None
+
+        metrics.record_upstream_guard(self.name, "rejected")
+        return state["error_code"]
+
+    def record(self, error_code):
+        """Updates the breaker with the outcome of an upstream call."""
+        try:
+            if error_code == 429:
+                self.open(429, self.quota_cooldown)
+            elif error_code == 500:
+                self.cache.add(self.failures_key, 0,
+                               timeout=self.failure_window)
+                if self.cache.incr(self.failures_key) >= self.failure_threshold:
+                    self.open(500, self.error_cooldown)
+            elif self.cache.get(self.open_key) is not None:
+                self.cache.delete_many([self.open_key, self.failures_key,
+                                        self.probe_key])
+                metrics.record_upstream_guard(self.name, "closed")
+        except Exception:
+            pass
+
+    def open(self, error_code, cooldown):
+        """Opens the breaker for cooldown seconds, failing fast with error_code."""
+        # Kept past the cooldown, so a failed probe finds the breaker open
+        self.cache.set(self.open_key,
+                       {"until": time.time() + cooldown,
+                        "error_code": error_code},
+                       timeout=cooldown * 10)
+        self.cache.delete_many([self.failures_key, self.probe_key])
+        metrics.record_upstream_guard(self.name, "opened")
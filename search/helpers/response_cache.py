@@ -0,0 +1,232 @@
+"""SerpAPI response cache with stale-while-revalidate.
+
+Responses are stored in a Django cache (see CACHES in settings, e.g. locmem,
+file-based or Redis), keyed on the canonical query (see queries) and page:
+- Fresh responses (younger than SEARCH_CACHE_TTL) are served directly
+- Stale responses (up to SEARCH_CACHE_STALE_TTL older) are served while a
+  background thread fetches a new one; one refresh runs per key at a time,
+  across processes sharing the cache
+- "No results" (error_code 400) responses are cached for
+  SEARCH_CACHE_NEGATIVE_TTL; other errors are never cached, and a failed
+  refresh keeps the stale response
+
+SearchResponseCache.afetch serves the async search path the same way, running
+cache I/O off the event loop.
+
+Lookups are counted per process (see SearchResponseCache.stats) and exported
+through the metrics module. A cache that cannot be reached is treated as a
+miss, so searches keep working without it.
+"""
+
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from asgiref.sync import sync_to_async
+from decouple import config
+from django.core.cache import caches
+
+from . import metrics
+
+# Django cache alias storing SerpAPI responses
+SEARCH_CACHE_ALIAS = config("SEARCH_CACHE_ALIAS", default="default")
+
+# Seconds a response is served without being refreshed (0 disables caching)
+SEARCH_CACHE_TTL = config("SEARCH_CACHE_TTL", default=3600, cast=int)
+
+# Seconds past SEARCH_CACHE_TTL a response is still served while refreshed
+SEARCH_CACHE_STALE_TTL = config("SEARCH_CACHE_STALE_TTL", default=86400,
+                                cast=int)
+
+# Seconds a "no results" response is served without being refreshed
+SEARCH_CACHE_NEGATIVE_TTL = config("SEARCH_CACHE_NEGATIVE_TTL", default=600,
+                                   cast=int)
+
+# Background threads refreshing stale responses
+REVALIDATION_WORKERS = 2
+
+# Seconds after which a refresh marker left by a dead process expires
+REVALIDATION_LOCK_TIMEOUT = 60
+
+# Bumped when the format of cached entries changes
+CACHE_KEY_VERSION = 1
+
+
+def normalize_query(query):
+    """Returns the form of a query used in cache keys (lowercase, single spaces)."""
+    return " ".join(query.lower().split())
+
+
+def is_cacheable(api_response):
+    """Whether a call_serpapi response may be cached (results or no results)."""
+    return api_response.get("error_code") in (None, 400)
+
+
+class SearchResponseCache:
+    """Caches call_serpapi responses in a Django cache."""
+
+    def __init__(self, alias=SEARCH_CACHE_ALIAS, ttl=SEARCH_CACHE_TTL,
+                 stale_ttl=SEARCH_CACHE_STALE_TTL,
+                 negative_ttl=SEARCH_CACHE_NEGATIVE_TTL):
+        self.alias = alias
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.lock = Lock()
+        self.counts = {"hit": 0, "stale": 0, "miss": 0}
+        self.revalidations = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=REVALIDATION_WORKERS,
+            thread_name_prefix="search-cache-revalidation")
+
+    @property
+    def cache(self):
+        """The Django cache responses are stored in."""
+        return caches[self.alias]
+
+    @staticmethod
+    def key(query, page_index):
+        """Returns the cache key of a query and page."""
+        content = f"{normalize_query(query)}\0{page_index}"
+        digest = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+        return f"serpapi:{CACHE_KEY_VERSION}:{digest}"
+
+    def get(self, key):
+        """Returns the cached entry of key, or None if missing or unreachable."""
+        try:
+            return self.cache.get(key)
+        except Exception:
+            return None
+
+    def set(self, key, api_response):
+        """Stores a cacheable response, for its fresh and stale lifetime."""
+        if not is_cacheable(api_response):
+            return
+
+        fresh_for = (self.negative_ttl if api_response.get("error_code")
+                     else self.ttl)
+        entry = {"response": api_response,
+                 "expires_at": time.time() + fresh_for}
+        try:
+            self.cache.set(key, entry, timeout=fresh_for + self.stale_ttl)
+        except Exception:
+            pass
+
+    def is_fresh(self, key):
+        """Whether key holds a response that does not need refreshing yet."""
+        entry = self.get(key)
+        return entry is not None and time.time() < entry["expires_at"]
+
+    def fetch(self, query, page_index, fetch_response):
+        """Returns the response of a search, from the cache when possible.
+
+        Args:
+            query: Search query string.
+            page_index: Starting index for pagination.
+            fetch_response: Function called as fetch_response(query,
+                page_index) to get a response on a miss (e.g. call_serpapi).
+
+        Returns:
+            Dict containing API response or error_code on failure.
+        """
+        if self.ttl <= 0:
+            return fetch_response(query, page_index)
+
+        key = self.key(query, page_index)
+        entry = self.get(key)
+
+        if entry is None:
+            self.count("miss")
+            api_response = fetch_response(query, page_index)
+            self.set(key, api_response)
+            return api_response
+
+        if time.time() < entry["expires_at"]:
+            self.count("hit")
+        else:
+            self.count("stale")
+            self.revalidate(key, query, page_index, fetch_response)
+
+        return entry["response"]
+
+    async def afetch(self, query, page_index, fetch_response,
+                     revalidate_response):
+        """Async version of fetch, for the async search path.
+
+        Args:
+            query: Search query string.
+            page_index: Starting index for pagination.
+            fetch_response: Coroutine function awaited on a miss (e.g.
+                fetch_serpapi_async).
+            revalidate_response: Function refreshing stale responses on the
+                background threads (e.g. fetch_serpapi).
+
+        Returns:
+            Dict containing API response or error_code on failure.
+        """
+        if self.ttl <= 0:
+            return await fetch_response(query, page_index)
+
+        key = self.key(query, page_index)
+        entry = await sync_to_async(self.get)(key)
+
+        if entry is None:
+            self.count("miss")
+            api_response = await fetch_response(query, page_index)
+            await sync_to_async(self.set)(key, api_response)
+            return api_response
+
+        if time.time() < entry["expires_at"]:
+            self.count("hit")
+        else:
+            self.count("stale")
+            await sync_to_async(self.revalidate)(
+                key, query, page_index, revalidate_response)
+
+        return entry["response"]
+
+    def revalidate(self, key, query, page_index, fetch_response):
+        """Refreshes a stale response in the background, once per key."""
+        with self.lock:
+            if key in self.revalidations:
+                return
+
+            try:
+                if not self.cache.add(f"{key}:revalidating", True,
+                                      timeout=REVALIDATION_LOCK_TIMEOUT):
+                    return
+            except Exception:
+                return
+
+            future = self.executor.submit(
+                self.refresh, key, query, page_index, fetch_response)
+            self.revalidations[key] = future
+
+        future.add_done_callback(lambda _: self.revalidations.pop(key, None))
+
+    def refresh(self, key, query, page_index, fetch_response):
+        """Fetches a new response for key, keeping the stale one on error."""
+        try:
+            self.set(key, fetch_response(query, page_index))
+        finally:
+            try:
+                self.cache.delete(f"{key}:revalidating")
+            except Exception:
+                pass
+
+    def count(self, result):
+        """Counts a lookup as a fresh hit, stale hit or miss."""
+        with self.lock:
+            self.counts[result] += 1
+        metrics.record_search_cache_lookup(result)
+
+    def stats(self):
+        """Returns lookup counts and the hit ratio (stale hits included)."""
+        with self.lock:
+            counts = dict(self.counts)
+
+        lookups = sum(counts.values())
+        counts["hit_ratio"] = ((counts["hit"] + counts["stale"]) / lookups
+                               if lookups else 0.0)
+        return counts
@@ -0,0 +1,85 @@
+"""Compact representation of organic search results.
+
+SerpAPI returns a large dict per organic result, of which classification and
+the templates only use a few fields. SearchResult keeps just those fields,
+along with values the classifier would otherwise recompute for every
+category: lowercase texts, the link's host, registered domain and path.
+"""
+
+from urllib.parse import urlsplit
+
+from .domains import host_domain, link_host
+
+
+class SearchResult:
+    """A single organic search result, normalized once when built."""
+
+    __slots__ = (
+        "link",
+        "title",
+        "snippet",
+        "displayed_link",
+        "lowered_link",
+        "lowered_title",
+        "lowered_snippet",
+        "host",
+        "domain",
+        "path",
+    )
+
+    def __init__(self, link="", title="", snippet="", displayed_link=""):
+        self.link = link or ""
+        self.title = title or ""
+        self.snippet = snippet or ""
+        self.displayed_link = displayed_link or ""
+
+        self.lowered_link = self.link.lower()
+        self.lowered_title = self.title.lower()
+        self.lowered_snippet = self.snippet.lower()
+
+        self.host = link_host(self.link)
+        self.domain = host_domain(self.host)
+        try:
+            self.path = urlsplit(self.link).path
+        except ValueError:
+            self.path = ""
+
+    @classmethod
+    def from_serpapi(cls, organic_result):
+        """Builds a SearchResult from a SerpAPI 'organic_results' entry."""
+        if isinstance(organic_result, cls):
+            return organic_result
+
+        return cls(
+            link=organic_result.get("link"),
+            title=organic_result.get("title"),
+            snippet=organic_result.get("snippet"),
+            displayed_link=organic_result.get("displayed_link"),
+        )
+
+    def to_dict(self):
+        """Returns the result fields as a dict, e.g. for JSON responses."""
+        return {
+            "link": self.link,
+            "title": self.title,
+            "snippet": self.snippet,
+            "displayed_link": self.displayed_link,
+        }
+
+    def get(self, key, default=None):
+        """Dict-style access to the result fields, for dict-based helpers."""
+        if key in ("link", "title", "snippet", "displayed_link"):
+            return getattr(self, key)
+        return default
+
+    def __eq__(self, other):
+        if not isinstance(other, SearchResult):
+            return NotImplemented
+        return (self.link, self.title, self.snippet, self.displayed_link) == (
+            other.link, other.title, other.snippet, other.displayed_link)
+
+    def __hash__(self):
+        return hash((self.link, self.title, self.snippet, self.displayed_link))
+
+    def __repr__(self):
+        return f"SearchResult(link={self.link!r}, title={self.title!r})"
@@ -0,0 +1,78 @@
+"""Per-result classification cache shared across queries.
+
+Popular pages (MDN, docs.python.org, large GitHub repositories) appear in the
+results of many different queries. ScoreCache remembers the categories of
+each result, keyed by a digest of its link, title, snippet and the version
+of the category rules, so a result is only classified once per rule set.
+
+Memory is bounded by a maximum entry count and a TTL. Changing the rules
+changes their version, so stale classifications are never reused.
+"""
+
+import hashlib
+import json
+from threading import Lock
+
+from cachetools import TTLCache
+from decouple import config
+
+# Maximum number of results whose classifications are kept
+SCORE_CACHE_SIZE = config("SCORE_CACHE_SIZE", default=50000, cast=int)
+
+# Seconds before cached classifications expire
+SCORE_CACHE_TTL = config("SCORE_CACHE_TTL", default=86400, cast=int)
+
+
+def rules_version(category_configs):
+    """Returns a short fingerprint identifying a set of category rules."""
+    serialized = json.dumps(category_configs, sort_keys=True, default=list)
+    return hashlib.blake2b(serialized.encode(), digest_size=8).hexdigest()
+
+
+class ScoreCache:
+    """Thread-safe LRU/TTL cache of per-result classifications."""
+
+    def __init__(self, maxsize=SCORE_CACHE_SIZE, ttl=SCORE_CACHE_TTL):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(search_result, version):
+        """Returns the cache key of a SearchResult under a rules version."""
+        content = "\0".join((search_result.link, search_result.title,
+                             search_result.snippet, version))
+        return hashlib.blake2b(content.encode(), digest_size=16).digest()
+
+    def get(self, key):
+        """Returns cached categories for key, or None if unseen or expired."""
+        with self.lock:
+            categories = self.cache.get(key)
+            if categories is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return categories
+
+    def set(self, key, categories):
+        """Stores the classification of a result."""
+        with self.lock:
+            self.cache[key] = categories
+
+    def clear(self):
+        """Drops every cached score and resets the counters."""
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Returns hit/miss counters and current size of the cache."""
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.cache),
+                "maxsize": self.cache.maxsize,
+            }
@@ -1,7 +1,8 @@
 """Search utility functions for categorizing and managing search results.
 
 This module provides utilities for:
-- Performing searches via SerpAPI
+- Performing searches via SerpAPI (and other providers), synchronously or
+  on an event loop
 - Classifying search results into categories using a scoring system
 - Managing pagination for search results
 - URL and content pattern matching
@@ -11,12 +12,66 @@ title patterns) to intelligently categorize search results into tabs like
 YouTube, Courses, Documentation, etc.
 """
 
-import tldextract
+from asgiref.sync import sync_to_async
 from decouple import config
 from rapidfuzz import fuzz
-from serpapi import GoogleSearch
 
-from . import constants
+from . import constants, metrics
+from .deep_fill import DeepFiller
+from .domains import configured_domains, link_domain
+from .matcher import CategoryMatcher, could_fuzzy_match
+from .page_cache import PageCache
+from .prefetch import Prefetcher
+from .providers import MultiProviderSearch, configured_providers
+from .queries import QueryCanonicalizer
+from .response_cache import SearchResponseCache
+from .results import SearchResult
+from .score_cache import ScoreCache
+from .serpapi_client import AsyncSerpApiClient, SerpApiClient, SerpApiError
+from .single_flight import SingleFlight
+from .suggest import SuggestionIndex
+
+# Scores of results seen in earlier searches, shared across queries
+SCORE_CACHE = ScoreCache()
+
+# SerpAPI responses of recent searches
+SEARCH_RESPONSE_CACHE = SearchResponseCache()
+
+# Pooled keep-alive client making every SerpAPI call
+SERPAPI_CLIENT = SerpApiClient()
+
+# Non-blocking client making the SerpAPI calls of the async search path
+SERPAPI_ASYNC_CLIENT = AsyncSerpApiClient()
+
+# Canonical forms of queries, used for upstream calls and caching
+QUERY_CANONICALIZER = QueryCanonicalizer()
+
+# Rendered search pages, served by search.middleware.PageCacheMiddleware
+PAGE_CACHE = PageCache()
+
+# Searched queries suggested while typing
+SUGGESTION_INDEX = SuggestionIndex()
+
+# SerpAPI calls in flight, shared by identical concurrent searches
+SERPAPI_FLIGHTS = SingleFlight()
+
+# Background prefetching of next pages (opt-in)
+PREFETCHER = Prefetcher()
+
+# Filling of sparse tabs from the following result windows (opt-in)
+DEEP_FILLER = DeepFiller()
+
+# Providers answering searches, SerpAPI by default (see SEARCH_PROVIDERS)
+PROVIDER_SEARCH = MultiProviderSearch(configured_providers(
+    lambda search_query, page_index: call_serpapi(search_query, page_index),
+    lambda search_query, page_index: call_serpapi_async(search_query,
+                                                        page_index),
+    on_answer=lambda provider, api_response: upstream_answered(
+        provider, api_response)))
+
+# Engine compiled from the default category rules
+CATEGORY_MATCHER = CategoryMatcher(
+    constants.SEARCH_CATEGORY_DATA, score_cache=SCORE_CACHE)
 
 
 def search_url_with_page_index(query, page):
@@ -39,19 +94,20 @@ def keyword_in_search(search_item, keywords=(), must_contain_all=False):
     title = search_item.get("title", "")
     snippet = search_item.get("snippet", "")
     filter_func = all if must_contain_all else any
+    fields = [information for information in (link, title, snippet)
+              if information]
 
-    for information in (link, title, snippet):
-        if not information:
-            continue
-
-        # Exact substring match
+    # Exact substring match on every field before any fuzzy matching
+    for information in fields:
         if filter_func(keyword.lower() in information.lower()
                        for keyword in keywords):
             return True
 
-        # Fuzzy matching with 90% similarity threshold
+    # Fuzzy matching with 90% similarity threshold, skipping pairs which
+    # cannot reach it
+    for information in fields:
         if filter_func(
-            fuzz.WRatio(
+            could_fuzzy_match(keyword, information) and fuzz.WRatio(
                 keyword,
                 information,
                 score_cutoff=90) for keyword in keywords):
@@ -70,19 +126,11 @@ def domain_in_search(search_item, domains=()):
     Returns:
         True if result is from specified domains or if no domains specified.
     """
-    link = search_item.get("link", "")
-
     if len(domains) == 0:
         return True
 
-    for domain in domains:
-        required_domain = tldextract.extract(domain).domain
-        search_result_domain = tldextract.extract(link).domain
-
-        if required_domain == search_result_domain:
-            return True
-
-    return False
+    return link_domain(search_item.get("link", "")) in configured_domains(
+        tuple(domains))
 
 
 def matches_pattern(text, patterns):
@@ -97,7 +145,8 @@ def matches_pattern(text, patterns):
     """
     if not text:
         return False
-    return any(pattern.lower() in text.lower() for pattern in patterns)
+    text = text.lower()
+    return any(pattern.lower() in text for pattern in patterns)
 
 
 def score_search_item(search_item, category_config):
@@ -152,39 +201,54 @@ def classify_search(search_items, category_configs):
     """Classifies search items into categories using scoring system.
 
     Each item is scored against each category and included if it meets
-    the minimum threshold. Items can appear in multiple categories.
+    the minimum threshold and is not excluded by a category it belongs to.
+    Items can appear in multiple categories. The default category rules use
+    a precompiled CategoryMatcher, whose classifications are cached per
+    result across searches.
 
     Args:
-        search_items: List of search result dicts.
+        search_items: List of SearchResult objects or search result dicts.
         category_configs: Dict mapping category names to configuration dicts.
 
     Returns:
         Dict with 'all' key containing all items, plus keys for each category
         containing filtered items.
     """
-    search_data = {"all": search_items}
+    if category_configs is constants.SEARCH_CATEGORY_DATA:
+        matcher = default_category_matcher()
+    else:
+        matcher = CategoryMatcher(category_configs)
 
-    # Track which categories each item has been assigned to
-    item_categories = {i: [] for i in range(len(search_items))}
+    return matcher.classify(search_items)
 
-    for category_name, config in category_configs.items():
-        search_data[category_name] = []
 
-        for idx, search_item in enumerate(search_items):
-            score = score_search_item(search_item, config)
+def default_category_matcher():
+    """Returns the matcher for the default rules, recompiling it if replaced.
 
-            # Minimum score threshold for inclusion
-            if score >= 20:
-                # Check exclusion rules
-                exclude_if_matched = config.get("exclude_if_matched", [])
-                if any(cat in item_categories[idx]
-                       for cat in exclude_if_matched):
-                    continue
+    Rules are compared by identity, so a search costs no fingerprint of the
+    rules; they are replaced, never edited in place.
+    """
+    global CATEGORY_MATCHER
+
+    if CATEGORY_MATCHER.category_configs is not constants.SEARCH_CATEGORY_DATA:
+        CATEGORY_MATCHER = CategoryMatcher(
+            constants.SEARCH_CATEGORY_DATA, score_cache=SCORE_CACHE)
+
+    return CATEGORY_MATCHER
 
-                search_data[category_name].append(search_item)
-                item_categories[idx].append(category_name)
 
-    return search_data
+def serpapi_params(search_query, page_index):
+    """Returns the SerpAPI parameters of a search."""
+    return {
+        "api_key": config("SERP_API_KEY"),
+        "engine": "google",
+        "q": search_query,
+        "google_domain": "google.com",
+        "safe": "active",
+        "uds": "technology,code,engineer,software,ai",
+        "num": "10",
+        "start": page_index,
+    }
 
 
 def call_serpapi(search_query, page_index):
@@ -197,45 +261,117 @@ def call_serpapi(search_query, page_index):
     Returns:
         Dict containing API response or error_code on failure.
     """
-    api_response = {}
+    try:
+        api_response = SERPAPI_CLIENT.search(
+            serpapi_params(search_query, page_index))
+    except SerpApiError as error:
+        api_response = {"error_code": error.error_code}
+    except Exception:
+        api_response = {"error_code": 500}
+
+    return api_response
 
+
+async def call_serpapi_async(search_query, page_index):
+    """Async version of call_serpapi, without blocking the event loop."""
     try:
-        serpapi_params = {
-            "api_key": config("SERP_API_KEY"),
-            "engine": "google",
-            "q": search_query,
-            "google_domain": "google.com",
-            "safe": "active",
-            "uds": "technology,code,engineer,software,ai",
-            "num": "10",
-            "start": page_index,
-        }
-
-        search = GoogleSearch(serpapi_params)
-        api_response = search.get_dict()
-
-        error_from_serpapi = api_response.get("error")
-
-        if error_from_serpapi:
-            if "run out of searches" in error_from_serpapi:
-                api_response = {"error_code": 429}
-            elif "Google hasn't returned any results for this query." in error_from_serpapi:
-                api_response = {"error_code": 400}
-            else:
-                api_response = {"error_code": 500}
-
-    except Exception as e:
+        api_response = await SERPAPI_ASYNC_CLIENT.search(
+            serpapi_params(search_query, page_index))
+    except SerpApiError as error:
+        api_response = {"error_code": error.error_code}
+    except Exception:
         api_response = {"error_code": 500}
 
     return api_response
 
 
-def perform_search_v2(search_query, page_index=0):
+def upstream_answered(provider, api_response):
+    """Counts an answer of an upstream provider in the search metrics.
+
+    Prefetching backs off once an upstream runs out of searches. Searches
+    failed fast by the rate limiter or circuit breaker never get here, so
+    limits imposed locally neither count as SerpAPI errors nor pause
+    prefetching.
+    """
+    error_code = api_response.get("error_code")
+    if provider == "serpapi":
+        metrics.record_serpapi_response(error_code)
+    if error_code == 429:
+        PREFETCHER.back_off()
+
+
+def fetch_serpapi(search_query, page_index):
+    """Searches the providers, once for identical searches running concurrently.
+
+    With only SerpAPI configured this is a call_serpapi call. The outcome of
+    each upstream call is counted by upstream_answered.
+    """
+    return SERPAPI_FLIGHTS.do(
+        SearchResponseCache.key(search_query, page_index),
+        lambda: PROVIDER_SEARCH.search(search_query, page_index))
+
+
+async def fetch_serpapi_async(search_query, page_index):
+    """Async version of fetch_serpapi, coalescing calls on the event loop."""
+    return await SERPAPI_FLIGHTS.ado(
+        SearchResponseCache.key(search_query, page_index),
+        lambda: PROVIDER_SEARCH.asearch(search_query, page_index))
+
+
+def prefetch_page(search_query, page_index):
+    """Fetches and classifies a page into the caches, ahead of a request for it.
+
+    Pages already cached and fresh are skipped; every other page counts
+    against the prefetch budget.
+    """
+    key = SearchResponseCache.key(search_query, page_index)
+    if SEARCH_RESPONSE_CACHE.is_fresh(key) or not PREFETCHER.take_budget():
+        return
+
+    api_response = fetch_serpapi(search_query, page_index)
+    SEARCH_RESPONSE_CACHE.set(key, api_response)
+    metrics.record_prefetch("fetched")
+
+    search_items = [
+        SearchResult.from_serpapi(organic_result)
+        for organic_result in api_response.get("organic_results", [])
+    ]
+    classify_search(search_items, constants.SEARCH_CATEGORY_DATA)
+
+
+def fetch_deep_page(search_query, page_index):
+    """Returns the response of a result window filling sparse tabs.
+
+    Windows already cached and fresh are served from the cache; every other
+    window counts against the deep fill budget, and is skipped (None) once
+    it is spent.
+    """
+    key = SearchResponseCache.key(search_query, page_index)
+    if not SEARCH_RESPONSE_CACHE.is_fresh(key) and not DEEP_FILLER.take_budget():
+        return None
+
+    return SEARCH_RESPONSE_CACHE.fetch(search_query, page_index, fetch_serpapi)
+
+
+def classify_default(search_items):
+    """Classifies search items with the default category rules."""
+    return classify_search(search_items, constants.SEARCH_CATEGORY_DATA)
+
+
+def perform_search_v2(search_query, page_index=0, searcher=None):
     """Performs search and classifies results into categories.
 
+    The canonical form of the query (see QUERY_CANONICALIZER) is searched,
+    and SerpAPI responses are served from SEARCH_RESPONSE_CACHE when
+    possible. With prefetching enabled, the next page is fetched in the background, and
+    with deep fill enabled, sparse tabs are filled from the following result
+    windows.
+
     Args:
         search_query: Query string to search for.
         page_index: Starting index for pagination (default: 0).
+        searcher: Id of the client searching, for suggestions (see
+            SuggestionIndex.record).
 
     Returns:
         Dict containing:
@@ -247,6 +383,55 @@ def perform_search_v2(search_query, page_index=0):
             - next_page_url: URL for next page
             - error_occured: Whether a server error occurred
     """
+    api_response = None
+    upstream_query = QUERY_CANONICALIZER.canonicalize(search_query)
+
+    if upstream_query:
+        with metrics.stage("serpapi"):
+            api_response = SEARCH_RESPONSE_CACHE.fetch(
+                upstream_query, page_index, fetch_serpapi)
+
+    return search_page_data(search_query, page_index, api_response,
+                            upstream_query, searcher)
+
+
+async def perform_search_async(search_query, page_index=0, searcher=None):
+    """Async version of perform_search_v2, for the ASGI deployment.
+
+    The SerpAPI call is awaited without holding a thread, and classification
+    runs in a worker thread so it does not block the event loop.
+
+    Returns:
+        Dict like that of perform_search_v2.
+    """
+    api_response = None
+    upstream_query = QUERY_CANONICALIZER.canonicalize(search_query)
+
+    if upstream_query:
+        with metrics.stage("serpapi"):
+            api_response = await SEARCH_RESPONSE_CACHE.afetch(
+                upstream_query, page_index, fetch_serpapi_async,
+                fetch_serpapi)
+
+    return await sync_to_async(search_page_data, thread_sensitive=False)(
+        search_query, page_index, api_response, upstream_query, searcher)
+
+
+def search_page_data(search_query, page_index, api_response,
+                     upstream_query=None, searcher=None):
+    """Builds the search page data of a SerpAPI response.
+
+    Args:
+        search_query: Query string searched for, as the user typed it.
+        page_index: Starting index for pagination.
+        api_response: Response of call_serpapi, or None without a query.
+        upstream_query: Canonical form of search_query, used for upstream
+            calls (default: computed from search_query).
+        searcher: Id of the client searching, for suggestions.
+
+    Returns:
+        Dict like that of perform_search_v2.
+    """
     has_prev_page = False
     has_next_page = False
     limit_reached = False
@@ -260,8 +445,10 @@ def perform_search_v2(search_query, page_index=0):
 
     results = {}
 
-    if search_query:
-        api_response = call_serpapi(search_query, page_index)
+    if upstream_query is None:
+        upstream_query = QUERY_CANONICALIZER.canonical(search_query)
+
+    if api_response is not None:
         api_response_err_code = api_response.get("error_code")
 
         if api_response_err_code == 429:
@@ -286,9 +473,28 @@ def perform_search_v2(search_query, page_index=0):
                 next_page_page_index = page_index + 1 if page_index > -1 else 1
                 next_page_url = search_url_with_page_index(
                     search_query, next_page_page_index)
-
-        search_items = api_response.get("organic_results", [])
-        results = classify_search(search_items, constants.SEARCH_CATEGORY_DATA)
+                PREFETCHER.schedule(
+                    SearchResponseCache.key(upstream_query,
+                                            next_page_page_index),
+                    prefetch_page, upstream_query, next_page_page_index)
+
+        search_items = [
+            SearchResult.from_serpapi(organic_result)
+            for organic_result in api_response.get("organic_results", [])
+        ]
+        with metrics.stage("classify"):
+            results = classify_search(
+                search_items, constants.SEARCH_CATEGORY_DATA)
+
+        if has_next_page and DEEP_FILLER.enabled:
+            with metrics.stage("deep_fill"):
+                results = DEEP_FILLER.fill(upstream_query, page_index,
+                                           results, fetch_deep_page,
+                                           classify_default)
+        metrics.record_category_results(results)
+
+        if page_index == 0 and results.get("all"):
+            SUGGESTION_INDEX.record(upstream_query, searcher=searcher)
 
     return {
         "results": results,
@@ -0,0 +1,279 @@
+"""Process-wide SerpAPI clients.
+
+Unlike a GoogleSearch object per search, SerpApiClient keeps one pooled
+keep-alive requests session, so searches reuse TLS connections.
+AsyncSerpApiClient does the same with a non-blocking httpx client, for the
+async search path served under ASGI. Every request
+has connect and read timeouts, and transient failures (timeouts, connection
+errors, 5xx responses) are retried a bounded number of times with jittered
+exponential backoff.
+
+Failures are raised as SerpApiError subclasses carrying the error_code used
+by perform_search_v2, based on the HTTP status of the response:
+- 429: QuotaExceededError (the account ran out of searches)
+- 200 with an "error" message: NoResultsError (Google returned nothing)
+- other 4xx: InvalidRequestError (e.g. a bad API key)
+- 5xx, timeouts and connection errors: TransientError
+
+Responses are pruned as soon as they are decoded: SerpAPI answers with the
+knowledge graph, related questions, inline images and search metadata, while
+searches only use the organic results' link, title, snippet and
+displayed_link, and whether there are previous and next pages. The full
+response is dropped before it reaches the response cache.
+"""
+
+import asyncio
+import json
+import random
+import time
+from weakref import WeakKeyDictionary
+
+import httpx
+import requests
+from decouple import config
+from requests.adapters import HTTPAdapter
+
+# SerpAPI search endpoint (e.g. a local stand-in for load tests)
+SERPAPI_SEARCH_URL = config("SERPAPI_SEARCH_URL",
+                            default="https://serpapi.com/search")
+
+# Seconds to wait for a connection to SerpAPI
+SERPAPI_CONNECT_TIMEOUT = config("SERPAPI_CONNECT_TIMEOUT", default=3.05,
+                                 cast=float)
+
+# Seconds to wait for SerpAPI to send its response
+SERPAPI_READ_TIMEOUT = config("SERPAPI_READ_TIMEOUT", default=10.0,
+                              cast=float)
+
+# Retries of a search after a transient failure
+SERPAPI_MAX_RETRIES = config("SERPAPI_MAX_RETRIES", default=2, cast=int)
+
+# Base of the exponential backoff between retries, in seconds
+SERPAPI_RETRY_BACKOFF = config("SERPAPI_RETRY_BACKOFF", default=0.25,
+                               cast=float)
+
+# Keep-alive connections kept open to SerpAPI
+SERPAPI_POOL_SIZE = config("SERPAPI_POOL_SIZE", default=10, cast=int)
+
+# Connections the async client may open to SerpAPI at once
+SERPAPI_ASYNC_MAX_CONNECTIONS = config("SERPAPI_ASYNC_MAX_CONNECTIONS",
+                                       default=200, cast=int)
+
+# Fields of the organic results kept by prune_response
+ORGANIC_RESULT_FIELDS = ("position", "link", "title", "snippet",
+                         "displayed_link")
+
+
+class SerpApiError(Exception):
+    """A SerpAPI search that did not return results."""
+
+    # error_code reported by call_serpapi
+    error_code = 500
+
+    # Whether the search may succeed if tried again
+    retryable = False
+
+
+class QuotaExceededError(SerpApiError):
+    """The SerpAPI account has run out of searches."""
+
+    error_code = 429
+
+
+class NoResultsError(SerpApiError):
+    """Google returned no results for the query."""
+
+    error_code = 400
+
+
+class InvalidRequestError(SerpApiError):
+    """SerpAPI rejected the request (e.g. invalid API key or parameters)."""
+
+
+class TransientError(SerpApiError):
+    """Timeout, connection error or server error; the search may be retried."""
+
+    retryable = True
+
+
+def prune_response(body):
+    """Returns the fields of a SerpAPI response used by searches.
+
+    Args:
+        body: Dict of the SerpAPI JSON response.
+
+    Returns:
+        Dict with the "organic_results" (restricted to ORGANIC_RESULT_FIELDS)
+        and the "pagination" flags of the response.
+    """
+    pagination = body.get("pagination") or {}
+    return {
+        "organic_results": [
+            {field: organic_result[field] for field in ORGANIC_RESULT_FIELDS
+             if field in organic_result}
+            for organic_result in body.get("organic_results") or []
+        ],
+        "pagination": {
+            "next": bool(pagination.get("next")),
+            "previous": bool(pagination.get("previous")),
+        },
+    }
+
+
+def parse_response(response):
+    """Returns the pruned body of a SerpAPI response, or raises its SerpApiError.
+
+    Args:
+        response: requests.Response or httpx.Response of a search.
+
+    Raises:
+        SerpApiError: The subclass matching the HTTP status of the response.
+    """
+    try:
+        # Decoded from the raw bytes, without building the text first
+        body = json.loads(response.content)
+    except ValueError:
+        body = {}
+
+    error = body.get("error") if isinstance(body, dict) else None
+    status = response.status_code
+
+    if status == 429:
+        raise QuotaExceededError(error or "Too many requests")
+    if status >= 500:
+        raise TransientError(error or f"SerpAPI server error {status}")
+    if status >= 400:
+        raise InvalidRequestError(error or f"SerpAPI rejected the request ({status})")
+    if not isinstance(body, dict) or not body:
+        raise TransientError("SerpAPI returned an invalid response")
+    if error:
+        raise NoResultsError(error)
+
+    return prune_response(body)
+
+
+def backoff_delay(retry_backoff, attempt):
+    """Returns a random delay up to retry_backoff * 2 ** attempt seconds."""
+    return random.uniform(0, retry_backoff * 2 ** attempt)
+
+
+class SerpApiClient:
+    """SerpAPI client sharing one pooled session between threads."""
+
+    def __init__(self, connect_timeout=SERPAPI_CONNECT_TIMEOUT,
+                 read_timeout=SERPAPI_READ_TIMEOUT,
+                 max_retries=SERPAPI_MAX_RETRIES,
+                 retry_backoff=SERPAPI_RETRY_BACKOFF,
+                 pool_size=SERPAPI_POOL_SIZE, session=None,
+                 url=SERPAPI_SEARCH_URL):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+
+    def search(self, params):
+        """Runs a search, retrying transient failures.
+
+        Args:
+            params: SerpAPI search parameters, including api_key.
+
+        Returns:
+            Dict of the pruned SerpAPI response (see prune_response).
+
+        Raises:
+            SerpApiError: If the search failed, after any retries.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.request(params)
+            except SerpApiError as error:
+                if not error.retryable or attempt == self.max_retries:
+                    raise
+            time.sleep(backoff_delay(self.retry_backoff, attempt))
+
+    def request(self, params):
+        """Sends a single search request to SerpAPI."""
+        try:
+            response = self.session.get(
+                self.url, params={**params, "output": "json"},
+                timeout=self.timeout)
+        except requests.Timeout as error:
+            raise TransientError(f"SerpAPI timed out: {error}") from error
+        except requests.RequestException as error:
+            raise TransientError(f"SerpAPI request failed: {error}") from error
+
+        return parse_response(response)
+
+
+class AsyncSerpApiClient:
+    """SerpAPI client for coroutines, with one pooled httpx client per event loop."""
+
+    def __init__(self, connect_timeout=SERPAPI_CONNECT_TIMEOUT,
+                 read_timeout=SERPAPI_READ_TIMEOUT,
+                 max_retries=SERPAPI_MAX_RETRIES,
+                 retry_backoff=SERPAPI_RETRY_BACKOFF,
+                 pool_size=SERPAPI_POOL_SIZE,
+                 max_connections=SERPAPI_ASYNC_MAX_CONNECTIONS, transport=None,
+                 url=SERPAPI_SEARCH_URL):
+        self.url = url
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=pool_size)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.transport = transport
+        self.sessions = WeakKeyDictionary()
+
+    @property
+    def session(self):
+        """The httpx client of the running event loop.
+
+        httpx clients are bound to the loop they were first used on, so a
+        process running several loops (e.g. tests) gets one client per loop.
+        """
+        loop = asyncio.get_running_loop()
+        session = self.sessions.get(loop)
+        if session is None:
+            session = self.sessions[loop] = httpx.AsyncClient(
+                timeout=self.timeout, limits=self.limits,
+                transport=self.transport)
+        return session
+
+    async def search(self, params):
+        """Runs a search, retrying transient failures.
+
+        Args:
+            params: SerpAPI search parameters, including api_key.
+
+        Returns:
+            Dict of the pruned SerpAPI response (see prune_response).
+
+        Raises:
+            SerpApiError: If the search failed, after any retries.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.request(params)
+            except SerpApiError as error:
+                if not error.retryable or attempt == self.max_retries:
+                    raise
+            await asyncio.sleep(backoff_delay(self.retry_backoff, attempt))
+
+    async def request(self, params):
+        """Sends a single search request to SerpAPI."""
+        try:
+            response = await self.session.get(
+                self.url, params={**params, "output": "json"})
+        except httpx.TimeoutException as error:
+            raise TransientError(f"SerpAPI timed out: {error}") from error
+        except httpx.HTTPError as error:
+            raise TransientError(f"SerpAPI request failed: {error}") from error
+
+        return parse_response(response)
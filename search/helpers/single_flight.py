@@ -0,0 +1,198 @@
+"""Single-flight coalescing of identical upstream calls.
+
+When many requests need the same SerpAPI response at once, only the first
+(the leader) calls SerpAPI; the others (followers) wait for its result:
+- Within a process, followers wait on the leader's in-flight call
+- With SINGLE_FLIGHT_SHARED, a lock in the Django cache elects one leader
+  across every process sharing the cache (e.g. gunicorn workers), which
+  publishes its result there for a few seconds
+
+The async search path coalesces coroutines on the same event loop with
+SingleFlight.ado; it does not coordinate with other processes.
+
+Followers wait at most SINGLE_FLIGHT_TIMEOUT seconds, then make the call
+themselves. A cache that cannot be reached only disables cross-process
+coalescing.
+"""
+
+import asyncio
+import time
+from threading import Event, Lock
+
+from decouple import config
+from django.core.cache import caches
+
+from . import metrics
+
+# Seconds followers wait for the leader before calling upstream themselves
+SINGLE_FLIGHT_TIMEOUT = config("SINGLE_FLIGHT_TIMEOUT", default=10.0,
+                               cast=float)
+
+# Whether calls are also coalesced across processes, through the cache
+SINGLE_FLIGHT_SHARED = config("SINGLE_FLIGHT_SHARED", default=False, cast=bool)
+
+# Django cache alias holding cross-process locks and results
+SINGLE_FLIGHT_CACHE_ALIAS = config("SINGLE_FLIGHT_CACHE_ALIAS",
+                                   default="default")
+
+# Seconds a leader's result stays readable by followers in other processes
+SHARED_RESULT_TTL = 5
+
+# Seconds between checks for the result of a leader in another process
+SHARED_POLL_INTERVAL = 0.05
+
+
+class Flight:
+    """An in-flight call, and its result once done."""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one call per key at a time, sharing its result with waiters."""
+
+    def __init__(self, timeout=SINGLE_FLIGHT_TIMEOUT,
+                 shared=SINGLE_FLIGHT_SHARED, alias=SINGLE_FLIGHT_CACHE_ALIAS):
+        self.timeout = timeout
+        self.shared = shared
+        self.alias = alias
+        self.lock = Lock()
+        self.flights = {}
+        self.async_flights = {}
+
+    @property
+    def cache(self):
+        """The Django cache holding cross-process locks and results."""
+        return caches[self.alias]
+
+    def do(self, key, func):
+        """Returns func(), or the result of an identical call in flight.
+
+        Args:
+            key: Key identifying identical calls.
+            func: Function making the call.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if not leader:
+            return self.follow(flight, func)
+
+        try:
+            flight.result = (self.run_shared(key, func) if self.shared
+                             else func())
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+        return flight.result
+
+    def follow(self, flight, func):
+        """Waits for the result of a flight in this process."""
+        metrics.record_single_flight("follower")
+
+        if not flight.done.wait(self.timeout):
+            metrics.record_single_flight("timeout")
+            return func()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    async def ado(self, key, func):
+        """Awaits func(), or the result of an identical call in flight.
+
+        Args:
+            key: Key identifying identical calls.
+            func: Coroutine function making the call.
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, key)
+        flight = self.async_flights.get(flight_key)
+
+        if flight is not None:
+            metrics.record_single_flight("follower")
+            try:
+                return await asyncio.wait_for(asyncio.shield(flight),
+                                              self.timeout)
+            except asyncio.TimeoutError:
+                metrics.record_single_flight("timeout")
+            except asyncio.CancelledError:
+                # Only a cancelled leader is recovered from, not our own cancellation
+                if not flight.cancelled() or asyncio.current_task().cancelling():
+                    raise
+            return await func()
+
+        flight = self.async_flights[flight_key] = loop.create_future()
+        try:
+            result = await func()
+        except Exception as error:
+            flight.set_exception(error)
+            flight.exception()  # Followers re-raise it; not logged as unretrieved
+            raise
+        else:
+            flight.set_result(result)
+        finally:
+            del self.async_flights[flight_key]
+            if not flight.done():
+                flight.cancel()
+
+        return result
+
+    def run_shared(self, key, func):
+        """Runs func unless another process already is, then shares its result."""
+        lock_key = f"{key}:flight"
+        result_key = f"{key}:flight-result"
+
+        try:
+            acquired = self.cache.add(lock_key, True, timeout=self.timeout)
+        except Exception:
+            return func()
+
+        if acquired:
+            result = None
+            try:
+                result = func()
+            finally:
+                self.publish(lock_key, result_key, result)
+            return result
+
+        # Another process leads: wait for its result, or its lock to go away
+        metrics.record_single_flight("follower")
+        deadline = time.monotonic() + self.timeout
+        try:
+            while time.monotonic() < deadline:
+                leading = self.cache.has_key(lock_key)
+                result = self.cache.get(result_key)
+                if result is not None:
+                    return result
+                if not leading:
+                    break
+                time.sleep(SHARED_POLL_INTERVAL)
+            else:
+                metrics.record_single_flight("timeout")
+        except Exception:
+            pass
+
+        return func()
+
+    def publish(self, lock_key, result_key, result):
+        """Shares a leader's result (if any) with other processes, then unlocks."""
+        try:
+            if result is not None:
+                self.cache.set(result_key, result, timeout=SHARED_RESULT_TTL)
+            self.cache.delete(lock_key)
+        except Exception:
+            pass
@@ -0,0 +1,209 @@
+"""Query suggestions from an in-memory prefix index.
+
+The /suggest view answers every keystroke of the search box, so suggestions
+never call upstream. They come from the canonical forms of queries searched
+before, ranked by how often they were searched:
+- Queries are kept in a sorted array; the queries starting with a prefix are
+  the range found by binary search
+- The top suggestions of each prefix are memoized, and a search only drops
+  the memos of its own prefixes, so repeated keystrokes are dict lookups
+- Only queries whose first page had results are recorded, and only those
+  searched by at least SUGGEST_MIN_COUNT distinct clients are suggested:
+  until then, repeat searches of a client (refreshes, page cache hits) are
+  not counted, so one-off queries of a user are never shown to others
+- At most SUGGEST_MAX_QUERIES queries are kept, dropping the least searched
+
+The index lives in each process. With SUGGEST_SNAPSHOT_PATH set, it is loaded
+from that JSON file at startup and written back every
+SUGGEST_SNAPSHOT_INTERVAL seconds and at exit, merged with the counts other
+processes wrote. Snapshots only hold queries already suggested, as the
+clients counted for the others are not kept.
+"""
+
+import atexit
+import heapq
+import json
+import os
+import tempfile
+import time
+from bisect import bisect_left, insort
+from threading import Lock
+
+from decouple import config
+
+# Suggestions returned per prefix
+SUGGEST_LIMIT = config("SUGGEST_LIMIT", default=8, cast=int)
+
+# Distinct clients searching a query before it is suggested
+SUGGEST_MIN_COUNT = config("SUGGEST_MIN_COUNT", default=2, cast=int)
+
+# Queries kept in the index
+SUGGEST_MAX_QUERIES = config("SUGGEST_MAX_QUERIES", default=20000, cast=int)
+
+# JSON file the index is loaded from and snapshotted to ("" disables it)
+SUGGEST_SNAPSHOT_PATH = config("SUGGEST_SNAPSHOT_PATH", default="")
+
+# Seconds between snapshots of the index
+SUGGEST_SNAPSHOT_INTERVAL = config("SUGGEST_SNAPSHOT_INTERVAL", default=300,
+                                   cast=int)
+
+# Memoized prefixes, beyond which the memos are cleared
+MAX_MEMOIZED_PREFIXES = 50000
+
+# Longest prefix looked up, in characters
+MAX_PREFIX_LENGTH = 100
+
+
+class SuggestionIndex:
+    """Prefix index of searched queries, ranked by search count."""
+
+    def __init__(self, limit=SUGGEST_LIMIT, min_count=SUGGEST_MIN_COUNT,
+                 max_queries=SUGGEST_MAX_QUERIES,
+                 snapshot_path=SUGGEST_SNAPSHOT_PATH,
+                 snapshot_interval=SUGGEST_SNAPSHOT_INTERVAL):
+        self.limit = limit
+        self.min_count = min_count
+        self.max_queries = max_queries
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.lock = Lock()
+        self.counts = {}
+        self.searchers = {}
+        self.queries = []
+        self.memos = {}
+        self.snapshot_at = time.monotonic()
+
+        if snapshot_path:
+            self.load(snapshot_path)
+            atexit.register(self.snapshot)
+
+    def suggest(self, prefix):
+        """Returns the most searched queries starting with prefix.
+
+        Args:
+            prefix: Canonical form of what was typed so far.
+
+        Returns:
+            List of up to limit queries, most searched first.
+        """
+        prefix = prefix[:MAX_PREFIX_LENGTH]
+        if not prefix:
+            return []
+
+        suggestions = self.memos.get(prefix)
+        if suggestions is not None:
+            return suggestions
+
+        with self.lock:
+            start = bisect_left(self.queries, prefix)
+            end = bisect_left(self.queries, prefix + "\U0010ffff", start)
+            candidates = (query for query in self.queries[start:end]
+                          if self.counts[query] >= self.min_count)
+            suggestions = heapq.nlargest(
+                self.limit, candidates,
+                key=lambda query: (self.counts[query], -len(query)))
+
+            if len(self.memos) >= MAX_MEMOIZED_PREFIXES:
+                self.memos.clear()
+            self.memos[prefix] = suggestions
+
+        return suggestions
+
+    def record(self, query, count=1, searcher=None):
+        """Counts searches of a canonical query.
+
+        Args:
+            query: Canonical query searched.
+            count: Searches to count.
+            searcher: Id of the client searching. Until the query is
+                suggested, only the first search of each client counts;
+                None counts every search (e.g. of query logs).
+        """
+        if not query or len(query) > MAX_PREFIX_LENGTH:
+            return
+
+        with self.lock:
+            if (searcher is not None
+                    and self.counts.get(query, 0) < self.min_count):
+                searchers = self.searchers.setdefault(query, set())
+                if searcher in searchers:
+                    return
+                searchers.add(searcher)
+
+            if query not in self.counts:
+                insort(self.queries, query)
+                self.counts[query] = 0
+            self.counts[query] += count
+            if self.counts[query] >= self.min_count:
+                self.searchers.pop(query, None)
+            self.forget_prefixes(query)
+
+            if len(self.queries) > self.max_queries:
+                self.evict()
+
+        if (self.snapshot_path and time.monotonic() - self.snapshot_at
+                >= self.snapshot_interval):
+            self.snapshot()
+
+    def forget_prefixes(self, query):
+        """Drops the memos of the prefixes of query. Called with the lock held."""
+        for end in range(1, len(query) + 1):
+            self.memos.pop(query[:end], None)
+
+    def evict(self):
+        """Drops the least searched tenth of the queries. Called with the lock held."""
+        keep = self.max_queries * 9 // 10
+        kept = set(heapq.nlargest(keep, self.counts, key=self.counts.get))
+        self.counts = {query: count for query, count in self.counts.items()
+                       if query in kept}
+        self.searchers = {query: searchers
+                          for query, searchers in self.searchers.items()
+                          if query in kept}
+        self.queries = [query for query in self.queries if query in kept]
+        self.memos.clear()
+
+    def load(self, path):
+        """Adds the counts of a snapshot to the index, if the file exists."""
+        try:
+            with open(path, encoding="utf-8") as snapshot_file:
+                counts = json.load(snapshot_file)
+        except (OSError, ValueError):
+            return
+
+        with self.lock:
+            for query, count in counts.items():
+                if query in self.counts:
+                    self.counts[query] = max(self.counts[query], count)
+                else:
+                    self.counts[query] = count
+            self.queries = sorted(self.counts)
+            self.memos.clear()
+            if len(self.queries) > self.max_queries:
+                self.evict()
+
+    def snapshot(self, path=None):
+        """Writes the counts of suggested queries to a JSON file, merged with
+        those already in it.
+
+        Each process adds to the counts it loaded, so merging keeps the
+        largest count of every query. The file is replaced atomically.
+        """
+        path = path or self.snapshot_path
+        self.snapshot_at = time.monotonic()
+        if not path:
+            return
+
+        self.load(path)
+        with self.lock:
+            counts = {query: count for query, count in self.counts.items()
+                      if count >= self.min_count}
+
+        try:
+            directory = os.path.dirname(os.path.abspath(path))
+            with tempfile.NamedTemporaryFile(
+                    "w", encoding="utf-8", dir=directory, suffix=".tmp",
+                    delete=False) as snapshot_file:
+                json.dump(counts, snapshot_file, ensure_ascii=False)
+            os.replace(snapshot_file.name, path)
+        except OSError:
+            pass
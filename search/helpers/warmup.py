@@ -0,0 +1,216 @@
+"""Warm-up of the search cache with popular queries.
+
+After a deploy or restart, the first users searching common queries wait for
+SerpAPI. CacheWarmer runs the first page of each popular query through
+perform_search_v2 ahead of them, filling the response and score caches:
+- Queries come from text files (one query per line) or query logs (JSON
+  lines with a "q" and an optional "count"), folded into canonical forms and
+  warmed most popular first
+- At most budget searches call SerpAPI, reserved in popularity order before
+  they are handed to a bounded thread pool, so the budget goes to the most
+  popular queries; queries whose first page is cached and fresh cost nothing
+- Warming stops as soon as SerpAPI reports running out of searches
+- Warmed queries are appended to a state file, so an interrupted warm-up
+  resumes where it stopped; entries older than SEARCH_CACHE_TTL are warmed
+  again, and calls spent by earlier runs count against the budget
+
+The cache has to be shared with the web processes (e.g. Redis, see
+CACHE_BACKEND) for them to see the warmed pages.
+"""
+
+import json
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
+
+from . import search
+from .bulk import open_archive
+from .response_cache import SearchResponseCache
+
+# Default SerpAPI calls a warm-up may make
+DEFAULT_BUDGET = 100
+
+# Default threads running searches
+DEFAULT_WORKERS = 4
+
+# Searches submitted ahead per thread
+SEARCHES_IN_FLIGHT_PER_WORKER = 2
+
+
+def read_queries(paths):
+    """Reads popular queries, counting them per canonical form.
+
+    Args:
+        paths: Text files or JSONL query logs ('.gz' is decompressed, '-'
+            reads stdin).
+
+    Returns:
+        List of canonical queries, most popular first (ties in file order).
+    """
+    counts = {}
+    for path in paths:
+        with open_archive(path) as queries_file:
+            for line in queries_file:
+                query, count = line.strip(), 1
+                if query.startswith("{"):
+                    try:
+                        entry = json.loads(query)
+                        query, count = entry.get("q", ""), entry.get("count", 1)
+                    except (ValueError, AttributeError):
+                        continue
+
+                canonical = search.QUERY_CANONICALIZER.canonical(str(query))
+                if canonical:
+                    counts[canonical] = counts.get(canonical, 0) + count
+
+    return sorted(counts, key=lambda canonical: -counts[canonical])
+
+
+def read_state(state_path, ttl):
+    """Reads the queries warmed by earlier runs within the last ttl seconds.
+
+    Returns:
+        Tuple of (set of warmed canonical queries, SerpAPI calls they spent).
+    """
+    warmed = set()
+    spent = 0
+    if not state_path:
+        return warmed, spent
+
+    try:
+        with open(state_path, encoding="utf-8") as state_file:
+            for line in state_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if time.time() - entry.get("at", 0) < ttl:
+                    warmed.add(entry["q"])
+                    spent += entry.get("spent", 0)
+    except FileNotFoundError:
+        pass
+
+    return warmed, spent
+
+
+class CacheWarmer:
+    """Warms the search cache with the first page of queries."""
+
+    def __init__(self, budget=DEFAULT_BUDGET, workers=DEFAULT_WORKERS,
+                 state_path=None):
+        self.budget = budget
+        self.workers = workers
+        self.state_path = state_path
+        self.lock = Lock()
+        self.spent = 0
+        self.stopped = False
+
+    def take_budget(self):
+        """Counts a SerpAPI call against the budget.
+
+        Returns:
+            False if the budget is spent or warming was stopped.
+        """
+        with self.lock:
+            if self.stopped or self.spent >= self.budget:
+                return False
+            self.spent += 1
+            return True
+
+    def reserve(self, query):
+        """Reserves a SerpAPI call for a canonical query, unless not needed.
+
+        Returns:
+            None if a call was reserved, else the outcome of the query:
+            "cached" (already fresh), "over_budget" or "limit_reached".
+        """
+        key = SearchResponseCache.key(query, 0)
+        if search.SEARCH_RESPONSE_CACHE.is_fresh(key):
+            return "cached"
+        if not self.take_budget():
+            return "limit_reached" if self.stopped else "over_budget"
+        return None
+
+    def warm(self, query):
+        """Warms the first page of a canonical query, its call reserved.
+
+        Returns:
+            Tuple of (query, outcome, SerpAPI calls spent). The outcome is
+            "warmed", "no_results", "failed" or "limit_reached"; the
+            reserved call is given back if warming stopped meanwhile.
+        """
+        with self.lock:
+            if self.stopped:
+                self.spent -= 1
+                return query, "limit_reached", 0
+
+        search_data = search.perform_search_v2(query, 0)
+        if search_data["limit_reached"]:
+            with self.lock:
+                self.stopped = True
+            return query, "limit_reached", 1
+        if search_data["error_occured"]:
+            return query, "failed", 1
+        if not search_data["results"].get("all"):
+            return query, "no_results", 1
+        return query, "warmed", 1
+
+    def record(self, query, spent):
+        """Appends a warmed query to the state file."""
+        if not self.state_path:
+            return
+
+        with self.lock, open(self.state_path, "a",
+                             encoding="utf-8") as state_file:
+            state_file.write(json.dumps(
+                {"q": query, "at": time.time(), "spent": spent}) + "\n")
+
+    def run(self, queries):
+        """Warms queries, most popular first.
+
+        Queries warmed by earlier runs recorded in the state file are
+        skipped, and the calls they spent are taken from the budget.
+
+        Yields:
+            (query, outcome, calls spent) tuples as searches complete,
+            beginning with the skipped queries (outcome "resumed").
+        """
+        warmed, spent = read_state(self.state_path,
+                                   search.SEARCH_RESPONSE_CACHE.ttl)
+        with self.lock:
+            self.spent = spent
+
+        pending = deque()
+        for query in queries:
+            if query in warmed:
+                yield query, "resumed", 0
+            else:
+                pending.append(query)
+
+        with ThreadPoolExecutor(max_workers=self.workers,
+                                thread_name_prefix="cache-warmup") as executor:
+            in_flight = set()
+            while pending or in_flight:
+                while (pending and not self.stopped and len(in_flight) <
+                       self.workers * SEARCHES_IN_FLIGHT_PER_WORKER):
+                    query = pending.popleft()
+                    outcome = self.reserve(query)
+                    if outcome is None:
+                        in_flight.add(executor.submit(self.warm, query))
+                        continue
+                    if outcome == "cached":
+                        self.record(query, 0)
+                    yield query, outcome, 0
+                if not in_flight:
+                    break
+
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    query, outcome, query_spent = future.result()
+                    if outcome in ("cached", "warmed", "no_results"):
+                        self.record(query, query_spent)
+                    yield query, outcome, query_spent
+
+        for query in pending:
+            yield query, "limit_reached" if self.stopped else "over_budget", 0
@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...benchmarks import suite
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks the classification and search pipeline on recorded "
+            "and synthetic SerpAPI results, and compares it to a baseline.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", type=int, nargs="+", default=list(suite.DEFAULT_SIZES),
+            help="Sizes of the synthetic organic_results fixtures.")
+        parser.add_argument(
+            "--rule-scales", type=int, nargs="+",
+            default=list(suite.DEFAULT_RULE_SCALES),
+            help="Rule set sizes, as multiples of SEARCH_CATEGORY_DATA.")
+        parser.add_argument(
+            "--runs", type=int, default=20,
+            help="Timed runs per measurement.")
+        parser.add_argument(
+            "--stages", nargs="+",
+            help="Only run these stages (e.g. 'classify cold').")
+        parser.add_argument(
+            "--recorded", default=suite.RECORDED_RESPONSE,
+            help="Recorded SerpAPI response to benchmark ('' to skip).")
+        parser.add_argument(
+            "--baseline", default=suite.BASELINE_PATH,
+            help="Baseline file to compare against.")
+        parser.add_argument(
+            "--save-baseline", nargs="?", const="", metavar="PATH",
+            help="Store this run as the new baseline, in PATH (default: "
+                 "the --baseline file).")
+        parser.add_argument(
+            "--max-regression", type=float,
+            help="Fail if any p50 latency grows by more than this percent.")
+
+    def handle(self, *args, **options):
+        baseline = suite.load_baseline(options["baseline"])
+        regressions = []
+        results = []
+
+        self.stdout.write(
+            f"{'stage':<18} {'source':<9} {'items':>6} {'cats':>4} "
+            f"{'items/s':>11} {'p50 ms':>9} {'p99 ms':>9} {'peak KiB':>9} "
+            f"{'vs base':>8}")
+
+        for result in suite.run_benchmarks(
+                sizes=options["sizes"],
+                rule_scales=options["rule_scales"],
+                runs=options["runs"],
+                recorded_path=options["recorded"],
+                stages=options["stages"]):
+            results.append(result)
+
+            change = suite.p50_change(result, baseline)
+            change_text = "-" if change is None else f"{change:+.1f}%"
+            if (change is not None and options["max_regression"] is not None
+                    and change > options["max_regression"]):
+                regressions.append(suite.result_key(result))
+
+            self.stdout.write(
+                f"{result['stage']:<18} {result['source']:<9} "
+                f"{result['size']:>6} {result['categories']:>4} "
+                f"{result['items_per_sec']:>11.0f} {result['p50_ms']:>9.3f} "
+                f"{result['p99_ms']:>9.3f} {result['peak_kib']:>9.1f} "
+                f"{change_text:>8}")
+
+        if options["save_baseline"] is not None:
+            path = options["save_baseline"] or options["baseline"]
+            suite.save_baseline(results, path)
+            self.stdout.write(f"Baseline saved to {path}")
+
+        if regressions:
+            raise CommandError(
+                "p50 latency regressed beyond the allowed "
+                f"{options['max_regression']}%: {', '.join(regressions)}")
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from ...benchmarks import serving
+
+
+class Command(BaseCommand):
+    help = ("Compares concurrent searches on the app under gunicorn (WSGI) "
+            "and uvicorn (ASGI), with SerpAPI replaced by a slow stand-in.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--searches", type=int, default=serving.DEFAULT_SEARCHES,
+            help="Searches sent to each deployment.")
+        parser.add_argument(
+            "--concurrency", type=int, default=serving.DEFAULT_CONCURRENCY,
+            help="Searches in flight at once, on both deployments.")
+        parser.add_argument(
+            "--workers", type=int, default=serving.DEFAULT_WORKERS,
+            help="Worker processes of both app servers.")
+        parser.add_argument(
+            "--threads", type=int, default=serving.DEFAULT_THREADS,
+            help="Threads per gunicorn worker.")
+        parser.add_argument(
+            "--latency", type=float, default=serving.DEFAULT_LATENCY,
+            help="Seconds the SerpAPI stand-in takes to answer.")
+        parser.add_argument(
+            "--port", type=int, default=8765,
+            help="Port of the app servers started.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'setup':<6} {'workers':>7} {'threads':>7} {'searches':>8} "
+            f"{'searches/s':>11} {'p50 ms':>9} {'p99 ms':>9} {'ok':>7}")
+
+        for result in serving.compare_deployments(
+                searches=options["searches"],
+                concurrency=options["concurrency"],
+                workers=options["workers"],
+                threads=options["threads"],
+                latency=options["latency"],
+                port=options["port"]):
+            self.stdout.write(
+                f"{result['setup']:<6} {result['workers']:>7} "
+                f"{result['threads']:>7} {result['requests']:>8} "
+                f"{result['requests_per_sec']:>11.1f} "
+                f"{result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+                f"{result['outcomes'].get('ok', 0.0):>7.1%}")
@@ -0,0 +1,64 @@
+import gzip
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...helpers import bulk
+
+
+class Command(BaseCommand):
+    help = ("Classifies archived SerpAPI responses (JSONL, optionally "
+            "gzipped) and writes the categories of every organic result "
+            "as JSONL.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "archives", nargs="+",
+            help="JSONL files of SerpAPI responses, one per line "
+                 "('.gz' is decompressed, '-' reads stdin).")
+        parser.add_argument(
+            "--output", "-o", default="-",
+            help="Output JSONL file ('.gz' is compressed, '-' for stdout).")
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count() or 1,
+            help="Worker processes (1 classifies in this process).")
+        parser.add_argument(
+            "--chunk-size", type=int, default=bulk.DEFAULT_CHUNK_SIZE,
+            help="SerpAPI responses classified per task.")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["chunk_size"] < 1:
+            raise CommandError("--workers and --chunk-size must be positive.")
+
+        for path in options["archives"]:
+            if path != "-" and not os.path.isfile(path):
+                raise CommandError(f"No such archive: {path}")
+
+        if options["output"] == "-":
+            output = self.stdout
+            report = self.stderr
+            self.classify(options, output, report)
+            return
+
+        opener = gzip.open if options["output"].endswith(".gz") else open
+        with opener(options["output"], "wt", encoding="utf-8") as output:
+            self.classify(options, output, self.stdout)
+
+    def classify(self, options, output, report):
+        responses = items = invalid = 0
+        start = time.perf_counter()
+
+        for chunk_responses, chunk_items, chunk_invalid in bulk.classify_archives(
+                options["archives"], output, workers=options["workers"],
+                chunk_size=options["chunk_size"]):
+            responses += chunk_responses
+            items += chunk_items
+            invalid += chunk_invalid
+
+        elapsed = time.perf_counter() - start
+        items_per_sec = items / elapsed if elapsed else 0.0
+        report.write(
+            f"Classified {items} results from {responses} responses in "
+            f"{elapsed:.1f}s ({items_per_sec:.0f} items/s), "
+            f"skipped {invalid} invalid lines.")
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+
+from ...benchmarks import load
+from .serpapi_standin import add_standin_arguments, standin_options
+
+
+class Command(BaseCommand):
+    help = ("Load tests the search page under gunicorn (or uvicorn), with "
+            "SerpAPI replaced by the local stand-in.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests", type=int, default=load.DEFAULT_REQUESTS,
+            help="Number of requests sent.")
+        parser.add_argument(
+            "--concurrency", type=int, default=load.DEFAULT_CONCURRENCY,
+            help="Requests in flight at once.")
+        parser.add_argument(
+            "--workers", type=int, default=load.DEFAULT_WORKERS,
+            help="Worker processes of the app server.")
+        parser.add_argument(
+            "--threads", type=int, default=load.DEFAULT_THREADS,
+            help="Threads per gunicorn worker.")
+        parser.add_argument(
+            "--asgi", action="store_true",
+            help="Run the app under uvicorn with ASYNC_SEARCH.")
+        parser.add_argument(
+            "--distinct", type=int, default=load.DEFAULT_DISTINCT_QUERIES,
+            help="Number of distinct queries searched.")
+        parser.add_argument(
+            "--seed", type=int, default=0,
+            help="Seed making the request mix reproducible.")
+        parser.add_argument(
+            "--port", type=int, default=8765,
+            help="Port of the app server started.")
+        parser.add_argument(
+            "--app-url",
+            help="URL of an app already running, instead of starting one.")
+        parser.add_argument(
+            "--standin-url",
+            help="SERPAPI_SEARCH_URL of a stand-in already running.")
+        add_standin_arguments(parser)
+
+    def handle(self, *args, **options):
+        result = load.run_load_test(
+            requests_count=options["requests"],
+            concurrency=options["concurrency"],
+            workers=options["workers"],
+            threads=options["threads"],
+            asgi=options["asgi"],
+            distinct=options["distinct"],
+            seed=options["seed"],
+            port=options["port"],
+            app_url=options["app_url"],
+            standin_url=options["standin_url"],
+            standin_options=standin_options(options))
+
+        self.stdout.write(
+            f"{'setup':<6} {'workers':>7} {'threads':>7} {'requests':>8} "
+            f"{'req/s':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} "
+            f"{'max ms':>9}")
+        self.stdout.write(
+            f"{result['setup']:<6} {result['workers']:>7} "
+            f"{result['threads']:>7} {result['requests']:>8} "
+            f"{result['requests_per_sec']:>8.1f} {result['p50_ms']:>9.1f} "
+            f"{result['p90_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+            f"{result['max_ms']:>9.1f}")
+        for name, share in result["outcomes"].items():
+            self.stdout.write(f"  {name:<16} {share:>6.1%}")
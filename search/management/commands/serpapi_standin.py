@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...benchmarks import standin
+
+
+def add_standin_arguments(parser):
+    """Adds the options of the SerpAPI stand-in to parser."""
+    parser.add_argument(
+        "--latency", type=float, default=standin.DEFAULT_LATENCY,
+        help="Seconds the stand-in takes to answer.")
+    parser.add_argument(
+        "--jitter", type=float, default=standin.DEFAULT_JITTER,
+        help="Seconds of random latency added on top.")
+    parser.add_argument(
+        "--rate-429", type=float, default=0.0,
+        help="Share of searches failing with 429 (out of searches).")
+    parser.add_argument(
+        "--rate-400", type=float, default=0.0,
+        help="Share of searches answered with no results.")
+    parser.add_argument(
+        "--rate-500", type=float, default=0.0,
+        help="Share of searches failing with 500.")
+    parser.add_argument(
+        "--total-results", type=int, default=standin.DEFAULT_TOTAL_RESULTS,
+        help="Results of every query, across all pages.")
+
+
+def standin_options(options):
+    """Returns the SerpApiStandin keyword arguments of parsed options."""
+    return {
+        "latency": options["latency"],
+        "jitter": options["jitter"],
+        "rate_429": options["rate_429"],
+        "rate_400": options["rate_400"],
+        "rate_500": options["rate_500"],
+        "total_results": options["total_results"],
+    }
+
+
+class Command(BaseCommand):
+    help = ("Serves recorded SerpAPI responses locally, with latency, errors "
+            "and pagination, to use as SERPAPI_SEARCH_URL.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--port", type=int, default=8001,
+            help="Port to serve on.")
+        add_standin_arguments(parser)
+
+    def handle(self, *args, **options):
+        server = standin.SerpApiStandin(port=options["port"],
+                                        **standin_options(options)).start()
+        self.stdout.write(f"SERPAPI_SEARCH_URL={server.url}")
+
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
@@ -0,0 +1,69 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...helpers import search, warmup
+
+
+class Command(BaseCommand):
+    help = ("Searches the first page of popular queries into the search "
+            "cache, within a budget of SerpAPI calls. Interrupted warm-ups "
+            "resume from the --state file.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "queries", nargs="+",
+            help="Files of queries, one per line, or JSONL query logs with "
+                 "'q' and 'count' ('.gz' is decompressed, '-' reads stdin).")
+        parser.add_argument(
+            "--budget", type=int, default=warmup.DEFAULT_BUDGET,
+            help="SerpAPI calls the warm-up may make, across resumed runs.")
+        parser.add_argument(
+            "--workers", type=int, default=warmup.DEFAULT_WORKERS,
+            help="Threads running searches.")
+        parser.add_argument(
+            "--limit", type=int, default=None,
+            help="Warm only the most popular queries.")
+        parser.add_argument(
+            "--state", default=".warm_search_cache.jsonl",
+            help="File recording warmed queries, to resume from ('' to "
+                 "start over every run).")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["budget"] < 0:
+            raise CommandError("--workers must be positive and --budget "
+                               "not negative.")
+
+        for path in options["queries"]:
+            if path != "-" and not os.path.isfile(path):
+                raise CommandError(f"No such file: {path}")
+
+        backend = settings.CACHES[search.SEARCH_RESPONSE_CACHE.alias]["BACKEND"]
+        if backend.endswith("LocMemCache"):
+            self.stderr.write(
+                "Warning: the search cache is in-process (LocMemCache), so "
+                "web processes will not see the warmed pages. Set "
+                "CACHE_BACKEND to a shared cache.")
+
+        queries = warmup.read_queries(options["queries"])[:options["limit"]]
+        warmer = warmup.CacheWarmer(budget=options["budget"],
+                                    workers=options["workers"],
+                                    state_path=options["state"] or None)
+
+        outcomes = {}
+        start = time.perf_counter()
+        for done, (query, outcome, spent) in enumerate(warmer.run(queries), 1):
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            self.stdout.write(
+                f"[{done}/{len(queries)}] {outcome:<13} {query} "
+                f"(calls: {spent}, SerpAPI calls: "
+                f"{warmer.spent}/{warmer.budget})")
+
+        elapsed = time.perf_counter() - start
+        summary = ", ".join(f"{count} {outcome}"
+                            for outcome, count in sorted(outcomes.items()))
+        self.stdout.write(
+            f"Warmed {len(queries)} queries in {elapsed:.1f}s ({summary}), "
+            f"spent {warmer.spent} of {warmer.budget} SerpAPI calls.")
@@ -0,0 +1,179 @@
+"""Middleware timing request stages for the Server-Timing header.
+
+ServerTimingMiddleware collects the timings of every stage run while a request
+is handled and adds them, with the total, to a Server-Timing header. Session
+saving and HTML minification run in middleware, so they are timed by thin
+wrappers of SessionMiddleware and HtmlMinifyMiddleware.
+
+ServerTimingMiddleware is removed from the stack when METRICS_ENABLED is off.
+
+Every middleware here supports both sync and async requests. WhiteNoise and
+django-htmlmin are sync-only, and a single sync-only middleware makes Django
+run the whole stack, async view included, in a thread under ASGI; hence
+StaticFilesMiddleware, and the MiddlewareMixin-based TimedHtmlMinifyMiddleware
+and MarkRequestMiddleware.
+
+PageCacheMiddleware serves search pages from the page cache (see
+helpers.page_cache). It sits inside the session and authentication
+middleware, to read the session theme, and outside the HTML minification, so
+pages are stored minified and hits are not minified again.
+"""
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils.cache import get_max_age
+from django.utils.deprecation import MiddlewareMixin
+from htmlmin.middleware import HtmlMinifyMiddleware
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import views
+from .helpers import metrics, search
+from .helpers.page_cache import PageCache
+
+
+class ServerTimingMiddleware:
+    """Adds the stage timings of each request to a Server-Timing header."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timings = {}
+        token = metrics.REQUEST_TIMINGS.set(timings)
+        try:
+            with metrics.stage("total"):
+                response = self.get_response(request)
+        finally:
+            metrics.REQUEST_TIMINGS.reset(token)
+
+        response["Server-Timing"] = metrics.server_timing_header(timings)
+        return response
+
+    async def __acall__(self, request):
+        timings = {}
+        token = metrics.REQUEST_TIMINGS.set(timings)
+        try:
+            with metrics.stage("total"):
+                response = await self.get_response(request)
+        finally:
+            metrics.REQUEST_TIMINGS.reset(token)
+
+        response["Server-Timing"] = metrics.server_timing_header(timings)
+        return response
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoiseMiddleware, also usable in an async middleware stack."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+class TimedSessionMiddleware(SessionMiddleware):
+    """SessionMiddleware timing how long saving the session takes."""
+
+    def process_response(self, request, response):
+        with metrics.stage("session"):
+            return super().process_response(request, response)
+
+
+class TimedHtmlMinifyMiddleware(MiddlewareMixin):
+    """HtmlMinifyMiddleware timing how long minifying the response takes."""
+
+    minifier = HtmlMinifyMiddleware()
+
+    def process_response(self, request, response):
+        with metrics.stage("minify"):
+            return self.minifier.process_response(request, response)
+
+
+class MarkRequestMiddleware(MiddlewareMixin):
+    """htmlmin's MarkRequestMiddleware, also usable in an async middleware stack."""
+
+    def process_request(self, request):
+        request._hit_htmlmin = True
+
+
+class PageCacheMiddleware(MiddlewareMixin):
+    """Serves search pages from the page cache, and stores cacheable ones."""
+
+    def page_key(self, request):
+        """Returns the page cache key of a request, or None if not cached."""
+        if (not search.PAGE_CACHE.enabled
+                or request.method not in ("GET", "HEAD")
+                or request.path_info != reverse("search:search")
+                or "theme" in request.GET
+                or request.user.is_authenticated):
+            return None
+
+        query, page_index = views.search_params(request)
+        canonical_query = search.QUERY_CANONICALIZER.canonicalize(query)
+        if not canonical_query:
+            return None
+
+        request._page_cache_query = (canonical_query, page_index)
+        return PageCache.key(canonical_query, query, page_index,
+                             request.session.get("theme"))
+
+    def process_request(self, request):
+        key = self.page_key(request)
+        if key is None:
+            return None
+
+        entry = search.PAGE_CACHE.get(key)
+        if entry is None:
+            request._page_cache_key = key
+            return None
+
+        # Still a search of the query, for suggestions
+        if entry["record_suggestion"]:
+            search.SUGGESTION_INDEX.record(request._page_cache_query[0],
+                                           searcher=views.searcher(request))
+
+        response = HttpResponse(entry["content"])
+        for header, value in entry["headers"].items():
+            response[header] = value
+        return views.cache_headers(request, request._page_cache_query[0],
+                                   response)
+
+    def process_response(self, request, response):
+        key = getattr(request, "_page_cache_key", None)
+        if (key is not None and response.status_code == 200
+                and not response.streaming and get_max_age(response)):
+            canonical_query, page_index = request._page_cache_query
+            search.PAGE_CACHE.set(
+                key, response, record_suggestion=page_index == 0 and (
+                    canonical_query in search.SUGGESTION_INDEX.counts))
+        return response
@@ -1,6 +1,53 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from threading import Event
+from unittest import mock
+
+import httplib2
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from googleapiclient.errors import HttpError
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.test import (AsyncRequestFactory, RequestFactory, SimpleTestCase,
+                         TestCase, override_settings)
+from htmlmin.minify import html_minify
+from rapidfuzz import fuzz
 from django.conf import settings
 
+from . import views
+from .benchmarks import suite
+from .benchmarks.standin import SerpApiStandin
+from .helpers import constants, metrics, quota, search
+from .helpers.deep_fill import DeepFiller
+from .helpers.domains import configured_domains, link_domain
+from .helpers.matcher import CategoryMatcher, PatternIndex, could_fuzzy_match
+from .helpers.prefetch import Prefetcher
+from .helpers.providers import (FunctionProvider, MultiProviderSearch,
+                                cse_error_code, cse_response)
+from .helpers.queries import QueryCanonicalizer
+from .helpers.quota import CircuitBreaker, TokenBucket
+from .helpers.response_cache import SearchResponseCache
+from .helpers.results import SearchResult
+from .helpers.score_cache import ScoreCache, rules_version
+from .helpers.serpapi_client import (AsyncSerpApiClient, NoResultsError,
+                                     QuotaExceededError, SerpApiClient,
+                                     TransientError)
+from .helpers.single_flight import SingleFlight
+from .helpers.suggest import SuggestionIndex
+from .helpers.warmup import CacheWarmer
+from .helpers.search import classify_search, score_search_item
+
 # Create your tests here.
 
 
@@ -31,3 +78,1336 @@ class ProductionTestCase(TestCase):
 
         self.assertTrue(settings.SECURE_SSL_REDIRECT,
                         "SSL redirect setting wrong")
+
+
+class CategoryMatcherTestCase(SimpleTestCase):
+
+    search_items = [
+        {"link": "https://www.youtube.com/watch?v=1",
+         "title": "Django ORM tutorial", "snippet": "Learn the ORM"},
+        {"link": "https://docs.djangoproject.com/en/5.0/topics/db/",
+         "title": "Making queries | Django documentation",
+         "snippet": "API reference for the ORM"},
+        {"link": "https://example.com/blog/django-orm",
+         "title": "Django ORM explained", "snippet": "A blog post"},
+        {"link": "https://example.com/courses/django",
+         "title": "Django course", "snippet": "A blog about training"},
+        {"link": "https://example.com/", "title": "", "snippet": ""},
+        {"link": "https://example.com/play", "title": "Regex playgrond",
+         "snippet": "Tutorail"},
+    ]
+
+    def test_scores_match_reference_scoring(self):
+        """ ensures the compiled matcher scores items like score_search_item """
+
+        matcher = CategoryMatcher(constants.SEARCH_CATEGORY_DATA)
+
+        for search_item in self.search_items:
+            scores = matcher.score_item(search_item)
+            for name, category_config in constants.SEARCH_CATEGORY_DATA.items():
+                self.assertEqual(
+                    scores[name],
+                    score_search_item(search_item, category_config),
+                    f"score mismatch for {name!r} on {search_item['link']}")
+
+    def test_classification_respects_exclusions(self):
+        """ ensures excluded categories are not assigned to the same item """
+
+        results = classify_search(
+            self.search_items, constants.SEARCH_CATEGORY_DATA)
+
+        self.assertEqual(list(results), ["all", *constants.SEARCH_CATEGORY_DATA])
+        self.assertIn(self.search_items[3], results["courses"])
+        self.assertNotIn(self.search_items[3], results["blog articles"])
+        self.assertIn(self.search_items[2], results["blog articles"])
+
+    def test_exclusions_do_not_depend_on_category_order(self):
+        """ ensures categories are evaluated after the categories excluding them """
+
+        reversed_data = dict(reversed(constants.SEARCH_CATEGORY_DATA.items()))
+
+        results = classify_search(
+            self.search_items, constants.SEARCH_CATEGORY_DATA)
+        reversed_results = classify_search(self.search_items, reversed_data)
+
+        self.assertEqual(list(reversed_results), ["all", *reversed_data])
+        for category in constants.SEARCH_CATEGORY_DATA:
+            self.assertEqual(reversed_results[category], results[category])
+
+        cyclic_data = {
+            "first": {"keywords": ("orm",), "exclude_if_matched": ["second"]},
+            "second": {"keywords": ("django",), "exclude_if_matched": ["first"]},
+        }
+        with self.assertRaises(ValueError):
+            CategoryMatcher(cyclic_data)
+
+    def test_pattern_index_finds_overlapping_patterns(self):
+        """ ensures patterns sharing a prefix are all found in one scan """
+
+        index = PatternIndex(("api", "api reference", "Docs", "doc"))
+
+        self.assertEqual(index.find("see the api reference docs"),
+                         {"api", "api reference", "docs", "doc"})
+        self.assertEqual(index.find(""), frozenset())
+
+    def test_fuzzy_prefilter_never_skips_a_match(self):
+        """ ensures skipped fuzzy pairs could not have reached the cutoff """
+
+        keywords = ("api", "docs", "guide", "tutorial", "api reference")
+        texts = ("api", "Docs", "a guide", "tutorail", "the api reference",
+                 "Python tutorial for beginners", "api reference guide docs",
+                 "https://example.com/docs/guide", "x" * 300)
+
+        for keyword in keywords:
+            for text in texts:
+                if not could_fuzzy_match(keyword, text):
+                    self.assertFalse(
+                        fuzz.WRatio(keyword, text, score_cutoff=90),
+                        f"{keyword!r} vs {text!r} wrongly skipped")
+
+        self.assertFalse(could_fuzzy_match("api", "x" * 300))
+
+    def test_fuzzy_stats_are_counted(self):
+        """ ensures the fuzzy stage reports scored and skipped pairs """
+
+        matcher = CategoryMatcher(constants.SEARCH_CATEGORY_DATA)
+        matcher.classify(self.search_items)
+
+        self.assertGreater(matcher.fuzzy_stats["skipped"], 0)
+        self.assertEqual(
+            matcher.fuzzy_stats["pairs"],
+            matcher.fuzzy_stats["scored"] + matcher.fuzzy_stats["skipped"])
+
+
+class DomainExtractionTestCase(SimpleTestCase):
+
+    def test_link_domain(self):
+        """ ensures result links resolve to their registered domain label """
+
+        self.assertEqual(link_domain("https://docs.python.org/3/"), "python")
+        self.assertEqual(link_domain("http://user@foo.co.uk:8080/a"), "foo")
+        self.assertEqual(link_domain("youtu.be/abc"), "youtu")
+        self.assertEqual(link_domain(""), "")
+
+    def test_configured_domains(self):
+        """ ensures configured domains are resolved into a frozen set """
+
+        self.assertEqual(
+            configured_domains(("readthedocs.io", "docs.python.org")),
+            frozenset({"readthedocs", "python"}))
+
+
+class SearchResultTestCase(SimpleTestCase):
+
+    def test_from_serpapi(self):
+        """ ensures organic results are normalized once into SearchResult """
+
+        result = SearchResult.from_serpapi({
+            "position": 1,
+            "link": "https://Docs.Python.org/3/Library/re.html",
+            "title": "re — Regular Expressions",
+            "snippet": "Source code: Lib/re/",
+            "displayed_link": "https://docs.python.org › library",
+            "favicon": "https://example.com/favicon.png",
+        })
+
+        self.assertEqual(result.title, "re — Regular Expressions")
+        self.assertEqual(result.lowered_link,
+                         "https://docs.python.org/3/library/re.html")
+        self.assertEqual(result.host, "Docs.Python.org")
+        self.assertEqual(result.domain, "Python")
+        self.assertEqual(result.path, "/3/Library/re.html")
+        self.assertEqual(result.get("displayed_link"),
+                         "https://docs.python.org › library")
+        self.assertIsNone(result.get("favicon"))
+        self.assertIs(SearchResult.from_serpapi(result), result)
+
+
+class ScoreCacheTestCase(SimpleTestCase):
+
+    search_items = CategoryMatcherTestCase.search_items
+
+    def test_scores_are_reused_across_searches(self):
+        """ ensures a result already scored is served from the cache """
+
+        score_cache = ScoreCache(maxsize=100, ttl=60)
+        matcher = CategoryMatcher(
+            constants.SEARCH_CATEGORY_DATA, score_cache=score_cache)
+
+        first = matcher.classify(self.search_items)
+        second = matcher.classify(self.search_items)
+
+        self.assertEqual(first, second)
+        self.assertEqual(score_cache.stats()["misses"], len(self.search_items))
+        self.assertEqual(score_cache.stats()["hits"], len(self.search_items))
+
+    def test_rule_changes_invalidate_scores(self):
+        """ ensures scores cached under other rules are not reused """
+
+        score_cache = ScoreCache(maxsize=100, ttl=60)
+        changed_rules = {**constants.SEARCH_CATEGORY_DATA,
+                         "youtube": {"domains": ("vimeo.com",)}}
+
+        CategoryMatcher(constants.SEARCH_CATEGORY_DATA,
+                        score_cache=score_cache).classify(self.search_items)
+        results = CategoryMatcher(
+            changed_rules, score_cache=score_cache).classify(self.search_items)
+
+        self.assertEqual(score_cache.stats()["hits"], 0)
+        self.assertEqual(results["youtube"], [])
+
+    def test_default_matcher_is_rebuilt_only_when_rules_are_replaced(self):
+        """ ensures searches do not fingerprint the default rules """
+
+        matcher = search.default_category_matcher()
+        with mock.patch("search.helpers.matcher.rules_version",
+                        wraps=rules_version) as version:
+            self.assertIs(search.default_category_matcher(), matcher)
+            version.assert_not_called()
+
+            changed_rules = {**constants.SEARCH_CATEGORY_DATA,
+                             "youtube": {"domains": ("vimeo.com",)}}
+            with mock.patch.object(constants, "SEARCH_CATEGORY_DATA",
+                                   changed_rules):
+                rebuilt = search.default_category_matcher()
+            version.assert_called_once_with(changed_rules)
+
+        self.assertIsNot(rebuilt, matcher)
+        self.assertIs(rebuilt.category_configs, changed_rules)
+        self.assertIsNot(search.default_category_matcher(), rebuilt)
+
+
+class SearchResponseCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.response_cache = SearchResponseCache(ttl=60, stale_ttl=60,
+                                                  negative_ttl=60)
+
+    def test_responses_are_cached_per_normalized_query(self):
+        """ ensures results and "no results" are cached, but not errors """
+
+        upstream = mock.Mock(side_effect=[
+            {"organic_results": []}, {"error_code": 400},
+            {"error_code": 500}, {"error_code": 500},
+        ])
+
+        for query in ("Django ORM", "  django   orm ", "zzqx", "zzqx"):
+            self.response_cache.fetch(query, 0, upstream)
+        for _ in range(2):
+            self.assertEqual(
+                self.response_cache.fetch("django", 1, upstream),
+                {"error_code": 500})
+
+        self.assertEqual(upstream.call_count, 4)
+        self.assertEqual(self.response_cache.stats(),
+                         {"hit": 2, "stale": 0, "miss": 4, "hit_ratio": 2 / 6})
+
+    def test_stale_responses_are_revalidated(self):
+        """ ensures stale responses are served while refreshed in the background """
+
+        key = self.response_cache.key("django", 0)
+        cache.set(key, {"response": {"organic_results": ["old"]},
+                        "expires_at": 0})
+        upstream = mock.Mock(return_value={"organic_results": ["new"]})
+
+        self.assertEqual(self.response_cache.fetch("django", 0, upstream),
+                         {"organic_results": ["old"]})
+        future = self.response_cache.revalidations.get(key)
+        if future:
+            future.result(timeout=5)
+
+        self.assertEqual(self.response_cache.fetch("django", 0, upstream),
+                         {"organic_results": ["new"]})
+        upstream.assert_called_once_with("django", 0)
+        self.assertEqual(self.response_cache.stats()["stale"], 1)
+
+
+class QueryCanonicalizerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_queries_fold_into_canonical_forms(self):
+        """ ensures case, width, spacing and tracking params are folded """
+
+        canonicalizer = QueryCanonicalizer(strip_stopwords=False)
+        for query in ("Django ORM", "django  orm ", "DJANGO ORM",
+                      "\uff24\uff4a\uff41\uff4e\uff47\uff4f orm",
+                      "Django ORM"):
+            self.assertEqual(canonicalizer.canonicalize(query), "django orm")
+        self.assertEqual(canonicalizer.folds("django orm"), 4)
+        self.assertEqual(canonicalizer.most_folded(1), [("django orm", 4)])
+
+        self.assertEqual(
+            canonicalizer.canonical(
+                "https://docs.djangoproject.com/?v=5&utm_source=x&gclid=1"),
+            "https://docs.djangoproject.com/?v=5")
+        self.assertEqual(canonicalizer.canonical("how to use the ORM"),
+                         "how to use the orm")
+        self.assertEqual(canonicalizer.canonicalize("   "), "")
+
+        canonicalizer = QueryCanonicalizer(strip_stopwords=True)
+        self.assertEqual(canonicalizer.canonical("how to use the ORM"),
+                         "use orm")
+        self.assertEqual(canonicalizer.canonical("How To"), "how to")
+
+    def test_searches_use_the_canonical_query(self):
+        """ ensures query variants share one upstream call but echo the typed query """
+
+        call_serpapi = mock.Mock(return_value={
+            "organic_results": [{"link": "https://docs.djangoproject.com/",
+                                 "title": "Django"}],
+            "pagination": {"next": True, "previous": False},
+        })
+        with mock.patch.object(search, "call_serpapi", call_serpapi):
+            first = search.perform_search_v2("Django ORM", 0)
+            second = search.perform_search_v2("  django   ORM ", 0)
+
+        call_serpapi.assert_called_once_with("django orm", 0)
+        self.assertEqual(first["results"], second["results"])
+        self.assertEqual(first["next_page_url"], "?q=Django ORM&page=1")
+
+
+class SingleFlightTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def coalesce(self, flights, followers=4):
+        """Runs a blocked leader on flights[0] and followers on every flight."""
+        release = Event()
+        upstream = mock.Mock(
+            side_effect=lambda: release.wait(5) and {"organic_results": []})
+
+        with ThreadPoolExecutor(max_workers=followers + 1) as executor, \
+                mock.patch.object(metrics, "record_single_flight") as record:
+            leader = executor.submit(flights[0].do, "django", upstream)
+            while not upstream.called:
+                release.wait(0.01)
+            waiting = [
+                executor.submit(flights[index % len(flights)].do, "django",
+                                upstream)
+                for index in range(followers)
+            ]
+            while record.call_count < followers:
+                release.wait(0.01)
+            release.set()
+            results = [leader.result()] + [future.result()
+                                           for future in waiting]
+
+        return upstream, results
+
+    def test_identical_calls_share_one_upstream_call(self):
+        """ ensures concurrent identical calls in a process are coalesced """
+
+        upstream, results = self.coalesce([SingleFlight(timeout=5)])
+
+        upstream.assert_called_once()
+        self.assertEqual(results, [{"organic_results": []}] * 5)
+
+    def test_identical_calls_are_shared_across_processes(self):
+        """ ensures calls are coalesced through the cache when shared """
+
+        upstream, results = self.coalesce([
+            SingleFlight(timeout=5, shared=True),
+            SingleFlight(timeout=5, shared=True),
+        ])
+
+        upstream.assert_called_once()
+        self.assertEqual(results, [{"organic_results": []}] * 5)
+
+
+class PrefetchTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_next_page_is_prefetched_within_budget(self):
+        """ ensures next pages are prefetched into the cache until the budget is spent """
+
+        prefetcher = Prefetcher(enabled=True, workers=1, hourly_budget=1)
+        api_response = {"organic_results": [], "pagination": {"next": "next"}}
+
+        with mock.patch.object(search, "PREFETCHER", prefetcher), \
+                mock.patch.object(search, "call_serpapi",
+                                  return_value=api_response) as call_serpapi:
+            for page_index in (0, 1):
+                search.perform_search_v2("django prefetch", page_index)
+                for future in list(prefetcher.tasks.values()):
+                    future.result(timeout=5)
+
+        self.assertEqual(call_serpapi.call_args_list,
+                         [mock.call("django prefetch", 0),
+                          mock.call("django prefetch", 1)])
+
+    def test_prefetching_backs_off_after_rate_limit(self):
+        """ ensures nothing is prefetched after SerpAPI runs out of searches """
+
+        prefetcher = Prefetcher(enabled=True, workers=1)
+        prefetcher.back_off()
+
+        self.assertFalse(prefetcher.schedule("key", mock.Mock()))
+        self.assertFalse(Prefetcher(enabled=False).schedule("key", mock.Mock()))
+
+
+class SerpApiClientTestCase(SimpleTestCase):
+
+    def client_for(self, *outcomes):
+        """Returns a client whose session answers with outcomes in turn."""
+        responses = []
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                responses.append(outcome)
+            else:
+                status_code, body = outcome
+                responses.append(mock.Mock(status_code=status_code,
+                                           content=json.dumps(body).encode()))
+
+        session = mock.Mock(get=mock.Mock(side_effect=responses))
+        return SerpApiClient(max_retries=2, retry_backoff=0, session=session)
+
+    def test_transient_failures_are_retried(self):
+        """ ensures timeouts and server errors are retried until a response """
+
+        client = self.client_for(requests.Timeout("read timed out"),
+                                 (503, {}), (200, {"organic_results": []}))
+
+        self.assertEqual(client.search({"q": "django"}),
+                         {"organic_results": [],
+                          "pagination": {"next": False, "previous": False}})
+        self.assertEqual(client.session.get.call_count, 3)
+        self.assertEqual(client.session.get.call_args.kwargs["timeout"],
+                         client.timeout)
+
+        client = self.client_for(*[requests.ConnectionError("refused")] * 3)
+        with self.assertRaises(TransientError):
+            client.search({"q": "django"})
+
+    def test_errors_are_mapped_without_retrying(self):
+        """ ensures quota and empty-result errors keep their error codes """
+
+        client = self.client_for(
+            (429, {"error": "Your account has run out of searches."}))
+        with self.assertRaises(QuotaExceededError) as raised:
+            client.search({"q": "django"})
+        self.assertEqual(raised.exception.error_code, 429)
+        self.assertEqual(client.session.get.call_count, 1)
+
+        client = self.client_for((200, {"error": "No results."}))
+        with self.assertRaises(NoResultsError) as raised:
+            client.search({"q": "django"})
+        self.assertEqual(raised.exception.error_code, 400)
+
+        with mock.patch.object(search, "SERPAPI_CLIENT",
+                               self.client_for((401, {"error": "Invalid key"}))):
+            self.assertEqual(search.call_serpapi("django", 0),
+                             {"error_code": 500})
+
+    def test_responses_are_pruned_to_the_fields_used(self):
+        """ ensures only organic result fields and page flags are kept """
+
+        api_response = suite.load_response()
+        client = self.client_for((200, api_response))
+        pruned = client.search({"q": "django orm"})
+
+        self.assertEqual(set(pruned), {"organic_results", "pagination"})
+        self.assertEqual(pruned["pagination"],
+                         {"next": True, "previous": False})
+        self.assertEqual(
+            [SearchResult.from_serpapi(organic_result)
+             for organic_result in pruned["organic_results"]],
+            [SearchResult.from_serpapi(organic_result)
+             for organic_result in api_response["organic_results"]])
+        self.assertLessEqual(
+            set().union(*pruned["organic_results"]),
+            {"position", "link", "title", "snippet", "displayed_link"})
+
+    async def test_async_client_retries_transient_failures(self):
+        """ ensures the async client retries server errors like the sync one """
+
+        statuses = iter((503, 200, 503, 503, 503))
+        transport = httpx.MockTransport(lambda request: httpx.Response(
+            next(statuses), json={"organic_results": []}))
+        client = AsyncSerpApiClient(retry_backoff=0, transport=transport)
+
+        self.assertEqual(await client.search({"q": "django"}),
+                         {"organic_results": [],
+                          "pagination": {"next": False, "previous": False}})
+        with self.assertRaises(TransientError):
+            await client.search({"q": "django"})
+
+    def test_standin_replays_responses_with_errors(self):
+        """ ensures the SerpAPI stand-in pages results and fails like SerpAPI """
+
+        with SerpApiStandin(latency=0, jitter=0, total_results=15) as standin:
+            client = SerpApiClient(max_retries=0, url=standin.url)
+
+            first = client.search({"q": "django", "start": 0})
+            second = client.search({"q": "django", "start": 10})
+            self.assertEqual(len(first["organic_results"]), 10)
+            self.assertEqual(len(second["organic_results"]), 5)
+            self.assertTrue(first["pagination"]["next"])
+            self.assertFalse(second["pagination"]["next"])
+            self.assertTrue(second["pagination"]["previous"])
+            self.assertFalse(
+                {result["link"] for result in first["organic_results"]} &
+                {result["link"] for result in second["organic_results"]})
+            with self.assertRaises(NoResultsError):
+                client.search({"q": "django", "start": 20})
+
+            standin.rate_429 = 1
+            with self.assertRaises(QuotaExceededError):
+                client.search({"q": "django"})
+            standin.rate_429, standin.rate_400 = 0, 1
+            with self.assertRaises(NoResultsError):
+                client.search({"q": "django"})
+            standin.rate_400, standin.rate_500 = 0, 1
+            with self.assertRaises(TransientError):
+                client.search({"q": "django"})
+
+
+@override_settings(COMPRESS_ENABLED=False, COMPRESS_OFFLINE=False)
+class AsyncSearchTestCase(TestCase):
+
+    api_response = {
+        "organic_results": [
+            {"link": "https://www.youtube.com/watch?v=1",
+             "title": "Django ORM tutorial", "snippet": "Learn the ORM"},
+        ],
+        "pagination": {"current": 1, "next": "next"},
+    }
+
+    def setUp(self):
+        cache.clear()
+
+    async def call_serpapi_async(self, search_query, page_index):
+        await asyncio.sleep(0.05)
+        return self.api_response
+
+    async def test_async_search_matches_sync_search(self):
+        """ ensures the async path classifies like perform_search_v2 and coalesces calls """
+
+        upstream = mock.AsyncMock(side_effect=self.call_serpapi_async)
+        with mock.patch.object(search, "call_serpapi_async", upstream):
+            async_data = await asyncio.gather(*(
+                search.perform_search_async("django orm", 0)
+                for _ in range(3)))
+
+        with mock.patch.object(search, "call_serpapi",
+                               return_value=self.api_response), \
+                mock.patch.object(search.SEARCH_RESPONSE_CACHE, "ttl", 0):
+            sync_data = search.perform_search_v2("django orm", 0)
+
+        upstream.assert_awaited_once()
+        self.assertEqual(async_data, [sync_data] * 3)
+
+    async def test_async_view(self):
+        """ ensures the async view renders search results """
+
+        request = AsyncRequestFactory().get("/", {"q": "django orm"})
+        request.session = SessionStore()
+        request.user = AnonymousUser()
+
+        with mock.patch.object(search, "call_serpapi_async",
+                               self.call_serpapi_async):
+            response = await views.index_async(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Django ORM tutorial", response.content.decode())
+
+    def test_asgi_stack_is_not_adapted(self):
+        """ ensures every middleware of the settings runs natively under ASGI """
+
+        self.assertNotIn("whitenoise.middleware.WhiteNoiseMiddleware",
+                         settings.MIDDLEWARE)
+        with override_settings(DEBUG=True), \
+                mock.patch.object(metrics, "METRICS_ENABLED", True), \
+                self.assertNoLogs("django.request", "DEBUG"):
+            ASGIHandler()
+
+
+class MultiProviderSearchTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def provider(self, name, api_response, delay=0):
+        def search(query, page_index):
+            Event().wait(delay)
+            return api_response
+        return FunctionProvider(name, search)
+
+    def response(self, *links):
+        return {"organic_results": [{"link": link, "title": link}
+                                    for link in links],
+                "pagination": {"next": "next"}}
+
+    def test_hedged_search_takes_first_good_answer(self):
+        """ ensures slow or failing providers are hedged to the next one """
+
+        slow = MultiProviderSearch([
+            self.provider("serpapi", self.response("https://a.com"), delay=2),
+            self.provider("google_cse", self.response("https://b.com")),
+        ], hedge_delay=0.05)
+        failing = MultiProviderSearch([
+            self.provider("serpapi", {"error_code": 429}),
+            self.provider("google_cse", self.response("https://b.com")),
+        ], hedge_delay=5)
+        late = MultiProviderSearch([
+            self.provider("late", self.response("https://a.com"), delay=2),
+        ] * 2, strategy="race", deadline=0.05)
+
+        self.assertEqual(slow.search("django", 0), self.response("https://b.com"))
+        self.assertEqual(failing.search("django", 0),
+                         self.response("https://b.com"))
+        self.assertEqual(late.search("django", 0), {"error_code": 500})
+
+    def test_merged_search_dedupes_results(self):
+        """ ensures merged results are interleaved by rank without duplicates """
+
+        merged = MultiProviderSearch([
+            self.provider("serpapi", self.response(
+                "https://a.com/x", "https://www.b.com/y/")),
+            self.provider("google_cse", cse_response({"items": [
+                {"link": "https://b.com/y", "title": "y"},
+                {"link": "https://c.com", "title": "c"},
+            ]}, 0)),
+        ], strategy="merge").search("django", 0)
+
+        self.assertEqual(
+            [(result["position"], result["link"])
+             for result in merged["organic_results"]],
+            [(1, "https://a.com/x"), (2, "https://b.com/y"),
+             (3, "https://c.com")])
+        self.assertEqual(merged["pagination"]["next"], "next")
+        self.assertEqual(cse_response({"items": []}, 0), {"error_code": 400})
+
+    def test_stalled_provider_fails_fast_once_saturated(self):
+        """ ensures searches do not queue behind a provider's stalled calls """
+
+        stalled = Event()
+
+        def stalled_search(query, page_index):
+            stalled.wait(5)
+            return self.response("https://a.com")
+
+        providers = MultiProviderSearch([
+            FunctionProvider("serpapi", stalled_search),
+            self.provider("google_cse", self.response("https://b.com")),
+        ], strategy="race", deadline=0.05, workers=2)
+        try:
+            self.assertEqual(providers.search("django", 0),
+                             self.response("https://b.com"))
+            start = time.monotonic()
+            hedged = providers.first_answer("flask", 0, hedged=True)
+            self.assertLess(time.monotonic() - start, 0.5)
+        finally:
+            stalled.set()
+
+        self.assertEqual(providers.max_in_flight, 1)
+        self.assertEqual(hedged, self.response("https://b.com"))
+
+    def test_cse_quota_errors_are_rate_limits(self):
+        """ ensures Custom Search quota 403s are handled as running out of searches """
+
+        def http_error(status, reason):
+            content = json.dumps({"error": {
+                "code": status, "message": "Quota exceeded",
+                "errors": [{"domain": "usageLimits", "reason": reason}]}})
+            return HttpError(httplib2.Response({"status": status}),
+                             content.encode())
+
+        self.assertEqual(cse_error_code(http_error(403, "dailyLimitExceeded")),
+                         429)
+        self.assertEqual(cse_error_code(http_error(403, "rateLimitExceeded")),
+                         429)
+        self.assertEqual(cse_error_code(http_error(429, "rateLimitExceeded")),
+                         429)
+        self.assertEqual(cse_error_code(http_error(403, "forbidden")), 500)
+        self.assertEqual(cse_error_code(http_error(500, "backendError")), 500)
+
+
+class QuotaTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_token_bucket_allows_bursts_up_to_the_rate(self):
+        """ ensures searches beyond the burst wait for tokens to be generated """
+
+        bucket = TokenBucket("test", hourly_limit=3600, burst=2)
+        now = time.time()
+
+        with mock.patch.object(quota.time, "time", return_value=now):
+            self.assertEqual([bucket.take() for _ in range(3)],
+                             [True, True, False])
+        with mock.patch.object(quota.time, "time", return_value=now + 1):
+            self.assertEqual([bucket.take() for _ in range(2)], [True, False])
+        with mock.patch.object(quota.time, "time", return_value=now + 3600):
+            self.assertEqual([bucket.take() for _ in range(3)],
+                             [True, True, False])
+
+    def test_circuit_breaker_fails_fast_then_probes(self):
+        """ ensures an open breaker fails fast until a probe succeeds """
+
+        breaker = CircuitBreaker("test", failure_threshold=2,
+                                 error_cooldown=30, quota_cooldown=600)
+
+        breaker.record(500)
+        self.assertIsNone(breaker.rejection())
+        breaker.record(500)
+        self.assertEqual(breaker.rejection(), 500)
+
+        with mock.patch.object(quota.time, "time",
+                               return_value=time.time() + 60):
+            self.assertIsNone(breaker.rejection())
+            self.assertEqual(breaker.rejection(), 500)
+            breaker.record(None)
+            self.assertIsNone(breaker.rejection())
+
+        breaker.record(429)
+        self.assertEqual(breaker.rejection(), 429)
+
+    def test_search_fails_fast_but_serves_cached_results(self):
+        """ ensures searches fail fast after a 429 while cached results are served """
+
+        api_response = {"organic_results": [
+            {"link": "https://github.com/django/django", "title": "django"}]}
+
+        metrics.REGISTRY.clear()
+        with mock.patch.object(metrics, "METRICS_ENABLED", True), \
+                mock.patch.object(search.PREFETCHER, "back_off") as back_off:
+            with mock.patch.object(search, "call_serpapi",
+                                   return_value=api_response):
+                search.perform_search_v2("django cached", 0)
+            with mock.patch.object(search, "call_serpapi",
+                                   return_value={"error_code": 429}):
+                self.assertTrue(search.perform_search_v2(
+                    "django quota", 0)["limit_reached"])
+            with mock.patch.object(search, "call_serpapi") as call_serpapi:
+                failed_fast = search.perform_search_v2("django other", 0)
+                cached = search.perform_search_v2("django cached", 0)
+            exported = metrics.REGISTRY.render()
+
+        call_serpapi.assert_not_called()
+        self.assertTrue(failed_fast["limit_reached"])
+        self.assertFalse(cached["limit_reached"])
+        self.assertTrue(cached["results"]["github"])
+
+        # Only the 429 SerpAPI answered counts, not the one failed fast
+        back_off.assert_called_once_with()
+        self.assertIn("devxplore_serpapi_requests_total 2", exported)
+        self.assertIn('devxplore_serpapi_errors_total{code="429"} 1', exported)
+
+
+class DeepFillTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_sparse_tabs_are_filled_from_following_windows(self):
+        """ ensures sparse tabs get results of following windows until filled """
+
+        def window(start):
+            return {"organic_results": [
+                {"link": f"https://github.com/django/{start}",
+                 "title": f"django {start}"},
+                {"link": f"https://www.youtube.com/watch?v={start}",
+                 "title": f"Django tutorial {start}"},
+            ], "pagination": {"next": "next"}}
+
+        filler = DeepFiller(enabled=True, min_items=2, max_pages=3,
+                            hourly_budget=3)
+        with mock.patch.object(search, "DEEP_FILLER", filler), \
+                mock.patch.object(search, "call_serpapi",
+                                  side_effect=lambda query, start: window(start)
+                                  ) as call_serpapi:
+            data = search.perform_search_v2("django deep fill", 0)
+
+        self.assertEqual(
+            [search_item.link for search_item in data["results"]["github"]],
+            ["https://github.com/django/0", "https://github.com/django/10"])
+        self.assertEqual(len(data["results"]["all"]), 2)
+        pages = {call.args[1] for call in call_serpapi.call_args_list}
+        self.assertLessEqual({0, 10}, pages)
+        self.assertLessEqual(pages, {0, 10, 20, 30})
+
+        # Pages starting at a window are served from the fill
+        with mock.patch.object(search, "call_serpapi") as call_serpapi:
+            search.perform_search_v2("django deep fill", 10)
+        call_serpapi.assert_not_called()
+
+    def test_tabs_without_signal_are_not_filled(self):
+        """ ensures only tabs the page has results for are filled """
+
+        api_response = {"organic_results": [
+            {"link": f"https://github.com/django/{index}",
+             "title": f"django {index}"} for index in range(3)
+        ], "pagination": {"next": "next"}}
+
+        filler = DeepFiller(enabled=True, min_items=3, max_pages=3,
+                            hourly_budget=3)
+        with mock.patch.object(search, "DEEP_FILLER", filler), \
+                mock.patch.object(search, "call_serpapi",
+                                  return_value=api_response) as call_serpapi:
+            data = search.perform_search_v2("django orm", 0)
+
+        call_serpapi.assert_called_once()
+        self.assertEqual(data["results"]["youtube"], [])
+        self.assertEqual(filler.sparse_categories(
+            {"all": [1], "github": [1], "youtube": []}), {"github"})
+
+
+class BenchmarkCommandTestCase(SimpleTestCase):
+
+    def test_benchmark_search_runs(self):
+        """ ensures the benchmark suite runs on small fixtures """
+
+        output = StringIO()
+        call_command("benchmark_search", sizes=[10], rule_scales=[1, 2],
+                     runs=1, stages=["classify cold", "perform_search_v2"],
+                     baseline="", stdout=output)
+
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 1 + 4 + 2)
+        self.assertTrue(any(line.startswith("perform_search_v2")
+                            for line in lines))
+
+    def test_baseline_is_saved_and_compared(self):
+        """ ensures a saved baseline is compared against, and searches leave no state """
+
+        options = {"sizes": [10], "rule_scales": [1], "runs": 1,
+                   "stages": ["perform_search_v2"], "recorded": ""}
+        folds = dict(search.QUERY_CANONICALIZER.raw_queries)
+        suggestions = dict(search.SUGGESTION_INDEX.counts)
+        score_cache = search.SCORE_CACHE
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "baseline.json")
+            call_command("benchmark_search", **options, baseline="",
+                         save_baseline=path, stdout=StringIO())
+            output = StringIO()
+            call_command("benchmark_search", **options, baseline=path,
+                         stdout=output)
+            self.assertIn("perform_search_v2|synthetic|10|",
+                          "".join(suite.load_baseline(path)))
+
+        self.assertRegex(output.getvalue().splitlines()[1], r"[+-]\d+\.\d%$")
+        self.assertEqual(search.QUERY_CANONICALIZER.raw_queries, folds)
+        self.assertEqual(search.SUGGESTION_INDEX.counts, suggestions)
+        self.assertIs(search.SCORE_CACHE, score_cache)
+
+
+class ClassifyResultsCommandTestCase(SimpleTestCase):
+
+    def test_classify_results_streams_categories(self):
+        """ ensures archived responses are classified in order, in any pool size """
+
+        api_response = suite.load_response()
+        with tempfile.TemporaryDirectory() as directory:
+            archive = os.path.join(directory, "responses.jsonl.gz")
+            with gzip.open(archive, "wt", encoding="utf-8") as archive_file:
+                for _ in range(3):
+                    archive_file.write(json.dumps(api_response) + "\n")
+                archive_file.write("not json\n")
+                for malformed in ({"search_parameters": None,
+                                   "organic_results": ["not a result"]},
+                                  {"organic_results": [{"title": 1}]},
+                                  {"organic_results": 5}):
+                    archive_file.write(json.dumps(malformed) + "\n")
+                archive_file.write(json.dumps(
+                    {"search_parameters": None, "organic_results": None}) + "\n")
+
+            outputs = []
+            for workers in (1, 2):
+                output = StringIO()
+                summary = StringIO()
+                call_command("classify_results", archive, workers=workers,
+                             chunk_size=2, stdout=output, stderr=summary)
+                outputs.append(output.getvalue())
+
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertIn("skipped 4 invalid lines", summary.getvalue())
+
+        classified = [json.loads(line) for line in outputs[0].splitlines()]
+        organic_results = api_response["organic_results"]
+        self.assertEqual(len(classified), 3 * len(organic_results))
+        self.assertEqual([item["line"] for item in classified],
+                         [line for line in (1, 2, 3)
+                          for _ in organic_results])
+
+        results = classify_search(
+            [SearchResult.from_serpapi(organic_result)
+             for organic_result in organic_results],
+            constants.SEARCH_CATEGORY_DATA)
+        for item, organic_result in zip(classified, organic_results):
+            self.assertEqual(item["link"], organic_result["link"])
+            self.assertEqual(item["categories"], [
+                category for category, category_items in results.items()
+                if category != "all" and any(
+                    category_item.link == item["link"]
+                    for category_item in category_items)])
+
+
+class ApiSearchTestCase(TestCase):
+
+    api_response = {
+        "organic_results": [
+            {"link": "https://www.youtube.com/watch?v=1",
+             "title": "Django ORM tutorial", "snippet": "Learn the ORM"},
+            {"link": "https://github.com/django/django",
+             "title": "django/django", "snippet": "The Web framework"},
+        ],
+        "pagination": {"next": True, "previous": False},
+    }
+
+    def setUp(self):
+        cache.clear()
+
+    def test_results_are_served_as_json_with_etags(self):
+        """ ensures classified results are JSON, and unchanged ones answer 304 """
+
+        with mock.patch.object(search, "call_serpapi",
+                               return_value=self.api_response) as call_serpapi:
+            response = self.client.get("/api/search", {"q": "Django ORM"},
+                                       secure=True)
+            data = response.json()
+            not_modified = self.client.get(
+                "/api/search", {"q": "Django ORM"}, secure=True,
+                headers={"If-None-Match": response["ETag"]})
+            other_page = self.client.get(
+                "/api/search", {"q": "django orm", "page": 1}, secure=True,
+                headers={"If-None-Match": response["ETag"]})
+
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response.content, json.dumps(
+            data, ensure_ascii=False, separators=(",", ":")).encode())
+        self.assertEqual(data["query"], "Django ORM")
+        self.assertEqual(data["results"]["github"],
+                         [{"link": "https://github.com/django/django",
+                           "title": "django/django",
+                           "snippet": "The Web framework",
+                           "displayed_link": ""}])
+        self.assertEqual(len(data["results"]["all"]), 2)
+        self.assertTrue(data["has_next_page"])
+        self.assertFalse(data["error_occured"])
+        self.assertRegex(response["ETag"], r'^"[0-9a-f]{32}"$')
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+        self.assertEqual(not_modified["ETag"], response["ETag"])
+        self.assertEqual(other_page.status_code, 200)
+        self.assertEqual(call_serpapi.call_count, 2)
+
+        with mock.patch.object(search, "call_serpapi",
+                               return_value={"error_code": 500}):
+            failed = self.client.get("/api/search", {"q": "django failing"},
+                                     secure=True)
+        self.assertTrue(failed.json()["error_occured"])
+        self.assertEqual(failed["Cache-Control"], "no-store")
+
+    async def test_async_api_matches_sync_api(self):
+        """ ensures the async API answers like the sync one """
+
+        request = AsyncRequestFactory().get("/api/search", {"q": "django orm"})
+        with mock.patch.object(search, "call_serpapi",
+                               return_value=self.api_response), \
+                mock.patch.object(search, "call_serpapi_async",
+                                  mock.AsyncMock(return_value=self.api_response)):
+            async_response = await views.api_search_async(request)
+            sync_response = await sync_to_async(views.api_search)(
+                RequestFactory().get("/api/search", {"q": "django orm"}))
+
+        self.assertEqual(async_response.content, sync_response.content)
+        self.assertEqual(async_response["ETag"], sync_response["ETag"])
+
+
+@override_settings(COMPRESS_ENABLED=False, COMPRESS_OFFLINE=False)
+class PageCacheTestCase(TestCase):
+
+    api_response = {
+        "organic_results": [
+            {"link": "https://www.youtube.com/watch?v=1",
+             "title": "Django ORM tutorial", "snippet": "Learn the ORM"},
+        ],
+        "pagination": {"next": True, "previous": False},
+    }
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, params, api_response=None):
+        with mock.patch.object(search, "call_serpapi",
+                               return_value=api_response or self.api_response):
+            return self.client.get("/", params, secure=True)
+
+    def test_repeat_searches_are_served_from_cache(self):
+        """ ensures a cached page skips the search, classification and minification """
+
+        classify = mock.Mock(wraps=search.classify_search)
+        minify = mock.Mock(wraps=html_minify)
+        with mock.patch.object(search, "classify_search", classify), \
+                mock.patch("htmlmin.middleware.html_minify", minify):
+            first = self.search({"q": "Django ORM"})
+            with mock.patch.object(search, "call_serpapi") as call_serpapi:
+                second = self.client.get("/", {"q": "Django ORM"}, secure=True)
+
+        call_serpapi.assert_not_called()
+        self.assertEqual(classify.call_count, 1)
+        self.assertEqual(minify.call_count, 1)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        self.assertIn("Django ORM tutorial", second.content.decode())
+        for response in (first, second):
+            self.assertEqual(response["Cache-Control"],
+                             f"public, max-age={search.PAGE_CACHE.ttl}")
+            self.assertEqual(response["Vary"], "Cookie")
+            self.assertEqual(response["Content-Type"],
+                             "text/html; charset=utf-8")
+
+    def test_pages_echo_the_query_as_typed(self):
+        """ ensures queries typed differently share the search but echo their own text """
+
+        filled = self.search({"q": "Django ORM"})
+        with mock.patch.object(search, "call_serpapi") as call_serpapi:
+            retyped = self.client.get("/", {"q": "django   orm"}, secure=True)
+
+        call_serpapi.assert_not_called()
+        self.assertIn('value="Django ORM"', filled.content.decode())
+        self.assertIn('value="django   orm"', retyped.content.decode())
+        self.assertIn("?q=django   orm&amp;page=1", retyped.content.decode())
+        self.assertNotIn("?q=Django ORM", retyped.content.decode())
+
+    def test_cache_headers_follow_each_request(self):
+        """ ensures cached pages get the Cache-Control of each request """
+
+        filled = self.search({"q": "Django ORM"})
+        session = self.client.session
+        session["seen"] = True
+        session.save()
+
+        with mock.patch.object(search, "call_serpapi") as call_serpapi, \
+                mock.patch.object(views, "render") as render:
+            with_session = self.client.get("/", {"q": "Django ORM"},
+                                           secure=True)
+            self.client.cookies.clear()
+            without_session = self.client.get("/", {"q": "Django ORM"},
+                                              secure=True)
+
+        call_serpapi.assert_not_called()
+        render.assert_not_called()
+        self.assertEqual(with_session.content, filled.content)
+        self.assertEqual(without_session.content, filled.content)
+        self.assertEqual(with_session["Cache-Control"],
+                         f"private, max-age={search.PAGE_CACHE.ttl}")
+        self.assertEqual(without_session["Cache-Control"],
+                         f"public, max-age={search.PAGE_CACHE.ttl}")
+        for response in (with_session, without_session):
+            self.assertEqual(response["Vary"], "Cookie")
+
+    def test_themes_are_cached_apart(self):
+        """ ensures theme switches update the session and are never cached """
+
+        light = self.search({"q": "django orm"})
+        switch = self.search({"q": "django orm", "theme": "dark"})
+        self.assertIn("no-store", switch["Cache-Control"])
+        self.assertEqual(self.client.session["theme"], "dark")
+
+        with mock.patch.object(search, "call_serpapi",
+                               return_value=self.api_response) as call_serpapi:
+            dark = self.client.get("/", {"q": "django orm"}, secure=True)
+            dark_again = self.client.get("/", {"q": "django orm"}, secure=True)
+
+        self.assertEqual(call_serpapi.call_count, 0)
+        self.assertNotEqual(dark.content, light.content)
+        self.assertEqual(dark_again.content, dark.content)
+        self.assertIn("#222", dark.content.decode())
+        self.assertEqual(dark["Cache-Control"],
+                         f"private, max-age={search.PAGE_CACHE.ttl}")
+
+    def test_failed_searches_are_not_cached(self):
+        """ ensures error pages are neither cached nor cacheable """
+
+        failed = self.search({"q": "django failing"}, {"error_code": 500})
+        recovered = self.search({"q": "django failing"})
+
+        self.assertIn("no-store", failed["Cache-Control"])
+        self.assertIn("Django ORM tutorial", recovered.content.decode())
+
+        with mock.patch.object(search.PAGE_CACHE, "ttl", 0):
+            uncached = self.search({"q": "django uncached"})
+        self.assertNotIn("Cache-Control", uncached)
+
+
+class SuggestionIndexTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_suggestions_are_ranked_and_updated(self):
+        """ ensures prefixes return popular queries, updated as searches happen """
+
+        index = SuggestionIndex(limit=2, min_count=2)
+        for query, count in (("django orm", 5), ("django rest", 3),
+                             ("django admin", 2), ("docker", 9),
+                             ("django secret", 1)):
+            index.record(query, count)
+
+        self.assertEqual(index.suggest("dj"), ["django orm", "django rest"])
+        self.assertEqual(index.suggest("django s"), [])
+        self.assertEqual(index.suggest("x"), [])
+
+        index.record("django admin", 4)
+        self.assertEqual(index.suggest("dj"), ["django admin", "django orm"])
+        self.assertEqual(index.suggest("d"), ["docker", "django admin"])
+
+        index = SuggestionIndex(limit=5, min_count=1, max_queries=10)
+        for number in range(12):
+            index.record(f"query {number}", number + 1)
+        self.assertLessEqual(len(index.queries), 10)
+        self.assertEqual(index.suggest("query 1")[0], "query 11")
+
+    def test_snapshots_are_merged_and_reloaded(self):
+        """ ensures snapshots keep the largest counts and load at startup """
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "suggestions.json")
+            first = SuggestionIndex(min_count=1, snapshot_path=path)
+            second = SuggestionIndex(min_count=1, snapshot_path=path)
+            first.record("django orm", 3)
+            second.record("django orm", 1)
+            second.record("django rest", 2)
+            first.snapshot()
+            second.snapshot()
+
+            reloaded = SuggestionIndex(min_count=1, snapshot_path=path)
+
+        self.assertEqual(reloaded.counts, {"django orm": 3, "django rest": 2})
+        self.assertEqual(reloaded.suggest("django"),
+                         ["django orm", "django rest"])
+
+    @override_settings(COMPRESS_ENABLED=False, COMPRESS_OFFLINE=False)
+    def test_searches_feed_the_suggest_view(self):
+        """ ensures searched queries with results are suggested without upstream calls """
+
+        index = SuggestionIndex(min_count=2)
+        api_response = {"organic_results": [
+            {"link": "https://github.com/django/django", "title": "Django"},
+        ]}
+        with mock.patch.object(search, "SUGGESTION_INDEX", index), \
+                mock.patch.object(views, "SUGGESTION_INDEX", index):
+            with mock.patch.object(search, "call_serpapi",
+                                   return_value=api_response):
+                for query, searcher in (("Django ORM", "a"),
+                                        ("django orm", "b"),
+                                        ("django tips", "a"),
+                                        ("Django tips", "a")):
+                    search.perform_search_v2(query, 0, searcher)
+            with mock.patch.object(search, "call_serpapi",
+                                   return_value={"error_code": 400}):
+                for _ in range(2):
+                    search.perform_search_v2("django zzqx", 0)
+
+            with mock.patch.object(search, "call_serpapi") as call_serpapi:
+                response = self.client.get("/suggest", {"q": "DJANGO "},
+                                           secure=True)
+
+        call_serpapi.assert_not_called()
+        self.assertEqual(response.json(), {"suggestions": ["django orm"]})
+        self.assertEqual(response["Cache-Control"], "max-age=60")
+
+    @override_settings(COMPRESS_ENABLED=False, COMPRESS_OFFLINE=False)
+    def test_repeat_searches_of_a_client_are_not_suggested(self):
+        """ ensures only searches of distinct clients make a query suggested """
+
+        cache.clear()
+        index = SuggestionIndex(min_count=2)
+        api_response = {"organic_results": [
+            {"link": "https://github.com/django/django", "title": "Django"},
+        ]}
+        with mock.patch.object(search, "SUGGESTION_INDEX", index), \
+                mock.patch.object(views, "SUGGESTION_INDEX", index), \
+                mock.patch.object(search, "call_serpapi",
+                                  return_value=api_response):
+            for _ in range(3):
+                self.client.get("/", {"q": "django secret"}, secure=True,
+                                REMOTE_ADDR="10.0.0.1")
+            self.assertEqual(index.suggest("django"), [])
+
+            self.client.get("/", {"q": "django secret"}, secure=True,
+                            REMOTE_ADDR="10.0.0.1",
+                            HTTP_X_FORWARDED_FOR="10.0.0.9, 10.0.0.2")
+            self.assertEqual(index.suggest("django"), ["django secret"])
+
+        index = SuggestionIndex(min_count=2)
+        index.record("django orm", searcher="a")
+        index.record("django orm", searcher="a")
+        index.record("django rest", searcher="a")
+        index.record("django rest", searcher="b")
+        index.record("django rest", searcher="b")
+        self.assertEqual(index.counts, {"django orm": 1, "django rest": 3})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "suggestions.json")
+            index.snapshot(path)
+            with open(path, encoding="utf-8") as snapshot_file:
+                self.assertEqual(json.load(snapshot_file), {"django rest": 3})
+
+
+class WarmSearchCacheCommandTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_warm_up_spends_its_budget_and_resumes(self):
+        """ ensures popular queries are warmed within budget, and resumed """
+
+        api_response = {"organic_results": [
+            {"link": "https://github.com/django/django", "title": "Django"},
+        ], "pagination": {"next": False}}
+
+        with tempfile.TemporaryDirectory() as directory:
+            queries = os.path.join(directory, "queries.txt")
+            with open(queries, "w", encoding="utf-8") as queries_file:
+                queries_file.write("django rest\nDjango ORM\n"
+                                   '{"q": "django  orm", "count": 5}\n'
+                                   "react hooks\n\n")
+            state = os.path.join(directory, "state.jsonl")
+
+            def warm(**options):
+                output = StringIO()
+                with mock.patch.object(search, "call_serpapi",
+                                       return_value=api_response
+                                       ) as call_serpapi:
+                    call_command("warm_search_cache", queries, state=state,
+                                 workers=2, stdout=output, stderr=StringIO(),
+                                 **options)
+                return call_serpapi, output.getvalue()
+
+            call_serpapi, output = warm(budget=2)
+            self.assertEqual(
+                sorted(call.args for call in call_serpapi.call_args_list),
+                [("django orm", 0), ("django rest", 0)])
+            self.assertIn("1 over_budget, 2 warmed", output)
+            self.assertIn("over_budget   react hooks (calls: 0,", output)
+
+            call_serpapi, output = warm(budget=3)
+            call_serpapi.assert_called_once_with("react hooks", 0)
+            self.assertIn("2 resumed, 1 warmed", output)
+            self.assertIn("spent 3 of 3 SerpAPI calls", output)
+
+        with mock.patch.object(search, "call_serpapi",
+                               return_value={"error_code": 429}):
+            warmer = CacheWarmer(budget=10, workers=1)
+            outcomes = [outcome for _, outcome, _
+                        in warmer.run(["vue", "svelte", "angular"])]
+        self.assertEqual(outcomes, ["limit_reached"] * 3)
+        self.assertEqual(warmer.spent, 1)
+
+    def test_budget_goes_to_the_most_popular_queries(self):
+        """ ensures the budget is reserved in popularity order, whichever search runs first """
+
+        api_response = {"organic_results": [
+            {"link": "https://github.com/django/django", "title": "Django"},
+        ], "pagination": {"next": False}}
+        is_fresh = search.SEARCH_RESPONSE_CACHE.is_fresh
+        slow_key = SearchResponseCache.key("django orm", 0)
+
+        def slow_is_fresh(key):
+            if key == slow_key:
+                time.sleep(0.1)
+            return is_fresh(key)
+
+        with mock.patch.object(search.SEARCH_RESPONSE_CACHE, "is_fresh",
+                               side_effect=slow_is_fresh), \
+                mock.patch.object(search, "call_serpapi",
+                                  return_value=api_response) as call_serpapi:
+            warmer = CacheWarmer(budget=1, workers=2)
+            outcomes = {query: outcome for query, outcome, _ in warmer.run(
+                ["django orm", "django rest", "react hooks"])}
+
+        call_serpapi.assert_called_once_with("django orm", 0)
+        self.assertEqual(outcomes, {"django orm": "warmed",
+                                    "django rest": "over_budget",
+                                    "react hooks": "over_budget"})
+
+
+@override_settings(COMPRESS_ENABLED=False, COMPRESS_OFFLINE=False)
+class MetricsTestCase(TestCase):
+
+    api_response = {
+        "organic_results": [
+            {"link": "https://www.youtube.com/watch?v=1",
+             "title": "Django ORM tutorial", "snippet": "Learn the ORM"},
+            {"link": "https://github.com/django/django",
+             "title": "django/django", "snippet": "The Web framework"},
+        ],
+        "pagination": {"current": 1},
+    }
+
+    def setUp(self):
+        metrics.REGISTRY.clear()
+        cache.clear()
+
+    def search(self, api_response, query="django orm"):
+        with mock.patch.object(search, "call_serpapi",
+                               return_value=api_response):
+            return self.client.get("/", {"q": query}, secure=True)
+
+    def test_stage_timings_are_reported(self):
+        """ ensures every stage of a search is timed and exported """
+
+        with mock.patch.object(metrics, "METRICS_ENABLED", True), \
+                mock.patch.object(metrics, "METRICS_TOKEN", "scrape-token"):
+            response = self.search(self.api_response)
+            self.search({"error_code": 429}, query="django queryset")
+            exported = self.client.get(
+                "/metrics", secure=True,
+                headers={"Authorization": "Bearer scrape-token"})
+
+        self.assertEqual(response.status_code, 200)
+        stages = [timing.split(";")[0]
+                  for timing in response["Server-Timing"].split(", ")]
+        for stage in ("serpapi", "classify", "theme", "render", "session",
+                      "minify", "total"):
+            self.assertIn(stage, stages)
+
+        self.assertEqual(exported.status_code, 200)
+        body = exported.content.decode()
+        self.assertIn('devxplore_stage_duration_seconds_count{stage="serpapi"} 2',
+                      body)
+        self.assertIn("devxplore_serpapi_requests_total 2", body)
+        self.assertIn('devxplore_serpapi_errors_total{code="429"} 1', body)
+        self.assertIn('devxplore_category_results_total{category="youtube"} 1',
+                      body)
+
+    def test_metrics_need_the_token(self):
+        """ ensures /metrics is only served with the scrape token """
+
+        with mock.patch.object(metrics, "METRICS_ENABLED", True):
+            with mock.patch.object(metrics, "METRICS_TOKEN", ""):
+                tokenless = self.client.get(
+                    "/metrics", secure=True,
+                    headers={"Authorization": "Bearer "})
+            with mock.patch.object(metrics, "METRICS_TOKEN", "scrape-token"):
+                anonymous = self.client.get("/metrics", secure=True)
+                wrong_token = self.client.get(
+                    "/metrics", secure=True,
+                    headers={"Authorization": "Bearer other-token"})
+
+        self.assertEqual(tokenless.status_code, 403)
+        self.assertEqual(anonymous.status_code, 403)
+        self.assertEqual(wrong_token.status_code, 403)
+
+    def test_disabled_metrics(self):
+        """ ensures nothing is timed or exported while metrics are disabled """
+
+        with mock.patch.object(metrics, "METRICS_ENABLED", False):
+            response = self.search(self.api_response)
+            exported = self.client.get("/metrics", secure=True)
+
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(exported.status_code, 404)
+        self.assertIs(metrics.stage("serpapi"), metrics.NULL_TIMER)
+        self.assertEqual(metrics.REGISTRY.render(), "\n")
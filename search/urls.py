@@ -1,9 +1,16 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = 'search'
 
 urlpatterns = [
-    path("", views.index, name="search"),
+    path("", views.index_async if settings.ASYNC_SEARCH else views.index,
+         name="search"),
+    path("api/search",
+         views.api_search_async if settings.ASYNC_SEARCH else views.api_search,
+         name="api_search"),
+    path("suggest", views.suggest, name="suggest"),
     path("credits", views.credits, name="credits"),
+    path("metrics", views.prometheus_metrics, name="metrics"),
 ]
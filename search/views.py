@@ -1,13 +1,26 @@
+import hashlib
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, JsonResponse
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
 from django.shortcuts import render
+from django.utils.cache import (add_never_cache_headers,
+                                get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
 
-from .helpers.search import perform_search_v2
+from .helpers import metrics
+from .helpers.search import (PAGE_CACHE, QUERY_CANONICALIZER,
+                             SUGGESTION_INDEX, perform_search_async,
+                             perform_search_v2)
 from .helpers.theme import manage_theme
 
 # Create your views here.
 
 
-def index(request):
-    """The page where users can search"""
+def search_params(request):
+    """The query and page index requested"""
 
     page_index = None
     query = request.GET.get("q", "")
@@ -17,17 +30,153 @@ def index(request):
     except ValueError:
         page_index = 0
 
-    search_data = perform_search_v2(query, page_index)
+    return query, page_index
 
-    return render(
-        request,
-        "search/index.html",
-        {
-            "query": query,
-            **search_data,
-            **manage_theme(request, query, page_index),
+
+def searcher(request):
+    """Id of the client of a request, telling apart searchers for suggestions
+
+    A digest of the client address: behind the Heroku router, the last one
+    in X-Forwarded-For.
+    """
+
+    forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR", "")
+    address = (forwarded_for.rsplit(",", 1)[-1].strip()
+               or request.META.get("REMOTE_ADDR", ""))
+    return hashlib.blake2b(address.encode(), digest_size=8).hexdigest()
+
+
+def cache_headers(request, query, response, cacheable=True):
+    """Sets the Cache-Control and Vary headers of a search page
+
+    Results pages may be cached for PAGE_CACHE_TTL seconds, by the page cache
+    and by CDNs; publicly unless the request has a session, which may hold a
+    theme. Pages that are not cacheable (errors, the search limit) and theme
+    switches are never cached. Also called on page cache hits, as the headers
+    depend on the request.
+    """
+
+    if not query or not PAGE_CACHE.enabled:
+        return response
+
+    patch_vary_headers(response, ("Cookie",))
+    if not cacheable or "theme" in request.GET:
+        add_never_cache_headers(response)
+    else:
+        visibility = ("private" if settings.SESSION_COOKIE_NAME
+                      in request.COOKIES else "public")
+        patch_cache_control(response, **{visibility: True},
+                            max_age=PAGE_CACHE.ttl)
+    return response
+
+
+def index(request):
+    """The page where users can search"""
+
+    query, page_index = search_params(request)
+    search_data = perform_search_v2(query, page_index, searcher(request))
+
+    with metrics.stage("theme"):
+        theme_data = manage_theme(request, query, page_index)
+
+    with metrics.stage("render"):
+        response = render(
+            request,
+            "search/index.html",
+            {
+                "query": query,
+                **search_data,
+                **theme_data,
+            },
+        )
+
+    return cache_headers(request, query, response, cacheable=not (
+        search_data["error_occured"] or search_data["limit_reached"]))
+
+
+async def index_async(request):
+    """The page where users can search, served without blocking (ASYNC_SEARCH)"""
+
+    query, page_index = search_params(request)
+    search_data = await perform_search_async(query, page_index,
+                                             searcher(request))
+
+    # Sessions and the auth context processor use the database synchronously
+    with metrics.stage("theme"):
+        theme_data = await sync_to_async(manage_theme)(request, query,
+                                                       page_index)
+
+    with metrics.stage("render"):
+        response = await sync_to_async(render)(
+            request,
+            "search/index.html",
+            {
+                "query": query,
+                **search_data,
+                **theme_data,
+            },
+        )
+
+    return cache_headers(request, query, response, cacheable=not (
+        search_data["error_occured"] or search_data["limit_reached"]))
+
+
+def search_api_response(request, query, page_index, search_data):
+    """Compact JSON of the search data, or a 304 if the client has it already
+
+    The strong ETag is a digest of the JSON, so unchanged results of a query
+    and page always get the same one.
+    """
+
+    payload = {
+        "query": query,
+        "page": page_index,
+        "results": {
+            category: [search_item.to_dict() for search_item in search_items]
+            for category, search_items in search_data["results"].items()
         },
-    )
+        **{key: value for key, value in search_data.items()
+           if key != "results"},
+    }
+
+    with metrics.stage("render"):
+        content = json.dumps(payload, ensure_ascii=False,
+                             separators=(",", ":")).encode()
+
+    response = HttpResponse(content, content_type="application/json")
+    response["ETag"] = f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+    # Errors are never reused; results are, once revalidated with the ETag
+    failed = search_data["error_occured"] or search_data["limit_reached"]
+    response["Cache-Control"] = "no-store" if failed else "no-cache"
+
+    return get_conditional_response(
+        request, etag=response["ETag"], response=response)
+
+
+def api_search(request):
+    """Classified results of a search as JSON, for tools and extensions"""
+
+    query, page_index = search_params(request)
+    search_data = perform_search_v2(query, page_index, searcher(request))
+    return search_api_response(request, query, page_index, search_data)
+
+
+async def api_search_async(request):
+    """Classified results of a search as JSON, served without blocking"""
+
+    query, page_index = search_params(request)
+    search_data = await perform_search_async(query, page_index,
+                                             searcher(request))
+    return search_api_response(request, query, page_index, search_data)
+
+
+def suggest(request):
+    """Searched queries starting with what was typed, most searched first"""
+
+    prefix = QUERY_CANONICALIZER.canonical(request.GET.get("q", ""))
+    response = JsonResponse({"suggestions": SUGGESTION_INDEX.suggest(prefix)})
+    response["Cache-Control"] = "max-age=60"
+    return response
 
 
 def credits(request):
@@ -213,3 +362,21 @@ def credits(request):
             **manage_theme(request, ""),
         },
     )
+
+
+def prometheus_metrics(request):
+    """Search metrics in the Prometheus text format (404 unless enabled)
+
+    Only served with the METRICS_TOKEN bearer token or to staff users (403
+    otherwise). Values are those of the worker process answering: behind
+    gunicorn or uvicorn with several workers, each scrape shows one of them,
+    so scrape every worker (e.g. one port each) or run a single one.
+    """
+
+    if not metrics.METRICS_ENABLED:
+        raise Http404
+    if not metrics.scrape_allowed(request):
+        raise PermissionDenied
+
+    return HttpResponse(metrics.REGISTRY.render(),
+                        content_type=metrics.PROMETHEUS_CONTENT_TYPE)
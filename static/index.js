@@ -39,6 +39,36 @@ function clearThemeQueryParameter() {
   window.history.replaceState({}, document.title, newUrl);
 }
 
+function setListenerToSuggestQueries(searchField) {
+  const suggestionList = document.querySelector("#search-suggestions");
+  let pendingRequest = null;
+
+  if (!searchField || !suggestionList) return;
+
+  searchField.addEventListener("input", function () {
+    const typed = searchField.value.trim();
+
+    if (pendingRequest) pendingRequest.abort();
+    if (!typed) {
+      suggestionList.replaceChildren();
+      return;
+    }
+
+    pendingRequest = new AbortController();
+
+    fetch(SUGGEST_URL + "?" + new URLSearchParams({ q: typed }), {
+      signal: pendingRequest.signal,
+    })
+      .then((response) => response.json())
+      .then((data) => {
+        suggestionList.replaceChildren(
+          ...data.suggestions.map((suggestion) => new Option(suggestion))
+        );
+      })
+      .catch(() => {});
+  });
+}
+
 document.addEventListener("DOMContentLoaded", function () {
   const searchField = document.querySelector("#search-field");
   const footer = document.querySelector("footer");
@@ -73,4 +103,5 @@ document.addEventListener("DOMContentLoaded", function () {
   }
 
   setListenerToHideFooter();
+  setListenerToSuggestQueries(searchField);
 });